@@ -64,6 +64,13 @@ reports.
 * From the MIS Report view, you can preview the report, add it to and Odoo
 dashboard, and export it to Excel.
 
+* Large reports can be exported to the xlsx format, which has no limit on
+the number of columns of the report. This requires the xlsxwriter python
+library. Several reports selected in the list of MIS Reports can be exported
+at once with the XLSX report of the Print menu, into one workbook with a sheet
+per report. They are computed in parallel, by the number of workers set in
+the mis_builder.export_workers system parameter (2 by default).
+
 Developer notes
 ===============
 
@@ -75,6 +82,48 @@ could be to add an analytic account field on mis.report.instance, or even
 on mis.report.instance.period if you want different columns to show different
 analytic accounts.
 
+For large databases, account balances by fiscal period can be maintained
+in the mis_account_period_balance table, by database triggers on move lines
+and moves (PostgreSQL 9.5 or later is required). To use it, call the enable()
+method of mis.account.period.balance; report instances using the SQL
+accounting query backend then read the table instead of the move lines for
+accounting variables without move line domain, in columns based on fiscal
+periods. The rebuild() method recomputes the table and the
+check() method compares it with the move lines. These methods are restricted
+to accounting managers, and balances are only readable by accountants of
+their companies.
+
+Computed reports can be kept in the mis_report_result_cache table, shared
+by all server workers, by setting the result cache option of the report
+instance. Results are discarded when move lines, moves, accounts, fiscal
+periods or report definitions change, and after the number of seconds set in
+the mis_builder.result_cache_ttl system parameter (3600 by default). The
+mis_builder.result_cache_size parameter limits the number of results kept
+(1000 by default). The database triggers detecting these changes are only
+installed while some report instance uses the cache. Results shared by all
+users are kept per set of groups and companies, as record rules usually
+depend on them; use a per user cache for rules depending on the user itself.
+Concurrent computations of the same report instance with a result cache are
+coalesced, across all workers, by a database advisory lock: one request
+computes the report while the others wait and read its result. Results are
+stored by the transaction of the request computing them, so they are only
+shared when it commits.
+
+Report instances marked as precomputed are computed by the "Compute MIS
+report snapshots" scheduled action, which stores a snapshot per pivot date and
+language. Reports show the latest snapshot while it is more recent than the
+snapshot validity of the instance, instead of computing the report.
+Snapshots are computed in every installed language, with the access rights of
+the user of the scheduled action, and only shown to users having the same
+groups and companies, as record rules usually depend on them.
+
+For data warehouses, the export_flat() method of mis.report.instance exports
+computed instances in csv or parquet format (parquet requires the pyarrow
+python library), with one row per instance, KPI and column holding the raw
+value, the dates of the column and the pivot date. It returns the file content
+encoded in base64. Rows are written to a temporary file while instances are
+computed, so it can be used for many instances at once.
+
 Known issues / Roadmap
 ======================
 
@@ -144,6 +193,7 @@ To contribute to this module, please visit http://odoo-community.org.
     'data': [
         'wizard/mis_builder_dashboard.xml',
         'views/mis_builder.xml',
+        'data/mis_builder_cron.xml',
         'security/ir.model.access.csv',
         'security/mis_builder_security.xml',
     ],
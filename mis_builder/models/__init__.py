@@ -24,3 +24,8 @@
 
 from . import mis_builder
 from . import aep
+from . import account
+from . import ir_report
+from . import mis_account_period_balance
+from . import mis_report_result_cache
+from . import mis_report_instance_snapshot
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    mis_builder module for Odoo, Management Information System Builder
+#    Copyright (C) 2014-2015 ACSONE SA/NV (<http://acsone.eu>)
+#
+#    This file is a part of mis_builder
+#
+#    mis_builder is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License v3 or later
+#    as published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    mis_builder is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License v3 or later for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    v3 or later along with this program.
+#    If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+from openerp.osv import orm
+from openerp import tools
+
+from .aep_chart import AccountChartIndex
+
+
+class AccountAccount(orm.Model):
+    """ Cache the resolution of account codes used by MIS reports.
+
+    Resolving account codes requires loading the chart of accounts,
+    which rarely changes, so the result is kept in an ormcache, per
+    database, user, root account and set of account codes. The cache
+    is cleared whenever accounts are created, modified or deleted;
+    other worker processes are notified through the registry cache
+    signaling.
+    """
+
+    _inherit = 'account.account'
+
+    @tools.ormcache(skiparg=2, size=64)
+    def _get_mis_account_ids_by_code(self, cr, uid, root_account_id,
+                                     account_codes):
+        """ Resolve account codes under a root account.
+
+        account_codes is a frozenset of codes, possibly containing
+        % wildcards, None meaning the root account.
+
+        Returns a dictionary {account code: frozenset(account ids)},
+        to be considered read only.
+        """
+        chart_index = AccountChartIndex(cr, uid, self.pool, root_account_id)
+        res = {}
+        for account_code in account_codes:
+            res[account_code] = frozenset(
+                chart_index.get_account_ids(account_code))
+        return res
+
+    def create(self, cr, uid, vals, context=None):
+        res = super(AccountAccount, self).create(
+            cr, uid, vals, context=context)
+        self.clear_caches()
+        return res
+
+    def write(self, cr, uid, ids, vals, context=None):
+        res = super(AccountAccount, self).write(
+            cr, uid, ids, vals, context=context)
+        self.clear_caches()
+        return res
+
+    def unlink(self, cr, uid, ids, context=None):
+        res = super(AccountAccount, self).unlink(
+            cr, uid, ids, context=context)
+        self.clear_caches()
+        return res
@@ -22,18 +22,19 @@
 #
 ##############################################################################
 
-import re
 from collections import defaultdict
+from functools import partial
 
 from openerp.exceptions import Warning
 from openerp import pooler
 from openerp.osv import expression
-from openerp.tools.safe_eval import safe_eval
 from openerp.tools.translate import _
 
-MODE_VARIATION = 'p'
-MODE_INITIAL = 'i'
-MODE_END = 'e'
+from .aep_backend import BACKENDS
+from .aep_expr import CompiledExpression, compile_expr
+from .aep_expr import MODE_VARIATION, MODE_INITIAL
+from .aep_period import PeriodTimeline
+from .parallel import run_parallel
 
 
 class AccountingExpressionProcessor(object):
@@ -57,112 +58,91 @@ class AccountingExpressionProcessor(object):
     How to use:
         * repeatedly invoke parse_expr() for each expression containing
           accounting variables as described above; this lets the processor
-          group domains and modes and accounts;
+          group domains and modes and accounts; expressions may be given
+          as strings or as CompiledExpression obtained with compile_expr(),
+          which is preferable when the same expressions are evaluated
+          many times;
         * when all expressions have been parsed, invoke done_parsing()
           to notify the processor that it can prepare to query (mainly
           search all accounts - children, consolidation - that will need to
           be queried;
         * for each period, call do_queries(), then call replace_expr() for each
           expression to replace accounting variables with their resulting value
-          for the given period.
+          for the given period;
+        * alternatively, call do_queries_multi() once with all periods,
+          then for each period call set_period() followed by replace_expr().
 
     How it works:
         * by accumulating the expressions before hand, it ensures to do the
           strict minimum number of queries to the database (for each period,
-          one query per domain and mode);
-        * it queries using the orm read_group which reduces to a query with
+          one query per domain and mode); when columns are based on fiscal
+          periods, sums are queried by fiscal period, once for all modes,
+          and initial and ending balances are carried forward from one column
+          to the next instead of summing the whole history each time;
+        * the queries are done by a backend (see aep_backend), selected
+          by name when creating the processor: the orm backend queries
+          using the orm read_group which reduces to a query with
           sum on debit and credit and group by on account_id (note: it seems
           the orm then does one query per account to fetch the account
-          name...);
-        * additionally, one query per view/consolidation account is done to
-          discover the children accounts.
+          name...), while the sql backend queries the move lines table
+          directly, with one query for all domains and periods passed
+          to do_queries_multi(), grouped by account_id and period, each
+          domain being a filtered aggregate;
+        * the queries of do_queries_multi() (one per additional move line
+          filter and mode, or per filter for fiscal periods) may run in
+          parallel on several database connections sharing the same
+          snapshot, when the processor is created with several workers;
+        * additionally, the chart of accounts is loaded once in an in-memory
+          index (see aep_chart) to resolve account codes, wildcards and
+          children of view/consolidation accounts; the resolved account
+          codes are cached on account.account until the chart changes;
+        * similarly, the fiscal periods are loaded once in a timeline
+          (see aep_period) to find the periods of each mode;
+        * expressions are compiled once, each accounting variable being
+          replaced by a slot; evaluating a compiled expression for a period
+          then only requires the values of its slots (see get_slot_values()).
     """
 
-    ACC_RE = re.compile(r"(?P<field>\bbal|\bcrd|\bdeb)"
-                        r"(?P<mode>[pise])?"
-                        r"(?P<accounts>_[a-zA-Z0-9]+|\[.*?\])"
-                        r"(?P<domain>\[.*?\])?")
-
-    def __init__(self, cursor):
+    def __init__(self, cursor, backend='orm', workers=1,
+                 period_timeline=None):
         self.pool = pooler.get_pool(cursor.dbname)
+        self._backend = BACKENDS[backend](self.pool)
+        # number of database connections used by do_queries_multi()
+        self._workers = workers
         # before done_parsing: {(domain, mode): set(account_codes)}
         # after done_parsing: {(domain, mode): list(account_ids)}
         self._map_account_ids = defaultdict(set)
         self._account_ids_by_code = defaultdict(set)
+        # after do_queries_multi:
+        # {period key: {(domain, mode): {account_id: (debit, credit)}}}
+        self._data_by_period = {}
+        # fiscal periods, loaded on first use unless
+        # a PeriodTimeline is shared by several processors
+        self._period_timeline = period_timeline
 
     def _load_account_codes(self, cr, uid, account_codes, root_account,
                             context=None):
-        account_obj = self.pool['account.account']
-        exact_codes = set()
-        like_codes = set()
-        for account_code in account_codes:
-            if account_code in self._account_ids_by_code:
-                continue
-            if account_code is None:
-                # by convention the root account is keyed as
-                # None in _account_ids_by_code, so it is consistent
-                # with what _parse_match_object returns for an
-                # empty list of account codes, ie [None]
-                exact_codes.add(root_account.code)
-            elif '%' in account_code:
-                like_codes.add(account_code)
-            else:
-                exact_codes.add(account_code)
-        account_ids = account_obj.search(
-            cr, uid,
-            [('code', 'in', list(exact_codes)),
-             ('parent_id', 'child_of', root_account.id)],
-            context=context)
-        for account in account_obj.browse(
-                cr, uid, account_ids, context=context):
-            if account.code == root_account.code:
-                code = None
-            else:
-                code = account.code
-            if account.type in ('view', 'consolidation'):
-                self._account_ids_by_code[code].update(
-                    account_obj._get_children_and_consol(
-                        cr, uid,
-                        [account.id],
-                        context=context))
-            else:
-                self._account_ids_by_code[code].add(account.id)
-        for like_code in like_codes:
-            for account_id in account_obj.\
-                    search(cr, uid,
-                           [('code', 'like', like_code),
-                            ('parent_id', 'child_of', root_account.id)],
-                           context=context):
-                account = account_obj.browse(cr, uid, account_id,
-                                             context=context)
-                if account.type in ('view', 'consolidation'):
-                    self._account_ids_by_code[like_code].update(
-                        account_obj._get_children_and_consol(
-                            cr, uid, [account.id], context=context))
-                else:
-                    self._account_ids_by_code[like_code].add(account.id)
-
-    def _parse_match_object(self, mo):
-        """Split a match object corresponding to an accounting variable
-
-        Returns field, mode, [account codes], (domain expression).
-        """
-        field, mode, account_codes, domain = mo.groups()
-        if not mode:
-            mode = MODE_VARIATION
-        elif mode == 's':
-            mode = MODE_END
-        if account_codes.startswith('_'):
-            account_codes = account_codes[1:]
-        else:
-            account_codes = account_codes[1:-1]
-        if account_codes.strip():
-            account_codes = [a.strip() for a in account_codes.split(',')]
-        else:
-            account_codes = [None]
-        domain = domain or '[]'
-        domain = tuple(safe_eval(domain))
-        return field, mode, account_codes, domain
+        account_codes = frozenset(
+            account_code for account_code in account_codes
+            if account_code not in self._account_ids_by_code)
+        if not account_codes:
+            return
+        # by convention the root account is keyed as
+        # None in _account_ids_by_code, so it is consistent
+        # with what compile_expr returns for an
+        # empty list of account codes, ie (None, )
+        account_ids_by_code = self.pool['account.account'].\
+            _get_mis_account_ids_by_code(cr, uid, root_account.id,
+                                         account_codes)
+        for account_code, account_ids in account_ids_by_code.items():
+            if account_ids:
+                self._account_ids_by_code[account_code].update(account_ids)
+
+    @staticmethod
+    def _get_compiled(expr):
+        if isinstance(expr, CompiledExpression):
+            return expr
+        return compile_expr(expr)
 
     def parse_expr(self, expr):
         """Parse an expression, extracting accounting variables.
@@ -170,18 +150,24 @@ class AccountingExpressionProcessor(object):
         Domains and accounts are extracted and stored in the map
         so when all expressions have been parsed, we know which
         account codes to query for each domain and mode.
+
+        Returns the CompiledExpression.
         """
-        for mo in self.ACC_RE.finditer(expr):
-            _, mode, account_codes, domain = self._parse_match_object(mo)
+        compiled = self._get_compiled(expr)
+        for field, mode, account_codes, domain in compiled.variables:
             key = (domain, mode)
             self._map_account_ids[key].update(account_codes)
+        return compiled
 
     def done_parsing(self, cr, uid, root_account, context=None):
         """Load account codes and replace account codes by
         account ids in map."""
+        all_account_codes = set()
+        for account_codes in self._map_account_ids.values():
+            all_account_codes.update(account_codes)
+        self._load_account_codes(cr, uid, all_account_codes, root_account,
+                                 context=context)
         for key, account_codes in self._map_account_ids.items():
-            self._load_account_codes(cr, uid, account_codes, root_account,
-                                     context=context)
             account_ids = set()
             for account_code in account_codes:
                 account_ids.update(self._account_ids_by_code[account_code])
@@ -190,7 +176,7 @@ class AccountingExpressionProcessor(object):
     @classmethod
     def has_account_var(cls, expr):
         """Test if an string contains an accounting variable."""
-        return bool(cls.ACC_RE.search(expr))
+        return bool(cls._get_compiled(expr).variables)
 
     def get_aml_domain_for_expr(self, cr, uid, expr,
                                 date_from, date_to,
@@ -204,8 +190,8 @@ class AccountingExpressionProcessor(object):
         """
         aml_domains = []
         date_domain_by_mode = {}
-        for mo in self.ACC_RE.finditer(expr):
-            field, mode, account_codes, domain = self._parse_match_object(mo)
+        for field, mode, account_codes, domain in \
+                self._get_compiled(expr).variables:
             aml_domain = list(domain)
             account_ids = set()
             for account_code in account_codes:
@@ -226,77 +212,46 @@ class AccountingExpressionProcessor(object):
         return expression.OR(aml_domains) + \
             expression.OR(date_domain_by_mode.values())
 
+    def _get_period_timeline(self, cr, uid, context=None):
+        if self._period_timeline is None:
+            self._period_timeline = PeriodTimeline(cr, uid, self.pool,
+                                                   context=context)
+        return self._period_timeline
+
     def _period_has_moves(self, cr, uid, period, context=None):
-        move_model = self.pool['account.move']
-        return bool(move_model.search(cr, uid,
-                                      [('period_id', '=', period.id)],
-                                      limit=1, context=context))
+        timeline = self._get_period_timeline(cr, uid, context=context)
+        return timeline.get_period(period.id).has_moves
 
     def _get_previous_opening_period(self, cr, uid, period, company_id,
                                      context=None):
-        period_model = self.pool['account.period']
-        period_ids = period_model.search(
-            cr, uid,
-            [('date_start', '<=', period.date_start),
-             ('special', '=', True),
-             ('company_id', '=', company_id)],
-            order="date_start desc",
-            limit=1,
-            context=context)
-        periods = period_model.browse(cr, uid, period_ids, context=context)
-        return periods and periods[0]
+        timeline = self._get_period_timeline(cr, uid, context=context)
+        return timeline.get_previous_opening_period(company_id,
+                                                    period.date_start)
 
     def _get_previous_normal_period(self, cr, uid, period, company_id,
                                     context=None):
-        period_model = self.pool['account.period']
-        period_ids = period_model.search(
-            cr, uid,
-            [('date_start', '<', period.date_start),
-             ('special', '=', False),
-             ('company_id', '=', company_id)],
-            order="date_start desc",
-            limit=1,
-            context=context)
-        periods = period_model.browse(cr, uid, period_ids, context=context)
-        return periods and periods[0]
+        timeline = self._get_period_timeline(cr, uid, context=context)
+        return timeline.get_previous_normal_period(company_id,
+                                                   period.date_start)
 
     def _get_first_normal_period(self, cr, uid, company_id, context=None):
-        period_model = self.pool['account.period']
-        period_ids = period_model.search(
-            cr, uid,
-            [('special', '=', False),
-             ('company_id', '=', company_id)],
-            order="date_start asc",
-            limit=1,
-            context=context)
-        periods = period_model.browse(cr, uid, period_ids, context=context)
-        return periods and periods[0]
+        timeline = self._get_period_timeline(cr, uid, context=context)
+        return timeline.get_first_normal_period(company_id)
 
     def _get_period_ids_between(self, cr, uid, period_from, period_to,
                                 company_id, context=None):
-        period_model = self.pool['account.period']
-        period_ids = period_model.search(
-            cr, uid,
-            [('date_start', '>=', period_from.date_start),
-             ('date_stop', '<=', period_to.date_stop),
-             ('special', '=', False),
-             ('company_id', '=', company_id)],
-            context=context)
+        timeline = self._get_period_timeline(cr, uid, context=context)
+        period_ids = timeline.get_normal_period_ids_between(
+            company_id, period_from.date_start, period_to.date_stop)
         if period_from.special:
             period_ids.append(period_from.id)
         return period_ids
 
     def _get_period_company_ids(self, cr, uid, period_from, period_to,
                                 context=None):
-        period_model = self.pool['account.period']
-        period_ids = period_model.search(
-            cr, uid,
-            [('date_start', '>=', period_from.date_start),
-             ('date_stop', '<=', period_to.date_stop),
-             ('special', '=', False)],
-            context=context)
-        periods = period_model.browse(cr, uid, period_ids, context=context)
-        return set([p.company_id.id for p in periods])
+        timeline = self._get_period_timeline(cr, uid, context=context)
+        return timeline.get_company_ids_between(period_from.date_start,
+                                                period_to.date_stop)
 
     def _get_period_ids_for_mode(self, cr, uid, period_from, period_to, mode,
                                  context=None):
@@ -377,43 +332,277 @@ class AccountingExpressionProcessor(object):
 
         This method must be executed after done_parsing().
         """
-        aml_model = self.pool['account.move.line']
-        # {(domain, mode): {account_id: (debit, credit)}}
-        self._data = defaultdict(dict)
-        domain_by_mode = {}
-        for key in self._map_account_ids:
-            domain, mode = key
-            if mode not in domain_by_mode:
-                domain_by_mode[mode] = \
-                    self.get_aml_domain_for_dates(cr, uid,
-                                                  date_from, date_to,
-                                                  period_from, period_to,
-                                                  mode, target_move,
-                                                  context=context)
-            domain = list(domain) + domain_by_mode[mode]
-            domain.append(('account_id', 'in', self._map_account_ids[key]))
-            if additional_move_line_filter:
-                domain.extend(additional_move_line_filter)
-            # fetch sum of debit/credit, grouped by account_id
-            accs = aml_model.read_group(cr, uid, domain,
-                                        ['debit', 'credit', 'account_id'],
-                                        ['account_id'],
-                                        context=context)
-            for acc in accs:
-                self._data[key][acc['account_id'][0]] = \
-                    (acc['debit'] or 0.0, acc['credit'] or 0.0)
+        self.do_queries_multi(
+            cr, uid,
+            [{'key': None,
+              'date_from': date_from,
+              'date_to': date_to,
+              'period_from': period_from,
+              'period_to': period_to,
+              'additional_move_line_filter': additional_move_line_filter,
+              }],
+            target_move,
+            context=context)
+        self.set_period(None)
 
-    def replace_expr(self, expr):
-        """Replace accounting variables in an expression by their amount.
+    def _get_period_ids_or_dates(self, cr, uid, date_from, date_to,
+                                 period_from, period_to, mode,
+                                 context=None):
+        """ Get the date filter for a period and a mode.
 
-        Returns a new expression string.
+        Returns a tuple (period_ids, dates) where one of both is None,
+        period_ids being a list of account.period ids and dates a
+        (date_from, date_to) tuple. This is the same filter as the
+        domain returned by get_aml_domain_for_dates(), without the
+        target move filter.
+        """
+        if period_from and period_to:
+            return self._get_period_ids_for_mode(
+                cr, uid,
+                period_from, period_to, mode,
+                context=context), None
+        elif mode == MODE_VARIATION:
+            return None, (date_from, date_to)
+        else:
+            raise Warning(_("Modes i and e are only applicable for "
+                            "fiscal periods"))
+
+    def do_queries_multi(self, cr, uid, periods, target_move,
+                         context=None):
+        """Query sums of debit and credit for all accounts and domains
+        used in expressions, for several periods at once.
+
+        periods is a list of dictionaries with keys key, date_from,
+        date_to, period_from, period_to and additional_move_line_filter,
+        having the same meaning as the arguments of do_queries(),
+        key being any hashable value identifying the period.
+
+        The queries are done by the backend, for all domains and periods
+        having the same additional move line filter at once. When the
+        processor has several workers, the queries run in parallel
+        (see _run_queries()).
+
+        This method must be executed after done_parsing(). It must be
+        followed by set_period() before invoking replace_expr().
+        """
+        self._data_by_period = {}
+        for p in periods:
+            self._data_by_period[p['key']] = defaultdict(dict)
+        # group periods by additional filter
+        # [(additional_move_line_filter, [period index])]
+        period_groups = []
+        for idx, p in enumerate(periods):
+            additional_move_line_filter = \
+                p.get('additional_move_line_filter') or []
+            for group_filter, idxs in period_groups:
+                if group_filter == additional_move_line_filter:
+                    idxs.append(idx)
+                    break
+            else:
+                period_groups.append((additional_move_line_filter, [idx]))
+        keys = [key for key, account_ids in self._map_account_ids.items()
+                if account_ids]
+        if not keys:
+            return
+        # {(period index, mode): (period_ids, dates)}
+        date_filters = {}
+        queries = []
+        for additional_move_line_filter, idxs in period_groups:
+            queries.extend(self._get_group_queries(
+                cr, uid, keys, periods, idxs, date_filters,
+                target_move, additional_move_line_filter,
+                context=context))
+        results = self._run_queries(cr, queries)
+        # merge results in the main thread, in a deterministic order
+        for (query, args, merge), rows in zip(queries, results):
+            merge(rows)
+
+    def _run_queries(self, cr, queries):
+        """Run backend queries, returning the list of their results.
+
+        queries is a list of (query, args, merge) tuples, where query
+        is a backend method called as query(cr, *args).
+
+        With more than one worker, queries run in parallel on cursors
+        sharing the snapshot of cr (see parallel.run_parallel()).
+        """
+        return run_parallel(
+            cr, [partial(self._run_query, query, args)
+                 for query, args, merge in queries],
+            self._workers)
+
+    @staticmethod
+    def _run_query(query, args, cr):
+        return query(cr, *args)
+
+    def _get_group_queries(self, cr, uid, keys, periods, idxs,
+                           date_filters, target_move,
+                           additional_move_line_filter, context=None):
+        """Prepare the queries of all domains and modes, for the periods
+        having the same additional move line filter.
+
+        The backend queries all domains at once. Columns based on dates
+        are queried once per mode. For columns based on fiscal periods,
+        debit and credit are queried once per fiscal period for the union
+        of all periods needed by all modes and columns, and then summed
+        for each column and mode, so the history before initial and
+        ending balances is read only once.
+
+        Returns a list of (query, args, merge) tuples, where merge
+        stores the result of query in the data of the periods.
+        """
+        queries = []
+        # {mode: [(period index, None, dates)]}
+        filters_by_dates = defaultdict(list)
+        # [(key, period index, frozenset(period_ids))]
+        filters_by_period_ids = []
+        modes = set(key[1] for key in keys)
+        for mode in modes:
+            for idx in idxs:
+                if (idx, mode) not in date_filters:
+                    p = periods[idx]
+                    date_filters[(idx, mode)] = \
+                        self._get_period_ids_or_dates(
+                            cr, uid,
+                            p['date_from'], p['date_to'],
+                            p['period_from'], p['period_to'],
+                            mode, context=context)
+                period_ids, dates = date_filters[(idx, mode)]
+                if period_ids is None:
+                    filters_by_dates[mode].append((idx, None, dates))
+                else:
+                    filters_by_period_ids.extend(
+                        (key, idx, frozenset(period_ids))
+                        for key in keys if key[1] == mode)
+        account_ids_by_key = dict((key, set(self._map_account_ids[key]))
+                                  for key in keys)
+        for mode, mode_date_filters in filters_by_dates.items():
+            mode_keys = [key for key in keys if key[1] == mode]
+            account_ids = set()
+            for key in mode_keys:
+                account_ids.update(account_ids_by_key[key])
+            queries.append((
+                self._backend.query,
+                (uid, [key[0] for key in mode_keys], list(account_ids),
+                 mode_date_filters, target_move, additional_move_line_filter,
+                 context),
+                partial(self._merge_date_sums, periods, mode_keys,
+                        account_ids_by_key)))
+        if not filters_by_period_ids:
+            return queries
+        domains = []
+        all_period_ids = set()
+        all_account_ids = set()
+        for key, idx, period_ids in filters_by_period_ids:
+            if key[0] not in domains:
+                domains.append(key[0])
+            all_period_ids.update(period_ids)
+            all_account_ids.update(account_ids_by_key[key])
+        if all_period_ids:
+            queries.append((
+                self._backend.query_by_period,
+                (uid, domains, list(all_account_ids), list(all_period_ids),
+                 target_move, additional_move_line_filter, context),
+                partial(self._merge_period_sums, periods, domains,
+                        filters_by_period_ids, account_ids_by_key)))
+        else:
+            self._merge_period_sums(periods, domains, filters_by_period_ids,
+                                    account_ids_by_key, [])
+        return queries
+
+    def _merge_date_sums(self, periods, mode_keys, account_ids_by_key,
+                         rows):
+        """Store the result of a backend query() for the keys
+        of a mode. """
+        for idx, account_id, sums in rows:
+            data_by_key = self._data_by_period[periods[idx]['key']]
+            for key, key_sums in zip(mode_keys, sums):
+                if key_sums is not None and \
+                        account_id in account_ids_by_key[key]:
+                    debit, credit = key_sums
+                    data_by_key[key][account_id] = \
+                        (debit or 0.0, credit or 0.0)
+
+    def _merge_period_sums(self, periods, domains, filters_by_period_ids,
+                           account_ids_by_key, rows):
+        """Sum the result of a backend query_by_period() for each
+        column and mode, and store it. """
+        # {domain: {period_id: {account_id: (debit, credit)}}}
+        data_by_domain = defaultdict(lambda: defaultdict(dict))
+        for period_id, account_id, sums in rows:
+            for domain, domain_sums in zip(domains, sums):
+                if domain_sums is not None:
+                    debit, credit = domain_sums
+                    data_by_domain[domain][period_id][account_id] = \
+                        (debit or 0.0, credit or 0.0)
+        for domain in domains:
+            domain_filters = [(key, idx, period_ids)
+                              for key, idx, period_ids
+                              in filters_by_period_ids
+                              if key[0] == domain]
+            sums = self._sum_period_data(
+                data_by_domain[domain],
+                set(period_ids for key, idx, period_ids in domain_filters))
+            for key, idx, period_ids in domain_filters:
+                account_ids = account_ids_by_key[key]
+                data = self._data_by_period[periods[idx]['key']][key]
+                for account_id, values in sums[period_ids].items():
+                    if account_id in account_ids:
+                        data[account_id] = values
+
+    @staticmethod
+    def _sum_period_data(data_by_period_id, period_id_sets):
+        """Sum debit and credit by account for sets of fiscal periods.
+
+        Sets are summed by increasing size, each one starting from the
+        largest set already summed that it contains: the initial balance
+        of a column is the ending balance of the previous column, and its
+        ending balance is its initial balance plus its variation.
+
+        Returns {frozenset(period_ids): {account_id: (debit, credit)}}.
+        """
+        res = {}
+        for period_ids in sorted(period_id_sets, key=len):
+            base = frozenset()
+            for summed_period_ids in res:
+                if len(summed_period_ids) > len(base) and \
+                        summed_period_ids <= period_ids:
+                    base = summed_period_ids
+            sums = dict(res.get(base, {}))
+            for period_id in period_ids - base:
+                for account_id, (debit, credit) in \
+                        data_by_period_id.get(period_id, {}).items():
+                    total_debit, total_credit = \
+                        sums.get(account_id, (0.0, 0.0))
+                    sums[account_id] = (total_debit + debit,
+                                        total_credit + credit)
+            res[period_ids] = sums
+        return res
+
+    def has_period(self, period_key):
+        """Test if do_queries_multi() has been invoked for a period."""
+        return period_key in self._data_by_period
+
+    def set_period(self, period_key):
+        """Select the period for which replace_expr() returns values.
+
+        This method must be executed after do_queries_multi().
+        """
+        self._data = self._data_by_period[period_key]
+
+    def get_slot_values(self, expr):
+        """Get the values of the accounting variables of an expression.
+
+        Returns a dictionary {slot: amount}, to be used as evaluation
+        context of the source of the CompiledExpression.
 
         This method must be executed after do_queries().
         """
-        def f(mo):
-            field, mode, account_codes, domain = self._parse_match_object(mo)
-            key = (domain, mode)
-            account_ids_data = self._data[key]
+        compiled = self._get_compiled(expr)
+        res = {}
+        for slot, (field, mode, account_codes, domain) in \
+                zip(compiled.slots, compiled.variables):
+            account_ids_data = self._data[(domain, mode)]
             v = 0.0
             for account_code in account_codes:
                 account_ids = self._account_ids_by_code[account_code]
@@ -426,5 +615,17 @@ class AccountingExpressionProcessor(object):
                         v += debit
                     elif field == 'crd':
                         v += credit
-            return '(' + repr(v) + ')'
-        return self.ACC_RE.sub(f, expr)
+            res[slot] = v
+        return res
+
+    def replace_expr(self, expr):
+        """Replace accounting variables in an expression by their amount.
+
+        Returns a new expression string.
+
+        This method must be executed after do_queries().
+        """
+        compiled = self._get_compiled(expr)
+        values = self.get_slot_values(compiled)
+        return compiled.render(['(' + repr(values[slot]) + ')'
+                                for slot in compiled.slots])
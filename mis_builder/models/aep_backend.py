@@ -0,0 +1,411 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    mis_builder module for Odoo, Management Information System Builder
+#    Copyright (C) 2014-2015 ACSONE SA/NV (<http://acsone.eu>)
+#
+#    This file is a part of mis_builder
+#
+#    mis_builder is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License v3 or later
+#    as published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    mis_builder is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License v3 or later for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    v3 or later along with this program.
+#    If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+
+from collections import defaultdict
+
+from openerp import SUPERUSER_ID
+from openerp.osv import expression
+
+
+class AEPBackend(object):
+    """ Query backend of the AccountingExpressionProcessor.
+
+    A backend sums debit and credit of move lines, grouped by account,
+    for a list of move line domains and a list of date filters. Backends
+    are registered in BACKENDS, by name.
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def query(self, cr, uid, domains, account_ids, date_filters,
+              target_move, additional_move_line_filter, context=None):
+        """ Sum debit and credit of move lines for several periods.
+
+        domains is a list of move line domains of accounting variables
+        and account_ids the list of accounts to query.
+        date_filters is a list of (idx, period_ids, dates) tuples,
+        where idx identifies a period, and one of period_ids (a list of
+        account.period ids) or dates (a (date_from, date_to) tuple)
+        is None.
+
+        Returns an iterable of (idx, account_id, sums), where sums
+        is a list with one (debit, credit) tuple per domain,
+        or None when no move line matches the domain.
+        """
+        raise NotImplementedError()
+
+    def query_by_period(self, cr, uid, domains, account_ids, period_ids,
+                        target_move, additional_move_line_filter,
+                        context=None):
+        """ Sum debit and credit of move lines by fiscal period.
+
+        Same as query(), for a list of account.period ids.
+
+        Returns an iterable of (period_id, account_id, sums).
+        """
+        raise NotImplementedError()
+
+
+class AEPOrmBackend(AEPBackend):
+    """ Backend using the orm read_group, one query per domain and
+    date filter, or per domain and fiscal period when querying by
+    fiscal period.
+
+    It is the slowest backend, but it applies the record rules on
+    move lines and it honors any customization of account.move.line.
+    """
+
+    def query(self, cr, uid, domains, account_ids, date_filters,
+              target_move, additional_move_line_filter, context=None):
+        aml_model = self.pool['account.move.line']
+        # {(idx, account_id): sums}
+        res = {}
+        for i, domain in enumerate(domains):
+            for idx, period_ids, dates in date_filters:
+                aml_domain = list(domain)
+                if period_ids is not None:
+                    aml_domain.append(('period_id', 'in', period_ids))
+                else:
+                    aml_domain.extend([('date', '>=', dates[0]),
+                                       ('date', '<=', dates[1])])
+                if target_move == 'posted':
+                    aml_domain.append(('move_id.state', '=', 'posted'))
+                aml_domain.append(('account_id', 'in', account_ids))
+                if additional_move_line_filter:
+                    aml_domain.extend(additional_move_line_filter)
+                # fetch sum of debit/credit, grouped by account_id
+                accs = aml_model.read_group(cr, uid, aml_domain,
+                                            ['debit', 'credit', 'account_id'],
+                                            ['account_id'],
+                                            context=context)
+                for acc in accs:
+                    sums = res.setdefault((idx, acc['account_id'][0]),
+                                          [None] * len(domains))
+                    sums[i] = (acc['debit'] or 0.0, acc['credit'] or 0.0)
+        return [(idx, account_id, sums)
+                for (idx, account_id), sums in res.items()]
+
+    def query_by_period(self, cr, uid, domains, account_ids, period_ids,
+                        target_move, additional_move_line_filter,
+                        context=None):
+        # read_group groups by the first field only: query each
+        # fiscal period as a date filter of its own
+        return self.query(cr, uid, domains, account_ids,
+                          [(period_id, [period_id], None)
+                           for period_id in period_ids],
+                          target_move, additional_move_line_filter,
+                          context=context)
+
+
+class AEPSqlBackend(AEPBackend):
+    """ Backend querying the account_move_line table directly.
+
+    All periods and domains are queried at once: periods are joined
+    as a VALUES list and grouped by account and period, and each domain
+    is a pair of filtered aggregates (SUM ... FILTER (WHERE ...)), so
+    move lines are read once whatever the number of domains.
+    Filters on periods, dates, accounts and move state are written in
+    SQL; the move line domains, the additional move line filter and
+    the record rules of the user on move lines go through the orm
+    domain translation, so the sql and orm backends compute the same
+    amounts.
+
+    When the mis.account.period.balance table is enabled, sums by
+    fiscal period without move line domain are read from that table.
+    The record rules of the user on move lines are then applied to the
+    company of the balances, so move lines are read instead when the
+    rules involve other fields than the company.
+    """
+
+    def __init__(self, pool):
+        super(AEPSqlBackend, self).__init__(pool)
+        self._period_balance_enabled = None
+
+    def _use_period_balance(self, cr):
+        if self._period_balance_enabled is None:
+            self._period_balance_enabled = \
+                self.pool['mis.account.period.balance'].is_enabled(cr)
+        return self._period_balance_enabled
+
+    @staticmethod
+    def _get_query_where(query):
+        """ Convert an orm query on move lines to a where clause on the
+        account_move_line table.
+
+        Returns a (where clause, params) tuple.
+        """
+        from_clause, where_clause, where_params = query.get_sql()
+        if not where_clause:
+            return None, []
+        if from_clause == '"account_move_line"':
+            return where_clause, where_params
+        return '"account_move_line".id IN (' \
+            'SELECT "account_move_line".id FROM ' + from_clause + \
+            ' WHERE ' + where_clause + ')', where_params
+
+    def _get_domain_where(self, cr, uid, domain, context=None):
+        """ Translate a move line domain to a where clause on the
+        account_move_line table.
+
+        Returns a (where clause, params) tuple.
+        """
+        aml_model = self.pool['account.move.line']
+        return self._get_query_where(
+            aml_model._where_calc(cr, uid, domain, context=context))
+
+    def _get_rules_where(self, cr, uid, context=None):
+        """ Return the (where clause, params) tuple of the record rules
+        on move lines for the user, the clause being None when no
+        rule applies. """
+        aml_model = self.pool['account.move.line']
+        aml_model.check_access_rights(cr, uid, 'read')
+        query = aml_model._where_calc(cr, uid, [], context=context)
+        aml_model._apply_ir_rules(cr, uid, query, 'read', context=context)
+        return self._get_query_where(query)
+
+    def _get_balance_rules_where(self, cr, uid, context=None):
+        """ Translate the record rules on move lines for the user to a
+        where clause on the mis_account_period_balance table.
+
+        Returns a (where clause, params) tuple, the clause being None
+        when no rule applies, or None when the rules cannot be applied
+        to the balances because they involve other fields than
+        company_id.
+        """
+        aml_model = self.pool['account.move.line']
+        aml_model.check_access_rights(cr, uid, 'read')
+        domain = self.pool['ir.rule']._compute_domain(
+            cr, uid, 'account.move.line', 'read')
+        if not domain:
+            return None, []
+        for leaf in domain:
+            if not expression.is_operator(leaf) and \
+                    tuple(leaf) not in (expression.TRUE_LEAF,
+                                        expression.FALSE_LEAF) and \
+                    leaf[0] != 'company_id':
+                return None
+        # evaluated like the rules, see ir.rule domain_get()
+        query = self.pool['mis.account.period.balance']._where_calc(
+            cr, SUPERUSER_ID, domain, context=context)
+        from_clause, where_clause, where_params = query.get_sql()
+        if from_clause != '"mis_account_period_balance"':
+            return None
+        return where_clause or None, where_params
+
+    def _get_where(self, cr, uid, domains, account_ids, target_move,
+                   additional_move_line_filter, context=None):
+        """ Build the clauses filtering move lines on accounts, target
+        move and domains.
+
+        Returns a (aggregates, aggregates params, join clause,
+        where clause, where params) tuple, where aggregates are the
+        sums of debit and credit for each domain.
+        """
+        wheres = ['"account_move_line".account_id IN %s']
+        where_params = [tuple(account_ids)]
+        rules_where, rules_params = self._get_rules_where(
+            cr, uid, context=context)
+        if rules_where:
+            wheres.append(rules_where)
+            where_params.extend(rules_params)
+        if target_move == 'posted':
+            wheres.append("m.state = 'posted'")
+        if additional_move_line_filter:
+            extra_where, extra_params = self._get_domain_where(
+                cr, uid, additional_move_line_filter, context=context)
+            if extra_where:
+                wheres.append(extra_where)
+                where_params.extend(extra_params)
+        aggregates = []
+        aggregates_params = []
+        domain_wheres = []
+        domain_params = []
+        for domain in domains:
+            domain_where, params = None, []
+            if domain:
+                domain_where, params = self._get_domain_where(
+                    cr, uid, domain, context=context)
+            if not domain_where:
+                aggregates.append('SUM("account_move_line".debit), '
+                                  'SUM("account_move_line".credit)')
+                domain_wheres = None
+                continue
+            aggregates.append(
+                'SUM("account_move_line".debit) '
+                'FILTER (WHERE ' + domain_where + '), '
+                'SUM("account_move_line".credit) '
+                'FILTER (WHERE ' + domain_where + ')')
+            aggregates_params.extend(params + params)
+            if domain_wheres is not None:
+                domain_wheres.append('(' + domain_where + ')')
+                domain_params.extend(params)
+        if domain_wheres:
+            # read only move lines matching at least one domain
+            wheres.append('(' + ' OR '.join(domain_wheres) + ')')
+            where_params.extend(domain_params)
+        join_move = ''
+        if target_move == 'posted':
+            join_move = """
+                JOIN account_move m
+                  ON m.id = "account_move_line".move_id"""
+        return ", ".join(aggregates), aggregates_params, \
+            join_move, " AND ".join(wheres), where_params
+
+    @staticmethod
+    def _get_sums(rows):
+        """ Convert rows of (key, account_id, debit, credit, debit,
+        credit, ...) to (key, account_id, sums) tuples. """
+        res = []
+        for row in rows:
+            sums = []
+            for i in range(2, len(row), 2):
+                if row[i] is None and row[i + 1] is None:
+                    sums.append(None)
+                else:
+                    sums.append((row[i], row[i + 1]))
+            res.append((row[0], row[1], sums))
+        return res
+
+    def query(self, cr, uid, domains, account_ids, date_filters,
+              target_move, additional_move_line_filter, context=None):
+        rows_by_kind = defaultdict(list)
+        for idx, period_ids, dates in date_filters:
+            if period_ids is not None:
+                for period_id in period_ids:
+                    rows_by_kind['period'].append((idx, period_id))
+            else:
+                rows_by_kind['date'].append((idx, ) + tuple(dates))
+        if not rows_by_kind:
+            return []
+        aggregates, aggregates_params, join_move, where, where_params = \
+            self._get_where(cr, uid, domains, account_ids, target_move,
+                            additional_move_line_filter, context=context)
+        selects = []
+        params = []
+        period_rows = rows_by_kind.get('period')
+        if period_rows:
+            selects.append("""
+                SELECT cols.idx, "account_move_line".account_id,
+                       """ + aggregates + """
+                FROM account_move_line""" + join_move + """
+                JOIN (VALUES """ + ", ".join(["(%s, %s)"] * len(period_rows))
+                           + """) AS cols (idx, period_id)
+                  ON "account_move_line".period_id = cols.period_id
+                WHERE """ + where + """
+                GROUP BY cols.idx, "account_move_line".account_id
+                """)
+            params.extend(aggregates_params)
+            for row in period_rows:
+                params.extend(row)
+            params.extend(where_params)
+        date_rows = rows_by_kind.get('date')
+        if date_rows:
+            selects.append("""
+                SELECT cols.idx, "account_move_line".account_id,
+                       """ + aggregates + """
+                FROM account_move_line""" + join_move + """
+                JOIN (VALUES """ + ", ".join(["(%s, %s::date, %s::date)"] *
+                                             len(date_rows))
+                           + """) AS cols (idx, date_from, date_to)
+                  ON "account_move_line".date >= cols.date_from
+                 AND "account_move_line".date <= cols.date_to
+                WHERE """ + where + """
+                GROUP BY cols.idx, "account_move_line".account_id
+                """)
+            params.extend(aggregates_params)
+            for row in date_rows:
+                params.extend(row)
+            params.extend(where_params)
+        cr.execute(" UNION ALL ".join(selects), params)
+        return self._get_sums(cr.fetchall())
+
+    def query_by_period(self, cr, uid, domains, account_ids, period_ids,
+                        target_move, additional_move_line_filter,
+                        context=None):
+        if not period_ids:
+            return []
+        # {(period_id, account_id): sums}
+        res = {}
+        domain_idxs = range(len(domains))
+        balance_rules_where = None
+        if not additional_move_line_filter and \
+                self._use_period_balance(cr) and \
+                not all(domains):
+            balance_rules_where = self._get_balance_rules_where(
+                cr, uid, context=context)
+        if balance_rules_where is not None:
+            balance_domain_idxs = [i for i in domain_idxs if not domains[i]]
+            wheres = ['"mis_account_period_balance".period_id IN %s',
+                      '"mis_account_period_balance".account_id IN %s']
+            params = [tuple(period_ids), tuple(account_ids)]
+            if target_move == 'posted':
+                wheres.append('"mis_account_period_balance".move_state '
+                              '= \'posted\'')
+            rules_where, rules_params = balance_rules_where
+            if rules_where:
+                wheres.append(rules_where)
+                params.extend(rules_params)
+            cr.execute("""
+                SELECT period_id, account_id, SUM(debit), SUM(credit)
+                FROM mis_account_period_balance
+                WHERE """ + " AND ".join(wheres) + """
+                GROUP BY period_id, account_id
+                """, params)
+            for period_id, account_id, debit, credit in cr.fetchall():
+                sums = res.setdefault((period_id, account_id),
+                                      [None] * len(domains))
+                for i in balance_domain_idxs:
+                    sums[i] = (debit, credit)
+            domain_idxs = [i for i in domain_idxs if domains[i]]
+        if domain_idxs:
+            aggregates, aggregates_params, join_move, where, where_params = \
+                self._get_where(cr, uid, [domains[i] for i in domain_idxs],
+                                account_ids, target_move,
+                                additional_move_line_filter, context=context)
+            cr.execute("""
+                SELECT "account_move_line".period_id,
+                       "account_move_line".account_id,
+                       """ + aggregates + """
+                FROM account_move_line""" + join_move + """
+                WHERE "account_move_line".period_id IN %s
+                  AND """ + where + """
+                GROUP BY "account_move_line".period_id,
+                         "account_move_line".account_id
+                """, aggregates_params + [tuple(period_ids)] + where_params)
+            for period_id, account_id, domain_sums in \
+                    self._get_sums(cr.fetchall()):
+                sums = res.setdefault((period_id, account_id),
+                                      [None] * len(domains))
+                for i, domain_sum in zip(domain_idxs, domain_sums):
+                    sums[i] = domain_sum
+        return [(period_id, account_id, sums)
+                for (period_id, account_id), sums in res.items()]
+
+
+BACKENDS = {
+    'orm': AEPOrmBackend,
+    'sql': AEPSqlBackend,
+}
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    mis_builder module for Odoo, Management Information System Builder
+#    Copyright (C) 2014-2015 ACSONE SA/NV (<http://acsone.eu>)
+#
+#    This file is a part of mis_builder
+#
+#    mis_builder is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License v3 or later
+#    as published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    mis_builder is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License v3 or later for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    v3 or later along with this program.
+#    If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import re
+from collections import defaultdict
+
+NON_LEAF_TYPES = ('view', 'consolidation')
+
+
+class AccountChartIndex(object):
+    """ In-memory index of a chart of accounts.
+
+    The accounts under the root account are loaded at once, together with
+    the charts they consolidate. Account codes are indexed in a prefix trie,
+    and the set of leaf descendants (ie accounts that are not views nor
+    consolidation accounts) is precomputed for each account, following
+    children and consolidated children.
+
+    Inactive accounts and accounts not readable by the user are excluded
+    from the results, like a search on account.account would do.
+    """
+
+    def __init__(self, cr, uid, pool, root_account_id, context=None):
+        self.root_account_id = root_account_id
+        # {account_id: (code, type)}
+        self._accounts = {}
+        # {account_id: parent account_id}
+        self._parents = {}
+        # {account_id: [child account_id]}, including consolidated children
+        self._children = defaultdict(list)
+        # code prefix trie: {char: node}, with account ids under None
+        self._trie = {}
+        # {account_id: frozenset(leaf descendant account ids)}
+        self._leaves = {}
+        self._load(cr, uid, pool, context=context)
+
+    def _load_subtrees(self, cr, account_ids):
+        """ Load accounts and their descendants.
+
+        Returns the list of loaded account ids. """
+        cr.execute("""
+            SELECT a.id, a.code, a.type, a.parent_id
+            FROM account_account a, account_account r
+            WHERE r.id IN %s
+              AND a.parent_left >= r.parent_left
+              AND a.parent_left < r.parent_right
+            """, (tuple(account_ids), ))
+        res = []
+        for account_id, code, account_type, parent_id in cr.fetchall():
+            if account_id in self._accounts:
+                continue
+            self._accounts[account_id] = (code, account_type)
+            self._parents[account_id] = parent_id
+            res.append(account_id)
+        return res
+
+    def _load(self, cr, uid, pool, context=None):
+        tree_ids = self._load_subtrees(cr, [self.root_account_id])
+        # load consolidated charts
+        consol_ids = [account_id for account_id in tree_ids
+                      if self._accounts[account_id][1] == 'consolidation']
+        while consol_ids:
+            cr.execute("""
+                SELECT parent_id, child_id
+                FROM account_account_consol_rel
+                WHERE parent_id IN %s
+                """, (tuple(consol_ids), ))
+            new_ids = set()
+            for parent_id, child_id in cr.fetchall():
+                self._children[parent_id].append(child_id)
+                if child_id not in self._accounts:
+                    new_ids.add(child_id)
+            consol_ids = []
+            if new_ids:
+                consol_ids = [
+                    account_id
+                    for account_id in self._load_subtrees(cr, list(new_ids))
+                    if self._accounts[account_id][1] == 'consolidation']
+        for account_id, parent_id in self._parents.items():
+            if parent_id in self._accounts:
+                self._children[parent_id].append(account_id)
+        # keep only active accounts the user can read
+        allowed_ids = set(pool['account.account'].search(
+            cr, uid, [('id', 'in', list(self._accounts))], context=context))
+        # index codes of the accounts in the chart
+        for account_id in tree_ids:
+            if account_id not in allowed_ids:
+                continue
+            node = self._trie
+            for c in self._accounts[account_id][0] or '':
+                node = node.setdefault(c, {})
+            node.setdefault(None, []).append(account_id)
+        # precompute leaf descendants
+        for account_id in self._accounts:
+            self._get_leaves(account_id, allowed_ids, set())
+        self._leaves = dict((account_id, leaves)
+                            for account_id, leaves in self._leaves.items()
+                            if account_id in allowed_ids)
+
+    def _get_leaves(self, account_id, allowed_ids, visiting):
+        if account_id in self._leaves:
+            return self._leaves[account_id]
+        if account_id in visiting:
+            # consolidation loop
+            return frozenset()
+        visiting.add(account_id)
+        leaves = set()
+        if account_id in allowed_ids and \
+                self._accounts[account_id][1] not in NON_LEAF_TYPES:
+            leaves.add(account_id)
+        for child_id in self._children.get(account_id, []):
+            if child_id in self._accounts:
+                leaves.update(self._get_leaves(child_id, allowed_ids,
+                                               visiting))
+        visiting.discard(account_id)
+        leaves = self._leaves[account_id] = frozenset(leaves)
+        return leaves
+
+    def _get_node(self, prefix):
+        node = self._trie
+        for c in prefix:
+            node = node.get(c)
+            if node is None:
+                return {}
+        return node
+
+    def _iter_node(self, node, prefix):
+        """ Yield (code, account ids) for all codes under a trie node """
+        stack = [(node, prefix)]
+        while stack:
+            node, prefix = stack.pop()
+            for c, child in node.items():
+                if c is None:
+                    yield prefix, child
+                else:
+                    stack.append((child, prefix + c))
+
+    def get_account_ids(self, account_code):
+        """ Return the set of leaf account ids for an account code.
+
+        The account code may be None for the root account, an exact code
+        or a pattern containing %, where % matches any string and _ matches
+        any character, like the SQL =like operator. View and consolidation
+        accounts are replaced by their leaf descendants.
+        """
+        if account_code is None:
+            account_code = self._accounts[self.root_account_id][0]
+        if '%' not in account_code:
+            # exact code
+            account_ids = self._get_node(account_code).get(None, [])
+        else:
+            wildcard = min(i for i in (account_code.find('%'),
+                                       account_code.find('_')) if i >= 0)
+            prefix = account_code[:wildcard]
+            node = self._get_node(prefix)
+            if account_code[wildcard:] == '%':
+                # prefix pattern
+                account_ids = [account_id
+                               for code, ids in self._iter_node(node, prefix)
+                               for account_id in ids]
+            else:
+                pattern = re.compile(''.join(
+                    c == '%' and '.*' or c == '_' and '.' or re.escape(c)
+                    for c in account_code) + '$', re.DOTALL)
+                account_ids = [account_id
+                               for code, ids in self._iter_node(node, prefix)
+                               if pattern.match(code)
+                               for account_id in ids]
+        res = set()
+        for account_id in account_ids:
+            res.update(self._leaves[account_id])
+        return res
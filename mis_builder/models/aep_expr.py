@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    mis_builder module for Odoo, Management Information System Builder
+#    Copyright (C) 2014-2015 ACSONE SA/NV (<http://acsone.eu>)
+#
+#    This file is a part of mis_builder
+#
+#    mis_builder is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License v3 or later
+#    as published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    mis_builder is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License v3 or later for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    v3 or later along with this program.
+#    If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+from openerp.tools.safe_eval import safe_eval
+
+MODE_VARIATION = 'p'
+MODE_INITIAL = 'i'
+MODE_END = 'e'
+
+FIELDS = ('bal', 'crd', 'deb')
+MODES = 'pise'
+SLOT_PREFIX = '_aep_'
+
+
+class CompiledExpression(object):
+    """ An expression where accounting variables are replaced by slots.
+
+    The expression is kept as a list of text segments surrounding
+    the accounting variables. Variables are (field, mode, account codes,
+    domain) tuples, where account codes is a tuple of codes ((None, ) for
+    the root account) and domain is a tuple of domain terms.
+    Slots are python variable names, one per accounting variable,
+    and source is the expression with accounting variables
+    replaced by their slot.
+    """
+
+    def __init__(self, expr, segments, variables):
+        assert len(segments) == len(variables) + 1
+        self.expr = expr
+        self.segments = segments
+        self.variables = variables
+        self.slots = [SLOT_PREFIX + str(i) for i in range(len(variables))]
+        self.source = self.render(self.slots)
+
+    def render(self, values):
+        """ Return the expression where each slot is replaced by
+        the corresponding string in values. """
+        res = [self.segments[0]]
+        for value, segment in zip(values, self.segments[1:]):
+            res.append(value)
+            res.append(segment)
+        return ''.join(res)
+
+
+def _is_word_char(c):
+    return c.isalnum() or c == '_'
+
+
+def _skip_string(expr, i):
+    """ Return the index after the string literal starting at i. """
+    quote = expr[i]
+    if expr[i:i + 3] == quote * 3:
+        quote = quote * 3
+    j = i + len(quote)
+    while j < len(expr):
+        if expr[j] == '\\':
+            j += 2
+        elif expr.startswith(quote, j):
+            return j + len(quote)
+        else:
+            j += 1
+    return len(expr)
+
+
+def _skip_brackets(expr, i):
+    """ Return the index after the square bracket opened at i,
+    or -1 if it is not closed. """
+    depth = 0
+    j = i
+    while j < len(expr):
+        c = expr[j]
+        if c in '\'"':
+            j = _skip_string(expr, j)
+            continue
+        if c == '[':
+            depth += 1
+        elif c == ']':
+            depth -= 1
+            if depth == 0:
+                return j + 1
+        j += 1
+    return -1
+
+
+def _freeze(value):
+    """ Convert lists to tuples, recursively, so domains are hashable. """
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+def _parse_var(expr, i, j):
+    """ Parse an accounting variable starting with the word expr[i:j].
+
+    Returns a (variable, end index) tuple, or (None, None) if
+    it is not an accounting variable.
+    """
+    word = expr[i:j]
+    field = word[:3]
+    rest = word[3:]
+    mode = None
+    if rest and rest[0] in MODES and (len(rest) == 1 or rest[1] == '_'):
+        mode = rest[0]
+        rest = rest[1:]
+    if rest:
+        # short form: <field><mode>_<account code>
+        account_codes = rest[1:]
+        if not rest.startswith('_') or not account_codes or \
+                '_' in account_codes:
+            return None, None
+        end = j
+    else:
+        # <field><mode>[<account codes>]
+        if expr[j:j + 1] != '[':
+            return None, None
+        end = _skip_brackets(expr, j)
+        if end < 0:
+            return None, None
+        account_codes = expr[j + 1:end - 1]
+    if account_codes.strip():
+        account_codes = tuple(a.strip() for a in account_codes.split(','))
+    else:
+        account_codes = (None, )
+    domain = ()
+    if expr[end:end + 1] == '[':
+        domain_end = _skip_brackets(expr, end)
+        if domain_end > 0:
+            domain = _freeze(safe_eval(expr[end:domain_end]))
+            end = domain_end
+    if not mode:
+        mode = MODE_VARIATION
+    elif mode == 's':
+        mode = MODE_END
+    return (field, mode, account_codes, domain), end
+
+
+def compile_expr(expr):
+    """ Tokenize an expression, extracting accounting variables.
+
+    String literals and attribute names are skipped, and square
+    brackets are matched, so domains may contain lists and strings
+    with brackets.
+
+    Returns a CompiledExpression.
+    """
+    segments = []
+    variables = []
+    start = i = 0
+    while i < len(expr):
+        c = expr[i]
+        if c in '\'"':
+            i = _skip_string(expr, i)
+        elif _is_word_char(c):
+            j = i
+            while j < len(expr) and _is_word_char(expr[j]):
+                j += 1
+            var = None
+            if expr[i:i + 3] in FIELDS and (i == 0 or expr[i - 1] != '.'):
+                var, end = _parse_var(expr, i, j)
+            if var:
+                segments.append(expr[start:i])
+                variables.append(var)
+                start = i = end
+            else:
+                i = j
+        else:
+            i += 1
+    segments.append(expr[start:])
+    return CompiledExpression(expr, segments, variables)
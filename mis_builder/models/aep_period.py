@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    mis_builder module for Odoo, Management Information System Builder
+#    Copyright (C) 2014-2015 ACSONE SA/NV (<http://acsone.eu>)
+#
+#    This file is a part of mis_builder
+#
+#    mis_builder is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License v3 or later
+#    as published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    mis_builder is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License v3 or later for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    v3 or later along with this program.
+#    If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+from bisect import bisect_left, bisect_right
+from collections import defaultdict, namedtuple
+
+# has_moves is only computed for special (opening) periods
+Period = namedtuple('Period', ['id', 'date_start', 'date_stop', 'special',
+                               'company_id', 'has_moves'])
+
+
+class PeriodTimeline(object):
+    """ In-memory timeline of the fiscal periods, per company.
+
+    All periods readable by the user are loaded at once, and for each
+    company normal and special periods are kept in two lists sorted
+    by start date, so the lookups needed to resolve the periods of
+    a column are bisections instead of database searches.
+    Dates are compared as strings, as returned by the orm.
+    """
+
+    def __init__(self, cr, uid, pool, context=None):
+        # {period_id: Period}
+        self._periods = {}
+        # {company_id: [Period]} sorted by date_start
+        self._normal = defaultdict(list)
+        self._special = defaultdict(list)
+        # {company_id: [date_start]}, for bisections
+        self._normal_starts = {}
+        self._special_starts = {}
+        self._load(cr, uid, pool, context=context)
+
+    def _load(self, cr, uid, pool, context=None):
+        period_model = pool['account.period']
+        period_ids = period_model.search(cr, uid, [], context=context)
+        rows = period_model.read(
+            cr, uid, period_ids,
+            ['date_start', 'date_stop', 'special', 'company_id'],
+            context=context, load='_classic_write')
+        special_ids = [row['id'] for row in rows if row['special']]
+        special_ids_with_moves = set()
+        if special_ids:
+            groups = pool['account.move'].read_group(
+                cr, uid, [('period_id', 'in', special_ids)],
+                ['period_id'], ['period_id'], context=context)
+            special_ids_with_moves = set(
+                group['period_id'][0] for group in groups
+                if group['period_id'])
+        for row in rows:
+            period = Period(row['id'], row['date_start'], row['date_stop'],
+                            row['special'], row['company_id'],
+                            row['id'] in special_ids_with_moves)
+            self._periods[period.id] = period
+            if period.special:
+                self._special[period.company_id].append(period)
+            else:
+                self._normal[period.company_id].append(period)
+        for periods_by_company, starts in ((self._normal,
+                                            self._normal_starts),
+                                           (self._special,
+                                            self._special_starts)):
+            for company_id, periods in periods_by_company.items():
+                periods.sort(key=lambda p: (p.date_start, p.id))
+                starts[company_id] = [p.date_start for p in periods]
+
+    def get_period(self, period_id):
+        return self._periods.get(period_id)
+
+    def _get_normal_periods_between(self, company_id, date_start, date_stop):
+        """ Normal periods starting on or after date_start
+        and ending on or before date_stop """
+        periods = self._normal.get(company_id, [])
+        starts = self._normal_starts.get(company_id, [])
+        lo = bisect_left(starts, date_start)
+        # a period starts before it stops
+        hi = bisect_right(starts, date_stop)
+        return [p for p in periods[lo:hi] if p.date_stop <= date_stop]
+
+    def get_company_ids_between(self, date_start, date_stop):
+        """ Companies having normal periods between two dates """
+        return set(company_id for company_id in self._normal
+                   if self._get_normal_periods_between(
+                       company_id, date_start, date_stop))
+
+    def get_normal_period_ids_between(self, company_id, date_start,
+                                      date_stop):
+        return [p.id for p in self._get_normal_periods_between(
+            company_id, date_start, date_stop)]
+
+    def get_previous_opening_period(self, company_id, date_start):
+        """ Last special period starting on or before date_start """
+        starts = self._special_starts.get(company_id, [])
+        i = bisect_right(starts, date_start)
+        return i and self._special[company_id][i - 1] or None
+
+    def get_previous_normal_period(self, company_id, date_start):
+        """ Last normal period starting strictly before date_start """
+        starts = self._normal_starts.get(company_id, [])
+        i = bisect_left(starts, date_start)
+        return i and self._normal[company_id][i - 1] or None
+
+    def get_first_normal_period(self, company_id):
+        periods = self._normal.get(company_id)
+        return periods and periods[0] or None
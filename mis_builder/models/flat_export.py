@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    mis_builder module for Odoo, Management Information System Builder
+#    Copyright (C) 2014-2015 ACSONE SA/NV (<http://acsone.eu>)
+#
+#    This file is a part of mis_builder
+#
+#    mis_builder is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License v3 or later
+#    as published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    mis_builder is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License v3 or later for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    v3 or later along with this program.
+#    If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+
+""" Flat export of computed report instances, one row per instance,
+KPI and column, for loading in data warehouses. """
+
+import csv
+import datetime
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# (column name, type)
+COLUMNS = [
+    ('instance_id', 'int'),
+    ('instance_name', 'str'),
+    ('pivot_date', 'date'),
+    ('kpi_id', 'int'),
+    ('kpi_name', 'str'),
+    ('kpi_description', 'str'),
+    ('period_id', 'int'),
+    ('period_name', 'str'),
+    ('date_from', 'date'),
+    ('date_to', 'date'),
+    ('val', 'float'),
+    ('error', 'str'),
+]
+
+PARQUET_BATCH_SIZE = 10000
+
+
+def get_raw_value(cell):
+    """ Return the value of a computed cell as a float,
+    or None if it is not a number. """
+    val = cell.get('val')
+    if isinstance(val, bool) or not isinstance(val, (int, long, float)):
+        return None
+    return float(val)
+
+
+def _encode(value):
+    if value is None:
+        return ''
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+def write_csv(rows, f):
+    """ Write rows, which are tuples of the values of COLUMNS,
+    to a csv file opened in binary mode, one at a time. """
+    writer = csv.writer(f)
+    writer.writerow([name for name, column_type in COLUMNS])
+    for row in rows:
+        writer.writerow([_encode(value) for value in row])
+
+
+def _parquet_schema():
+    types = {
+        'int': pyarrow.int64(),
+        'str': pyarrow.string(),
+        'date': pyarrow.date32(),
+        'float': pyarrow.float64(),
+    }
+    return pyarrow.schema([(name, types[column_type])
+                           for name, column_type in COLUMNS])
+
+
+def _parse_date(value):
+    if not value:
+        return None
+    return datetime.datetime.strptime(value[:10], '%Y-%m-%d').date()
+
+
+def write_parquet(rows, path):
+    """ Write rows, which are tuples of the values of COLUMNS,
+    to a parquet file, by row groups of PARQUET_BATCH_SIZE rows. """
+    schema = _parquet_schema()
+    date_idxs = [i for i, (name, column_type) in enumerate(COLUMNS)
+                 if column_type == 'date']
+    writer = pyarrow.parquet.ParquetWriter(path, schema)
+    try:
+        batch = []
+        for row in rows:
+            row = list(row)
+            for i in date_idxs:
+                row[i] = _parse_date(row[i])
+            batch.append(row)
+            if len(batch) >= PARQUET_BATCH_SIZE:
+                writer.write_table(_make_table(schema, batch))
+                batch = []
+        if batch:
+            writer.write_table(_make_table(schema, batch))
+    finally:
+        writer.close()
+
+
+def _make_table(schema, batch):
+    return pyarrow.Table.from_arrays(
+        [pyarrow.array([row[i] for row in batch], type=field.type)
+         for i, field in enumerate(schema)],
+        schema=schema)
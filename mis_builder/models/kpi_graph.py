@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    mis_builder module for Odoo, Management Information System Builder
+#    Copyright (C) 2014-2015 ACSONE SA/NV (<http://acsone.eu>)
+#
+#    This file is a part of mis_builder
+#
+#    mis_builder is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License v3 or later
+#    as published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    mis_builder is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License v3 or later for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    v3 or later along with this program.
+#    If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+
+""" Static analysis of dependencies between KPI's. """
+
+import ast
+
+
+def get_expr_names(source):
+    """ Return the set of free names used in a python expression,
+    ie names that are loaded and not bound in the expression
+    (by a comprehension or a lambda), or an empty set if the
+    expression is not valid. """
+    try:
+        tree = ast.parse(source.strip(), mode='eval')
+    except SyntaxError:
+        return set()
+    loaded = set()
+    bound = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name):
+            if isinstance(node.ctx, ast.Load):
+                loaded.add(node.id)
+            else:
+                bound.add(node.id)
+        elif isinstance(node, ast.arguments):
+            for arg in node.args:
+                # python 3 lambda arguments are not Name nodes
+                if not isinstance(arg, ast.Name):
+                    bound.add(arg.arg)
+            if node.vararg:
+                bound.add(getattr(node.vararg, 'arg', node.vararg))
+            if node.kwarg:
+                bound.add(getattr(node.kwarg, 'arg', node.kwarg))
+    return loaded - bound
+
+
+def get_expr_attributes(source):
+    """ Return the set of attribute names used in a python expression,
+    eg the fields of query records, or an empty set if the expression
+    is not valid. """
+    try:
+        tree = ast.parse(source.strip(), mode='eval')
+    except SyntaxError:
+        return set()
+    return set(node.attr for node in ast.walk(tree)
+               if isinstance(node, ast.Attribute))
+
+
+def sort_kpis(kpi_names, dependencies):
+    """ Sort KPI's so each one comes after the KPI's it depends on.
+
+    kpi_names is the list of KPI names in report order, and
+    dependencies a dictionary {kpi name: set of names used in its
+    expression}, names which are not KPI names being ignored.
+
+    Returns a (sorted kpi names, cyclic kpi names) tuple, where
+    cyclic kpi names is the set of KPI's that are part of a
+    circular reference. The report order is kept as much as possible.
+    """
+    positions = dict((kpi_name, i) for i, kpi_name in enumerate(kpi_names))
+    edges = {}
+    for kpi_name in kpi_names:
+        edges[kpi_name] = sorted(
+            [name for name in dependencies.get(kpi_name, ())
+             if name in positions],
+            key=positions.get)
+    # Tarjan's strongly connected components algorithm, which
+    # yields components after the components they depend on;
+    # it uses an explicit call stack as dependency chains may be
+    # longer than the python recursion limit
+    res = []
+    cyclic = set()
+    index = {}
+    lowlink = {}
+    stack = []
+    on_stack = set()
+
+    for root_name in kpi_names:
+        if root_name in index:
+            continue
+        index[root_name] = lowlink[root_name] = len(index)
+        stack.append(root_name)
+        on_stack.add(root_name)
+        call_stack = [(root_name, iter(edges[root_name]))]
+        while call_stack:
+            kpi_name, dep_names = call_stack[-1]
+            for dep_name in dep_names:
+                if dep_name not in index:
+                    index[dep_name] = lowlink[dep_name] = len(index)
+                    stack.append(dep_name)
+                    on_stack.add(dep_name)
+                    call_stack.append((dep_name, iter(edges[dep_name])))
+                    break
+                elif dep_name in on_stack:
+                    lowlink[kpi_name] = min(lowlink[kpi_name],
+                                            index[dep_name])
+            else:
+                # all dependencies visited
+                call_stack.pop()
+                if call_stack:
+                    caller_name = call_stack[-1][0]
+                    lowlink[caller_name] = min(lowlink[caller_name],
+                                               lowlink[kpi_name])
+                if lowlink[kpi_name] == index[kpi_name]:
+                    component = []
+                    while True:
+                        name = stack.pop()
+                        on_stack.discard(name)
+                        component.append(name)
+                        if name == kpi_name:
+                            break
+                    if len(component) > 1 or kpi_name in edges[kpi_name]:
+                        cyclic.update(component)
+                    res.extend(reversed(component))
+    return res, cyclic
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    mis_builder module for Odoo, Management Information System Builder
+#    Copyright (C) 2014-2015 ACSONE SA/NV (<http://acsone.eu>)
+#
+#    This file is a part of mis_builder
+#
+#    mis_builder is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License v3 or later
+#    as published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    mis_builder is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License v3 or later for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    v3 or later along with this program.
+#    If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+
+from openerp.addons.base.res.res_lang import intersperse
+from openerp.tools.safe_eval import safe_eval
+from openerp.tools.translate import _
+
+
+class KpiRenderer(object):
+    """ Render KPI values and comparisons, ready for display.
+
+    The renderer is built once for a language: the number grouping,
+    separators and divider labels are looked up once, and numbers
+    are then formatted exactly like res.lang.format() does.
+    """
+
+    def __init__(self, cr, uid, pool, lang_id, context=None):
+        if isinstance(lang_id, (list, tuple)):
+            lang_id = lang_id[0]
+        grouping, self._thousands_sep, self._decimal_point = \
+            pool['res.lang']._lang_data_get(cr, uid, lang_id, False)
+        self._grouping = safe_eval(grouping)
+        self._divider_labels = {}
+        for divider, divider_label in \
+                pool['mis.report.kpi']._columns['divider'].selection:
+            if divider_label == '1':
+                divider_label = ''
+            self._divider_labels.setdefault(divider, divider_label)
+        self._pp_label = _('pp')
+        # {(sign, dp): format}
+        self._formats = {}
+
+    def _format(self, sign, dp, value):
+        fmt = self._formats.get((sign, dp))
+        if fmt is None:
+            fmt = self._formats[(sign, dp)] = '%%%s.%df' % (sign, dp)
+        parts = (fmt % value).split('.')
+        parts[0], seps = intersperse(parts[0], self._grouping,
+                                     self._thousands_sep)
+        formatted = self._decimal_point.join(parts)
+        while seps:
+            sp = formatted.find(' ')
+            if sp == -1:
+                break
+            formatted = formatted[:sp] + formatted[sp + 1:]
+            seps -= 1
+        return formatted
+
+    def render_num(self, value, divider, dp, suffix, sign='-'):
+        divider_label = self._divider_labels.get(divider, '')
+        # format number following user language
+        value = round(value / float(divider or 1), dp) or 0
+        value = self._format(sign, dp, value)
+        value = u'%s\N{NO-BREAK SPACE}%s%s' % \
+            (value, divider_label, suffix or '')
+        value = value.replace('-', u'\N{NON-BREAKING HYPHEN}')
+        return value
+
+    def render(self, kpi, value):
+        if value is None:
+            return '#N/A'
+        if kpi.type == 'num':
+            return self.render_num(value, kpi.divider, kpi.dp, kpi.suffix)
+        elif kpi.type == 'pct':
+            return self.render_num(value, 0.01, kpi.dp, '%')
+        else:
+            return unicode(value)
+
+    def render_comparison(self, kpi, value, base_value,
+                          average_value, average_base_value):
+        """ render the comparison of two KPI values, ready for display """
+        if value is None or base_value is None:
+            return ''
+        if kpi.type == 'pct':
+            return self.render_num(value - base_value, 0.01,
+                                   kpi.dp, self._pp_label, sign='+')
+        elif kpi.type == 'num':
+            if average_value:
+                value = value / float(average_value)
+            if average_base_value:
+                base_value = base_value / float(average_base_value)
+            if kpi.compare_method == 'diff':
+                return self.render_num(value - base_value, kpi.divider,
+                                       kpi.dp, kpi.suffix, sign='+')
+            elif kpi.compare_method == 'pct':
+                if round(base_value, kpi.dp) != 0:
+                    return self.render_num(
+                        (value - base_value) / abs(base_value),
+                        0.01, kpi.dp, '%', sign='+')
+        return ''
+
+    def render_values(self, kpis, values):
+        """ Render the values of several KPI's, eg a column. """
+        return [self.render(kpi, value)
+                for kpi, value in zip(kpis, values)]
+
+    def render_row(self, kpi, values):
+        """ Render several values of a KPI, eg a row. """
+        return [self.render(kpi, value) for value in values]
+
+    def render_comparisons(self, kpis, values, base_values,
+                           average_value, average_base_value):
+        """ Render the comparison of two columns of KPI values. """
+        return [self.render_comparison(kpi, value, base_value,
+                                       average_value, average_base_value)
+                for kpi, value, base_value
+                in zip(kpis, values, base_values)]
@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    mis_builder module for Odoo, Management Information System Builder
+#    Copyright (C) 2014-2015 ACSONE SA/NV (<http://acsone.eu>)
+#
+#    This file is a part of mis_builder
+#
+#    mis_builder is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License v3 or later
+#    as published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    mis_builder is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License v3 or later for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    v3 or later along with this program.
+#    If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+
+import logging
+
+from openerp import SUPERUSER_ID
+from openerp.osv import orm, fields
+from openerp.tools.translate import _
+
+_logger = logging.getLogger(__name__)
+
+PARAM_ENABLED = 'mis_builder.period_balance'
+
+# upsert a contribution of move lines into the balance table
+_UPSERT = """
+        INSERT INTO mis_account_period_balance
+            (company_id, account_id, period_id, move_state,
+             debit, credit, line_count)
+        VALUES (%s, %s, %s, %s, %s, %s, %s)
+        ON CONFLICT (account_id, period_id, move_state) DO UPDATE
+        SET debit = mis_account_period_balance.debit + EXCLUDED.debit,
+            credit = mis_account_period_balance.credit + EXCLUDED.credit,
+            line_count = mis_account_period_balance.line_count
+                         + EXCLUDED.line_count"""
+
+_TRIGGER_FUNCTIONS = """
+    CREATE OR REPLACE FUNCTION mis_account_period_balance_aml()
+    RETURNS trigger AS $$
+    DECLARE
+        _state varchar;
+    BEGIN
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            SELECT state INTO _state FROM account_move WHERE id = OLD.move_id;
+            -- when the move is deleted, its lines have been removed
+            -- from the balances by mis_account_period_balance_move()
+            IF FOUND THEN
+                %(upsert_old)s;
+            END IF;
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            SELECT state INTO _state FROM account_move WHERE id = NEW.move_id;
+            %(upsert_new)s;
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE FUNCTION mis_account_period_balance_move()
+    RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'DELETE' THEN
+            %(upsert_move_old)s;
+            RETURN OLD;
+        END IF;
+        IF OLD.state IS DISTINCT FROM NEW.state THEN
+            %(upsert_move_old)s;
+            %(upsert_move_new)s;
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+"""
+
+_UPSERT_LINE = _UPSERT % (
+    '%(rec)s.company_id', '%(rec)s.account_id', '%(rec)s.period_id',
+    '_state', '%(sign)sCOALESCE(%(rec)s.debit, 0)',
+    '%(sign)sCOALESCE(%(rec)s.credit, 0)', '%(sign)s1')
+
+_UPSERT_MOVE = """
+        INSERT INTO mis_account_period_balance
+            (company_id, account_id, period_id, move_state,
+             debit, credit, line_count)
+        SELECT MIN(l.company_id), l.account_id, l.period_id, %(rec)s.state,
+               %(sign)sCOALESCE(SUM(l.debit), 0),
+               %(sign)sCOALESCE(SUM(l.credit), 0),
+               %(sign)sCOUNT(*)
+        FROM account_move_line l
+        WHERE l.move_id = %(rec)s.id
+        GROUP BY l.account_id, l.period_id
+        ON CONFLICT (account_id, period_id, move_state) DO UPDATE
+        SET debit = mis_account_period_balance.debit + EXCLUDED.debit,
+            credit = mis_account_period_balance.credit + EXCLUDED.credit,
+            line_count = mis_account_period_balance.line_count
+                         + EXCLUDED.line_count"""
+
+
+class MisAccountPeriodBalance(orm.Model):
+    """ Debit and credit of move lines by account, period and move state.
+
+    This optional table is maintained by database triggers on move lines
+    and moves, when enabled with the mis_builder.period_balance system
+    parameter (see enable() and disable()). The sql backend of the
+    AccountingExpressionProcessor reads it instead of the move lines
+    for accounting variables without move line domain, when columns
+    are based on fiscal periods.
+    """
+
+    _name = 'mis.account.period.balance'
+    _description = 'MIS Account Period Balance'
+    _auto = False
+    _log_access = False
+
+    _columns = {
+        'company_id': fields.many2one('res.company', string='Company',
+                                      readonly=True),
+        'account_id': fields.many2one('account.account', string='Account',
+                                      readonly=True),
+        'period_id': fields.many2one('account.period', string='Period',
+                                     readonly=True),
+        'move_state': fields.char(size=16, string='Move State',
+                                  readonly=True),
+        'debit': fields.float(string='Debit', readonly=True),
+        'credit': fields.float(string='Credit', readonly=True),
+        'line_count': fields.integer(string='Number of Move Lines',
+                                     readonly=True),
+    }
+
+    def init(self, cr):
+        cr.execute("""
+            CREATE TABLE IF NOT EXISTS mis_account_period_balance (
+                id serial,
+                company_id integer,
+                account_id integer NOT NULL,
+                period_id integer NOT NULL,
+                move_state varchar(16) NOT NULL,
+                debit numeric NOT NULL DEFAULT 0,
+                credit numeric NOT NULL DEFAULT 0,
+                line_count integer NOT NULL DEFAULT 0,
+                PRIMARY KEY (account_id, period_id, move_state)
+            )
+            """)
+        if self.is_enabled(cr):
+            self._create_triggers(cr)
+
+    def is_enabled(self, cr):
+        param = self.pool['ir.config_parameter'].get_param(
+            cr, SUPERUSER_ID, PARAM_ENABLED)
+        return bool(param) and param not in ('0', 'False', 'false')
+
+    def _create_triggers(self, cr):
+        cr.execute(_TRIGGER_FUNCTIONS % {
+            'upsert_old': _UPSERT_LINE % {'rec': 'OLD', 'sign': '-'},
+            'upsert_new': _UPSERT_LINE % {'rec': 'NEW', 'sign': ''},
+            'upsert_move_old': _UPSERT_MOVE % {'rec': 'OLD', 'sign': '-'},
+            'upsert_move_new': _UPSERT_MOVE % {'rec': 'NEW', 'sign': ''},
+        })
+        self._drop_triggers(cr)
+        cr.execute("""
+            CREATE TRIGGER mis_account_period_balance_aml
+            AFTER INSERT OR DELETE OR UPDATE OF
+                account_id, period_id, move_id, company_id, debit, credit
+            ON account_move_line
+            FOR EACH ROW EXECUTE PROCEDURE mis_account_period_balance_aml();
+
+            CREATE TRIGGER mis_account_period_balance_move_state
+            AFTER UPDATE OF state ON account_move
+            FOR EACH ROW EXECUTE PROCEDURE mis_account_period_balance_move();
+
+            CREATE TRIGGER mis_account_period_balance_move_unlink
+            BEFORE DELETE ON account_move
+            FOR EACH ROW EXECUTE PROCEDURE mis_account_period_balance_move();
+            """)
+
+    def _drop_triggers(self, cr):
+        cr.execute("""
+            DROP TRIGGER IF EXISTS mis_account_period_balance_aml
+                ON account_move_line;
+            DROP TRIGGER IF EXISTS mis_account_period_balance_move_state
+                ON account_move;
+            DROP TRIGGER IF EXISTS mis_account_period_balance_move_unlink
+                ON account_move;
+            """)
+
+    def _check_manager(self, cr, uid, context=None):
+        """ Only accounting managers may maintain the balance table. """
+        if uid != SUPERUSER_ID and not self.pool['res.users'].has_group(
+                cr, uid, 'account.group_account_manager'):
+            raise orm.except_orm(
+                _('Access Denied'),
+                _('Only accounting managers can maintain the MIS '
+                  'account period balances.'))
+
+    def enable(self, cr, uid, context=None):
+        """ Install the triggers and fill the balance table. """
+        self._check_manager(cr, uid, context=context)
+        self.pool['ir.config_parameter'].set_param(
+            cr, SUPERUSER_ID, PARAM_ENABLED, '1')
+        self._create_triggers(cr)
+        self.rebuild(cr, uid, context=context)
+        return True
+
+    def disable(self, cr, uid, context=None):
+        """ Remove the triggers and empty the balance table. """
+        self._check_manager(cr, uid, context=context)
+        self.pool['ir.config_parameter'].set_param(
+            cr, SUPERUSER_ID, PARAM_ENABLED, '0')
+        self._drop_triggers(cr)
+        cr.execute("TRUNCATE mis_account_period_balance")
+        return True
+
+    def rebuild(self, cr, uid, context=None):
+        """ Recompute the balance table from the move lines. """
+        self._check_manager(cr, uid, context=context)
+        # block writes on moves and move lines while rebuilding
+        cr.execute("LOCK TABLE account_move, account_move_line "
+                   "IN SHARE MODE")
+        cr.execute("TRUNCATE mis_account_period_balance")
+        cr.execute("""
+            INSERT INTO mis_account_period_balance
+                (company_id, account_id, period_id, move_state,
+                 debit, credit, line_count)
+            SELECT MIN(l.company_id), l.account_id, l.period_id, m.state,
+                   COALESCE(SUM(l.debit), 0), COALESCE(SUM(l.credit), 0),
+                   COUNT(*)
+            FROM account_move_line l
+            JOIN account_move m ON m.id = l.move_id
+            GROUP BY l.account_id, l.period_id, m.state
+            """)
+        _logger.info("rebuilt mis_account_period_balance with %s rows",
+                     cr.rowcount)
+        return True
+
+    def check(self, cr, uid, context=None):
+        """ Compare the balance table with the move lines.
+
+        Returns a list of (account_id, period_id, move_state) for which
+        the balance table is not consistent with the move lines.
+        """
+        self._check_manager(cr, uid, context=context)
+        cr.execute("""
+            SELECT COALESCE(b.account_id, r.account_id),
+                   COALESCE(b.period_id, r.period_id),
+                   COALESCE(b.move_state, r.move_state)
+            FROM (SELECT * FROM mis_account_period_balance
+                  WHERE line_count != 0) b
+            FULL OUTER JOIN (
+                SELECT l.account_id, l.period_id, m.state AS move_state,
+                       COALESCE(SUM(l.debit), 0) AS debit,
+                       COALESCE(SUM(l.credit), 0) AS credit,
+                       COUNT(*) AS line_count
+                FROM account_move_line l
+                JOIN account_move m ON m.id = l.move_id
+                GROUP BY l.account_id, l.period_id, m.state
+            ) r
+              ON r.account_id = b.account_id
+             AND r.period_id = b.period_id
+             AND r.move_state = b.move_state
+            WHERE b.account_id IS NULL OR r.account_id IS NULL
+               OR b.debit != r.debit OR b.credit != r.credit
+               OR b.line_count != r.line_count
+            """)
+        res = cr.fetchall()
+        if res:
+            _logger.warning("mis_account_period_balance is not consistent "
+                            "with move lines for %s rows", len(res))
+        return res
@@ -22,29 +22,50 @@
 #
 ##############################################################################
 
+import base64
+from collections import defaultdict
 import datetime
 import dateutil
 from dateutil import parser
+from functools import partial
+import hashlib
 import logging
+import os
 import re
+import tempfile
 import time
 import traceback
 
 import pytz
 
-from openerp.osv import orm, fields
-from openerp import tools
+from openerp.osv import expression, orm, fields
+from openerp import SUPERUSER_ID, tools
 from openerp.tools.safe_eval import safe_eval
 from openerp.tools.translate import _
 
 from .aep import AccountingExpressionProcessor as AEP
+from .aep_period import PeriodTimeline
+from .aep_expr import compile_expr
+from .kpi_graph import get_expr_attributes, get_expr_names, sort_kpis
+from .kpi_renderer import KpiRenderer
+from .parallel import get_max_workers, run_parallel
+from .query_result import LazyQueryResult, get_row_class
+from .safe_code import compile_safe, get_safe_builtins
 from .aggregate import _sum, _avg, _min, _max
+from .flat_export import get_raw_value, pyarrow, write_csv, write_parquet
+from .vectorized import numpy, compile_vectorized, evaluate_vectorized
 
 _logger = logging.getLogger(__name__)
 DATE_LENGTH = len(datetime.date.today().strftime(
     tools.DEFAULT_SERVER_DATE_FORMAT))
 DATETIME_LENGTH = len(datetime.datetime.now().strftime(
     tools.DEFAULT_SERVER_DATETIME_FORMAT))
+# rendering of KPI error codes
+KPI_ERRORS = {
+    'div0': '#DIV/0',
+    'err': '#ERR',
+    'cycle': '#ERR',
+}
 
 
 class AutoStruct(object):
@@ -54,13 +75,6 @@ class AutoStruct(object):
             setattr(self, k, v)
 
 
-def _get_selection_label(selection, value):
-    for v, l in selection:
-        if v == value:
-            return l
-    return ''
-
-
 def _utc_midnight(d, tz_name, add_day=0):
     d = d[:DATETIME_LENGTH]
     if len(d) == DATE_LENGTH:
@@ -187,62 +201,25 @@ class MisReportKpi(orm.Model):
             }
         return res
 
+    def _get_renderer(self, cr, uid, lang_id, context=None):
+        """ Return a KpiRenderer, to render many values in a language """
+        return KpiRenderer(cr, uid, self.pool, lang_id, context=context)
+
     def render(self, cr, uid, lang_id, kpi, value, context=None):
-        if value is None:
-            return '#N/A'
-        if kpi.type == 'num':
-            return self._render_num(cr, uid, lang_id, value, kpi.divider,
-                                    kpi.dp, kpi.suffix, context=context)
-        elif kpi.type == 'pct':
-            return self._render_num(cr, uid, lang_id, value, 0.01,
-                                    kpi.dp, '%', context=context)
-        else:
-            return unicode(value)
+        return self._get_renderer(cr, uid, lang_id, context=context).\
+            render(kpi, value)
 
     def _render_comparison(self, cr, uid, lang_id, kpi, value, base_value,
                            average_value, average_base_value, context=None):
         """ render the comparison of two KPI values, ready for display """
-        if value is None or base_value is None:
-            return ''
-        if kpi.type == 'pct':
-            return self._render_num(cr, uid, lang_id, value - base_value, 0.01,
-                                    kpi.dp, _('pp'), sign='+', context=context)
-        elif kpi.type == 'num':
-            if average_value:
-                value = value / float(average_value)
-            if average_base_value:
-                base_value = base_value / float(average_base_value)
-            if kpi.compare_method == 'diff':
-                return self._render_num(cr, uid, lang_id, value - base_value,
-                                        kpi.divider,
-                                        kpi.dp, kpi.suffix, sign='+',
-                                        context=context)
-            elif kpi.compare_method == 'pct':
-                if round(base_value, kpi.dp) != 0:
-                    return self._render_num(
-                        cr, uid, lang_id,
-                        (value - base_value) / abs(base_value),
-                        0.01, kpi.dp, '%', sign='+', context=context)
-        return ''
+        return self._get_renderer(cr, uid, lang_id, context=context).\
+            render_comparison(kpi, value, base_value,
+                              average_value, average_base_value)
 
     def _render_num(self, cr, uid, lang_id, value, divider,
                     dp, suffix, sign='-', context=None):
-        divider_label = _get_selection_label(
-            self._columns['divider'].selection, divider)
-        if divider_label == '1':
-            divider_label = ''
-        # format number following user language
-        value = round(value / float(divider or 1), dp) or 0
-        value = self.pool['res.lang'].format(
-            cr, uid, lang_id,
-            '%%%s.%df' % (sign, dp),
-            value,
-            grouping=True,
-            context=context)
-        value = u'%s\N{NO-BREAK SPACE}%s%s' % \
-            (value, divider_label, suffix or '')
-        value = value.replace('-', u'\N{NON-BREAKING HYPHEN}')
-        return value
+        return self._get_renderer(cr, uid, lang_id, context=context).\
+            render_num(value, divider, dp, suffix, sign=sign)
 
 
 class MisReportQuery(orm.Model):
@@ -279,8 +256,13 @@ class MisReportQuery(orm.Model):
                             string='Name'),
         'model_id': fields.many2one('ir.model', required=True,
                                     string='Model'),
-        'field_ids': fields.many2many('ir.model.fields', required=True,
-                                      string='Fields to fetch'),
+        'field_ids': fields.many2many(
+            'ir.model.fields', required=True,
+            string='Fields to fetch',
+            help='Without aggregate, records only get the fields used '
+                 'as attributes in KPI expressions (such as l.debit), '
+                 'or all fields when getattr() is used. Records passed '
+                 'to other functions only have these fields.'),
         'field_names': fields.function(_get_field_names, type='char',
                                        string='Fetched fields name',
                                        store={'mis.report.query':
@@ -365,6 +347,134 @@ class MisReport(orm.Model):
                     cr, uid, [kpi.id], {'sequence': idx + 1}, context=context)
         return res
 
+    def _get_kpi_version(self, cr, uid, report_id, context=None):
+        """ Return a token identifying the version of the KPI's
+        of a report template, ie that changes whenever a KPI
+        is created or deleted, or whenever a field used by the
+        cached compilations changes.
+
+        The token is a tuple of (kpi id, digest) pairs, the digest
+        hashing the name, sequence, expression and CSS style of the
+        KPI. Write dates are not enough, as they are the timestamp
+        of the transaction, shared by successive writes.
+        """
+        cr.execute("""
+            SELECT id, name, sequence, expression, css_style
+            FROM mis_report_kpi
+            WHERE report_id = %s
+            ORDER BY id
+            """, (report_id, ))
+        return tuple((row[0], hashlib.sha1(repr(row[1:])).hexdigest())
+                     for row in cr.fetchall())
+
+    @tools.ormcache(skiparg=3, size=128)
+    def _compile_kpis(self, cr, uid, report_id, version):
+        """ Compile the KPI expressions of a report template version.
+
+        The result is cached and must not be modified.
+
+        Returns a dictionary {kpi id: CompiledExpression}.
+        """
+        kpi_ids = [kpi_id for kpi_id, digest in version]
+        res = {}
+        for kpi in self.pool['mis.report.kpi'].read(
+                cr, uid, kpi_ids, ['expression']):
+            res[kpi['id']] = compile_expr(kpi['expression'])
+        return res
+
+    def _get_compiled_kpis(self, cr, uid, report_id, context=None):
+        """ Return the compiled KPI expressions of a report template,
+        compiling them only once per template version. """
+        version = self._get_kpi_version(cr, uid, report_id, context=context)
+        return self._compile_kpis(cr, uid, report_id, version)
+
+    @tools.ormcache(skiparg=3, size=128)
+    def _schedule_kpis(self, cr, uid, report_id, version):
+        """ Sort the KPI's of a report template version so each KPI
+        is evaluated after the KPI's it references.
+
+        The result is cached and must not be modified.
+
+        Returns a (sorted kpi ids, cyclic kpi ids) tuple, where
+        cyclic kpi ids is the set of KPI's that are part of a
+        circular reference and cannot be evaluated.
+        """
+        compiled_kpis = self._compile_kpis(cr, uid, report_id, version)
+        kpis = self.pool['mis.report.kpi'].read(
+            cr, uid, list(compiled_kpis), ['name', 'sequence'])
+        kpis.sort(key=lambda kpi: (kpi['sequence'], kpi['id']))
+        kpi_ids_by_name = {}
+        dependencies = {}
+        for kpi in kpis:
+            kpi_ids_by_name[kpi['name']] = kpi['id']
+            dependencies[kpi['name']] = get_expr_names(
+                compiled_kpis[kpi['id']].source)
+        kpi_names, cyclic_kpi_names = sort_kpis(
+            [kpi['name'] for kpi in kpis], dependencies)
+        return ([kpi_ids_by_name[kpi_name] for kpi_name in kpi_names],
+                frozenset(kpi_ids_by_name[kpi_name]
+                          for kpi_name in cyclic_kpi_names))
+
+    def _get_kpi_schedule(self, cr, uid, report_id, context=None):
+        """ Return the KPI evaluation order of a report template,
+        computing it only once per template version
+        (see _schedule_kpis()). """
+        version = self._get_kpi_version(cr, uid, report_id, context=context)
+        return self._schedule_kpis(cr, uid, report_id, version)
+
+    @tools.ormcache(skiparg=3, size=128)
+    def _compile_kpi_code(self, cr, uid, report_id, version):
+        """ Compile the KPI expressions and CSS style expressions
+        of a report template version to python code.
+
+        The result is cached and must not be modified.
+
+        Returns a dictionary {kpi id: (expression SafeCode,
+        css style SafeCode)}, where SafeCode is None for expressions
+        that are empty or cannot be compiled.
+        """
+        compiled_kpis = self._compile_kpis(cr, uid, report_id, version)
+        res = {}
+        for kpi in self.pool['mis.report.kpi'].read(
+                cr, uid, list(compiled_kpis), ['css_style']):
+            res[kpi['id']] = (compile_safe(compiled_kpis[kpi['id']].source),
+                              compile_safe(kpi['css_style']))
+        return res
+
+    def _get_kpi_code(self, cr, uid, report_id, context=None):
+        """ Return the compiled python code of the KPI's of a report
+        template, compiling it only once per template version
+        (see _compile_kpi_code()). """
+        version = self._get_kpi_version(cr, uid, report_id, context=context)
+        return self._compile_kpi_code(cr, uid, report_id, version)
+
+    @tools.ormcache(skiparg=3, size=128)
+    def _collect_kpi_attributes(self, cr, uid, report_id, version):
+        """ Return the frozenset of attribute names used in the KPI
+        expressions and CSS style expressions of a report template
+        version, ie the fields of query records that may be used,
+        or None when attributes are also read with getattr(), in
+        which case any field may be used.
+        """
+        compiled_kpis = self._compile_kpis(cr, uid, report_id, version)
+        res = set()
+        for kpi in self.pool['mis.report.kpi'].read(
+                cr, uid, list(compiled_kpis), ['css_style']):
+            for expr in (compiled_kpis[kpi['id']].source, kpi['css_style']):
+                if not expr:
+                    continue
+                if 'getattr' in get_expr_names(expr):
+                    return None
+                res.update(get_expr_attributes(expr))
+        return frozenset(res)
+
+    def _get_kpi_attributes(self, cr, uid, report_id, context=None):
+        """ Return the attribute names used in the KPI's of a report
+        template, collecting them only once per template version
+        (see _collect_kpi_attributes()). """
+        version = self._get_kpi_version(cr, uid, report_id, context=context)
+        return self._collect_kpi_attributes(cr, uid, report_id, version)
+
 
 class MisReportInstancePeriod(orm.Model):
     """ A MIS report instance has the logic to compute
@@ -550,78 +660,418 @@ class MisReportInstancePeriod(orm.Model):
         else:
             return False
 
-    def _fetch_queries(self, cr, uid, c, context):
+    @staticmethod
+    def _get_kpi_dependencies(report, kpi_id, compiled_kpis):
+        """ Return the (ids of the KPI's, names) needed to evaluate
+        a KPI and its CSS style: the KPI itself, the KPI's it references,
+        directly or not, and all the names they use. """
+        kpis_by_name = dict((kpi.name, kpi) for kpi in report.kpi_ids)
+        kpis_by_id = dict((kpi.id, kpi) for kpi in report.kpi_ids)
+        kpi_ids = set()
+        names = set()
+        to_visit = [kpis_by_id[kpi_id]]
+        while to_visit:
+            kpi = to_visit.pop()
+            if kpi.id in kpi_ids:
+                continue
+            kpi_ids.add(kpi.id)
+            kpi_names = get_expr_names(compiled_kpis[kpi.id].source)
+            if kpi.css_style:
+                kpi_names |= get_expr_names(kpi.css_style)
+            names |= kpi_names
+            to_visit.extend(kpis_by_name[name] for name in kpi_names
+                            if name in kpis_by_name)
+        return kpi_ids, names
+
+    def error_detail(self, cr, uid, _id, kpi_id, context=None):
+        """ Explain why a KPI cannot be evaluated for this period.
+
+        The KPI is evaluated again to obtain the error, with the KPI's
+        and queries it depends on only, so error messages and
+        tracebacks are only produced on demand.
+
+        Returns the error message, or False if there is no error.
+        """
+        if context is None:
+            context = {}
+        this = self.browse(cr, uid, _id, context=context)
+        r = this.report_instance_id
+        kpi = self.pool['mis.report.kpi'].browse(
+            cr, uid, kpi_id, context=context)
+        if kpi.report_id.id != r.report_id.id:
+            raise orm.except_orm(_('Error!'),
+                                 _('KPI %s does not belong to the report '
+                                   'of period %s.') % (kpi.name, this.name))
+        report_obj = self.pool['mis.report']
+        compiled_kpis = report_obj._get_compiled_kpis(
+            cr, uid, r.report_id.id, context=context)
+        sorted_kpi_ids, cyclic_kpi_ids = report_obj._get_kpi_schedule(
+            cr, uid, r.report_id.id, context=context)
+        kpi_ids, names = self._get_kpi_dependencies(
+            r.report_id, kpi.id, compiled_kpis)
+        aep = AEP(cr, backend=r.aep_backend)
+        for dep_kpi_id in kpi_ids:
+            aep.parse_expr(compiled_kpis[dep_kpi_id])
+        aep.done_parsing(cr, uid, r.root_account, context=context)
+        lang_id = self.pool['mis.report.instance']._get_lang_id(
+            cr, uid, context=context)
+        diagnostics = {}
+        self._compute(cr, uid, lang_id, this, aep,
+                      compiled_kpis=compiled_kpis,
+                      kpi_schedule=([i for i in sorted_kpi_ids
+                                     if i in kpi_ids],
+                                    cyclic_kpi_ids & kpi_ids),
+                      diagnostics=diagnostics,
+                      query_values=self._fetch_queries(
+                          cr, uid, this, context, query_names=names),
+                      context=context)
+        if kpi.id not in diagnostics:
+            return False
+        return kpi.name + " = " + kpi.expression + \
+            '\n\n%s' % (diagnostics[kpi.id], )
+
+    @staticmethod
+    def _can_aggregate_in_sql(obj, field_names):
+        """ Test if fields are numeric columns stored in the table
+        of a model, so they can be aggregated by _aggregate_in_sql(). """
+        for field_name in field_names:
+            column = obj._columns.get(field_name)
+            if column is None or not column._classic_write or \
+                    column._type not in ('integer', 'float'):
+                return False
+        return True
+
+    @staticmethod
+    def _get_aggregate_selects(obj, field_names, aggregate):
+        """ Return the SQL expressions aggregating fields,
+        for _aggregate_in_sql(). """
+        selects = []
+        for field_name in field_names:
+            column = '"%s"."%s"' % (obj._table, field_name)
+            if aggregate == 'avg':
+                select = 'AVG(COALESCE(%s, 0))::float' % column
+            else:
+                select = '%s(COALESCE(%s, 0))' % (aggregate.upper(), column)
+                if obj._columns[field_name]._type == 'float':
+                    # numeric columns would be fetched as Decimal
+                    select += '::float'
+            selects.append(select)
+        return selects
+
+    def _aggregate_in_sql(self, cr, uid, obj, domain, field_names,
+                          aggregate, context=None):
+        """ Aggregate numeric fields of the records matching a domain
+        in one SQL statement, applying record rules.
+
+        Like the read() of the records, null values count as zero.
+        Like the functions of the aggregate module, the aggregate of
+        each field is None when there is no record.
+
+        Returns an AutoStruct with the count of records and the
+        aggregate of each field.
+        """
+        obj.check_access_rights(cr, uid, 'read')
+        query = obj._where_calc(cr, uid, domain, context=context)
+        obj._apply_ir_rules(cr, uid, query, 'read', context=context)
+        from_clause, where_clause, where_params = query.get_sql()
+        selects = ['COUNT(*)'] + \
+            self._get_aggregate_selects(obj, field_names, aggregate)
+        cr.execute('SELECT ' + ', '.join(selects) +
+                   ' FROM ' + from_clause +
+                   (where_clause and ' WHERE ' + where_clause or ''),
+                   where_params)
+        row = cr.fetchone()
+        s = AutoStruct(count=row[0])
+        for field_name, v in zip(field_names, row[1:]):
+            setattr(s, field_name, v)
+        return s
+
+    def _aggregate_in_sql_by_dates(self, cr, uid, obj, domain, field_names,
+                                   aggregate, date_field, date_bounds,
+                                   context=None):
+        """ Same as _aggregate_in_sql(), for several date ranges at once.
+
+        date_bounds is a list of (key, date_from, date_to, to_operator)
+        tuples, defining the ranges of date_field, where to_operator
+        is '<=' or '<'.
+
+        Returns a dictionary {key: AutoStruct}.
+        """
+        res = {}
+        for key, date_from, date_to, to_operator in date_bounds:
+            s = res[key] = AutoStruct(count=0)
+            for field_name in field_names:
+                setattr(s, field_name, None)
+        if not date_bounds:
+            return res
+        obj.check_access_rights(cr, uid, 'read')
+        query = obj._where_calc(cr, uid, domain, context=context)
+        obj._apply_ir_rules(cr, uid, query, 'read', context=context)
+        from_clause, where_clause, where_params = query.get_sql()
+        cast = obj._columns[date_field]._type == 'date' and \
+            'date' or 'timestamp'
+        to_operator = date_bounds[0][3]
+        values_params = []
+        for key, date_from, date_to, _op in date_bounds:
+            values_params.extend([key, date_from, date_to])
+        column = '"%s"."%s"' % (obj._table, date_field)
+        wheres = [column + ' >= cols.date_from',
+                  column + ' ' + to_operator + ' cols.date_to']
+        if where_clause:
+            wheres.append(where_clause)
+        selects = ['cols.idx', 'COUNT(*)'] + \
+            self._get_aggregate_selects(obj, field_names, aggregate)
+        cr.execute('SELECT ' + ', '.join(selects) +
+                   ' FROM ' + from_clause + ', (VALUES ' +
+                   ', '.join(['(%s, %s::' + cast + ', %s::' + cast + ')'] *
+                             len(date_bounds)) +
+                   ') AS cols (idx, date_from, date_to)' +
+                   ' WHERE ' + ' AND '.join(wheres) +
+                   ' GROUP BY cols.idx',
+                   values_params + where_params)
+        for row in cr.fetchall():
+            s = res[row[0]]
+            s.count = row[1]
+            for field_name, v in zip(field_names, row[2:]):
+                setattr(s, field_name, v)
+        return res
+
+    def _get_query_domain(self, cr, uid, c, query, context):
+        """ Return the domain of a query for a period,
+        without the filter on the date field. """
+        obj = self.pool[query.model_id.model]
+        eval_context = {
+            'time': time,
+            'datetime': datetime,
+            'dateutil': dateutil,
+            # deprecated
+            'uid': uid,
+            'context': context,
+        }
+
+        if not c.date_from or not c.date_to:
+            raise orm.except_orm(_('Error!'),
+                                 _('Please define From and To dates for '
+                                   'period %s.') % c.name)
+        domain = query.domain and \
+            safe_eval(query.domain, eval_context) or []
+        domain.extend(self._get_additional_query_filter(
+            cr, uid, c.id, query, context=context))
+        if obj._columns.get('company_id', False):
+            domain.extend(['|', ('company_id', '=', False),
+                           ('company_id', '=', c.company_id.id)])
+        return domain
+
+    @staticmethod
+    def _get_query_date_bounds(c, query, context):
+        """ Return the (date_from, date_to, to_operator) bounds of the
+        date field of a query for a period, where to_operator is '<='
+        or '<'. Datetimes are the UTC midnights of the timezone
+        of the context. """
+        if query.date_field.ttype == 'date':
+            return c.date_from, c.date_to, '<='
+        tz = context.get('tz', False) or 'UTC'
+        return _utc_midnight(c.date_from, tz), \
+            _utc_midnight(c.date_to, tz, add_day=1), '<'
+
+    def _get_query_field_names(self, cr, uid, query, context=None):
+        """ Return the fields to fetch for a query. Records of
+        queries without aggregate only get the fields used
+        as attributes in the KPI's. """
+        field_names = [f.name for f in query.field_ids]
+        if query.aggregate:
+            return field_names
+        kpi_attributes = self.pool['mis.report']._get_kpi_attributes(
+            cr, uid, query.report_id.id, context=context)
+        if kpi_attributes is None:
+            return field_names
+        return [field_name for field_name in field_names
+                if field_name in kpi_attributes]
+
+    def _fetch_query(self, cr, uid, query, domain, context):
+        """ Fetch the data of a query, for a domain including the
+        filter on the date field.
+
+        The records of queries without aggregate are fetched
+        when they are used (see LazyQueryResult). """
+        obj = self.pool[query.model_id.model]
+        field_names = self._get_query_field_names(
+            cr, uid, query, context=context)
+        if not query.aggregate:
+            return LazyQueryResult(cr, uid, obj, domain, field_names,
+                                   context=context)
+        elif self._can_aggregate_in_sql(obj, field_names):
+            return self._aggregate_in_sql(
+                cr, uid, obj, domain, field_names, query.aggregate,
+                context=context)
+        elif query.aggregate == 'sum':
+            data = obj.read_group(
+                cr, uid, domain, field_names, '', context=context)
+            s = AutoStruct(count=data[0]['_count'])
+            for field_name in field_names:
+                v = data[0][field_name]
+                setattr(s, field_name, v)
+            return s
+        else:
+            obj_ids = obj.search(cr, uid, domain, context=context)
+            data = obj.read(
+                cr, uid, obj_ids, field_names, context=context)
+            s = AutoStruct(count=len(data))
+            if query.aggregate == 'min':
+                agg = _min
+            elif query.aggregate == 'max':
+                agg = _max
+            elif query.aggregate == 'avg':
+                agg = _avg
+            for field_name in field_names:
+                setattr(s, field_name,
+                        agg([d[field_name] for d in data]))
+            return s
+
+    def _fetch_queries(self, cr, uid, c, context, query_names=None):
+        """ Fetch the data of the queries of the report for a period,
+        or of the queries named in query_names when it is given.
+
+        Returns a dictionary {query name: data}.
+        """
         res = {}
         report = c.report_instance_id.report_id
         for query in report.query_ids:
-            obj = self.pool[query.model_id.model]
-            eval_context = {
-                'time': time,
-                'datetime': datetime,
-                'dateutil': dateutil,
-                # deprecated
-                'uid': uid,
-                'context': context,
-            }
+            if query_names is not None and query.name not in query_names:
+                continue
+            domain = self._get_query_domain(cr, uid, c, query, context)
+            date_from, date_to, to_operator = \
+                self._get_query_date_bounds(c, query, context)
+            domain.extend([(query.date_field.name, '>=', date_from),
+                           (query.date_field.name, to_operator, date_to)])
+            res[query.name] = self._fetch_query(
+                cr, uid, query, domain, context)
+        return res
 
-            if not c.date_from or not c.date_to:
-                raise orm.except_orm(_('Error!'),
-                                     _('Please define From and To dates for '
-                                       'period %s.') % c.name)
-            domain = query.domain and \
-                safe_eval(query.domain, eval_context) or []
-            domain.extend(self._get_additional_query_filter(
-                cr, uid, c.id, query, context=context))
-            if query.date_field.ttype == 'date':
-                domain.extend([(query.date_field.name, '>=', c.date_from),
-                               (query.date_field.name, '<=', c.date_to)])
-            else:
-                tz = context.get('tz', False) or 'UTC'
-                datetime_from = _utc_midnight(
-                    c.date_from, tz)
-                datetime_to = _utc_midnight(
-                    c.date_to, tz, add_day=1)
-                domain.extend([(query.date_field.name, '>=', datetime_from),
-                               (query.date_field.name, '<', datetime_to)])
-            if obj._columns.get('company_id', False):
-                domain.extend(['|', ('company_id', '=', False),
-                               ('company_id', '=', c.company_id.id)])
-            field_names = [f.name for f in query.field_ids]
-            if not query.aggregate:
-                obj_ids = obj.search(cr, uid, domain, context=context)
-                data = obj.read(
-                    cr, uid, obj_ids, field_names, context=context)
-                res[query.name] = [AutoStruct(**d) for d in data]
-            elif query.aggregate == 'sum':
-                data = obj.read_group(
-                    cr, uid, domain, field_names, '', context=context)
-                s = AutoStruct(count=data[0]['_count'])
-                for field_name in field_names:
-                    v = data[0][field_name]
-                    setattr(s, field_name, v)
-                res[query.name] = s
-            else:
+    def _fetch_queries_multi(self, cr, uid, periods, context):
+        """ Fetch the data of queries for several periods of an instance.
+
+        Each query is done once for all periods having the same domain,
+        over the union of their date ranges, and its result is split
+        by period in memory. Aggregates of numeric fields are computed
+        in one SQL statement grouped by period. Other aggregates are
+        fetched for each period, as by _fetch_queries().
+
+        Returns a dictionary {period id: {query name: data}}.
+        """
+        res = dict((c.id, {}) for c in periods)
+        if not periods:
+            return res
+        report = periods[0].report_instance_id.report_id
+        for query in report.query_ids:
+            obj = self.pool[query.model_id.model]
+            field_names = self._get_query_field_names(
+                cr, uid, query, context=context)
+            date_field = query.date_field.name
+            # group periods having the same domain
+            # [(domain, [(period id, date_from, date_to, to_operator)])]
+            groups = []
+            for c in periods:
+                domain = self._get_query_domain(cr, uid, c, query, context)
+                date_bounds = (c.id, ) + \
+                    self._get_query_date_bounds(c, query, context)
+                for group_domain, group_date_bounds in groups:
+                    if group_domain == domain:
+                        group_date_bounds.append(date_bounds)
+                        break
+                else:
+                    groups.append((domain, [date_bounds]))
+            for domain, group_date_bounds in groups:
+                if query.aggregate and \
+                        not self._can_aggregate_in_sql(obj, field_names):
+                    for c_id, date_from, date_to, to_operator in \
+                            group_date_bounds:
+                        res[c_id][query.name] = self._fetch_query(
+                            cr, uid, query, domain + [
+                                (date_field, '>=', date_from),
+                                (date_field, to_operator, date_to)],
+                            context)
+                    continue
+                # records in the date range of any period, and not
+                # between periods that are not adjacent
+                date_domains = []
+                for c_id, date_from, date_to, to_operator in \
+                        group_date_bounds:
+                    date_domain = [(date_field, '>=', date_from),
+                                   (date_field, to_operator, date_to)]
+                    if date_domain not in date_domains:
+                        date_domains.append(date_domain)
+                domain = domain + expression.OR(date_domains)
+                if query.aggregate:
+                    for c_id, s in self._aggregate_in_sql_by_dates(
+                            cr, uid, obj, domain, field_names,
+                            query.aggregate, date_field, group_date_bounds,
+                            context=context).items():
+                        res[c_id][query.name] = s
+                    continue
                 obj_ids = obj.search(cr, uid, domain, context=context)
-                data = obj.read(
-                    cr, uid, obj_ids, field_names, context=context)
-                s = AutoStruct(count=len(data))
-                if query.aggregate == 'min':
-                    agg = _min
-                elif query.aggregate == 'max':
-                    agg = _max
-                elif query.aggregate == 'avg':
-                    agg = _avg
-                for field_name in field_names:
-                    setattr(s, field_name,
-                            agg([d[field_name] for d in data]))
-                res[query.name] = s
+                data = obj.read(cr, uid, obj_ids,
+                                field_names + [date_field], context=context)
+                row_class = get_row_class(field_names)
+                rows = []
+                for d in data:
+                    date = d[date_field]
+                    if date_field not in field_names:
+                        del d[date_field]
+                    rows.append((date, row_class(**d)))
+                for c_id, date_from, date_to, to_operator in \
+                        group_date_bounds:
+                    if to_operator == '<':
+                        res[c_id][query.name] = [
+                            row for date, row in rows
+                            if date and date_from <= date < date_to]
+                    else:
+                        res[c_id][query.name] = [
+                            row for date, row in rows
+                            if date and date_from <= date <= date_to]
         return res
 
-    def _compute(self, cr, uid, lang_id, c, aep, context=None):
+    def _compute(self, cr, uid, lang_id, c, aep, compiled_kpis=None,
+                 kpi_values=None, kpi_schedule=None, kpi_code=None,
+                 diagnostics=None, renderer=None, query_values=None,
+                 context=None):
+        """ Compute the KPI's of a report for a period.
+
+        KPI's that cannot be evaluated have an error code
+        (see KPI_ERRORS). When diagnostics is a dictionary,
+        it is filled with {kpi id: error message} for those KPI's.
+
+        kpi_values is an optional dictionary {kpi name: value} of
+        KPI's already evaluated for this period (None meaning a
+        division by zero), which are then not evaluated again.
+        compiled_kpis, kpi_schedule and kpi_code are the compiled KPI's,
+        the KPI evaluation order and the KPI python code of the report
+        template, as returned by mis.report _get_compiled_kpis(),
+        _get_kpi_schedule() and _get_kpi_code(). renderer is the
+        KpiRenderer of the language lang_id. query_values is the
+        optional data of the queries for this period, as returned
+        by _fetch_queries(), which are then not fetched again.
+        """
         if context is None:
             context = {}
+        if kpi_values is None:
+            kpi_values = {}
 
         kpi_obj = self.pool['mis.report.kpi']
+        report_obj = self.pool['mis.report']
+        report = c.report_instance_id.report_id
+        if compiled_kpis is None:
+            compiled_kpis = report_obj._get_compiled_kpis(
+                cr, uid, report.id, context=context)
+        if kpi_schedule is None:
+            kpi_schedule = report_obj._get_kpi_schedule(
+                cr, uid, report.id, context=context)
+        if kpi_code is None:
+            kpi_code = report_obj._get_kpi_code(
+                cr, uid, report.id, context=context)
+        if renderer is None:
+            renderer = kpi_obj._get_renderer(cr, uid, lang_id,
+                                             context=context)
 
         res = {}
 
@@ -634,78 +1084,105 @@ class MisReportInstancePeriod(orm.Model):
             'avg': _avg,
         }
 
-        localdict.update(self._fetch_queries(cr, uid, c, context=context))
+        if query_values is None:
+            query_values = self._fetch_queries(cr, uid, c, context=context)
+        localdict.update(query_values)
+        # for the evaluation of compiled code
+        localdict['__builtins__'] = get_safe_builtins()
 
-        aep.do_queries(cr, uid, c.date_from, c.date_to,
-                       c.period_from, c.period_to,
-                       c.report_instance_id.target_move,
-                       self._get_additional_move_line_filter(cr, uid, c.id,
-                                                             context=context),
-                       context=context)
-
-        compute_queue = c.report_instance_id.report_id.kpi_ids
-        recompute_queue = []
-        while True:
-            for kpi in compute_queue:
+        if aep.has_period(c.id):
+            # accounting data already queried with do_queries_multi
+            aep.set_period(c.id)
+        else:
+            aep.do_queries(cr, uid, c.date_from, c.date_to,
+                           c.period_from, c.period_to,
+                           c.report_instance_id.target_move,
+                           self._get_additional_move_line_filter(
+                               cr, uid, c.id, context=context),
+                           context=context)
+
+        kpis_by_id = dict((kpi.id, kpi) for kpi in report.kpi_ids)
+        sorted_kpi_ids, cyclic_kpi_ids = kpi_schedule
+        # kpi's with a value to render
+        kpis_to_render = []
+        for kpi_id in sorted_kpi_ids:
+            kpi = kpis_by_id[kpi_id]
+            compiled = compiled_kpis[kpi.id]
+            expr_code, css_style_code = kpi_code[kpi.id]
+            kpi_val_comment = kpi.name + " = " + kpi.expression
+            kpi_error = None
+            if kpi.id in cyclic_kpi_ids:
+                kpi_val = None
+                kpi_error = 'cycle'
+                if diagnostics is not None:
+                    diagnostics[kpi.id] = \
+                        _('Circular reference between KPI\'s')
+            else:
                 try:
-                    kpi_val_comment = kpi.name + " = " + kpi.expression
-                    kpi_eval_expression = aep.replace_expr(kpi.expression)
-                    kpi_val = safe_eval(kpi_eval_expression, localdict)
+                    if kpi.name in kpi_values:
+                        kpi_val = kpi_values[kpi.name]
+                        if kpi_val is None:
+                            raise ZeroDivisionError()
+                    else:
+                        localdict.update(aep.get_slot_values(compiled))
+                        if expr_code is not None:
+                            kpi_val = expr_code.eval(localdict)
+                        else:
+                            kpi_val = safe_eval(compiled.source, localdict)
                     localdict[kpi.name] = kpi_val
                 except ZeroDivisionError:
                     kpi_val = None
-                    kpi_val_rendered = '#DIV/0'
-                    kpi_val_comment += '\n\n%s' % (traceback.format_exc(),)
-                except (NameError, ValueError):
-                    recompute_queue.append(kpi)
-                    kpi_val = None
-                    kpi_val_rendered = '#ERR'
-                    kpi_val_comment += '\n\n%s' % (traceback.format_exc(),)
+                    kpi_error = 'div0'
+                    if diagnostics is not None:
+                        diagnostics[kpi.id] = traceback.format_exc()
                 except:
                     kpi_val = None
-                    kpi_val_rendered = '#ERR'
-                    kpi_val_comment += '\n\n%s' % (traceback.format_exc(),)
-                else:
-                    kpi_val_rendered = kpi_obj.render(
-                        cr, uid, lang_id, kpi, kpi_val, context=context)
+                    kpi_error = 'err'
+                    if diagnostics is not None:
+                        diagnostics[kpi.id] = traceback.format_exc()
+            if kpi_error:
+                kpi_val_rendered = KPI_ERRORS[kpi_error]
+            else:
+                # rendered below, with all values of the period
+                kpi_val_rendered = None
+                kpis_to_render.append(kpi)
+
+            try:
+                kpi_style = None
+                if css_style_code is not None:
+                    kpi_style = css_style_code.eval(localdict)
+                elif kpi.css_style:
+                    kpi_style = safe_eval(kpi.css_style, localdict)
+            except:
+                _logger.warning("error evaluating css stype expression %s",
+                                kpi.css_style, exc_info=True)
+                kpi_style = None
+
+            drilldown = (kpi_val is not None and
+                         bool(compiled.variables))
+
+            res[kpi.name] = {
+                'val': kpi_val,
+                'val_r': kpi_val_rendered,
+                'val_c': kpi_val_comment,
+                'error': kpi_error,
+                'kpi_id': kpi.id,
+                'style': kpi_style,
+                'default_style': kpi.default_css_style or None,
+                'suffix': kpi.suffix,
+                'dp': kpi.dp,
+                'is_percentage': kpi.type == 'pct',
+                'period_id': c.id,
+                'expr': kpi.expression,
+                'drilldown': drilldown,
+            }
 
-                try:
-                    kpi_style = None
-                    if kpi.css_style:
-                        kpi_style = safe_eval(kpi.css_style, localdict)
-                except:
-                    _logger.warning("error evaluating css stype expression %s",
-                                    kpi.css_style, exc_info=True)
-                    kpi_style = None
-
-                drilldown = (kpi_val is not None and
-                             AEP.has_account_var(kpi.expression))
-
-                res[kpi.name] = {
-                    'val': kpi_val,
-                    'val_r': kpi_val_rendered,
-                    'val_c': kpi_val_comment,
-                    'style': kpi_style,
-                    'default_style': kpi.default_css_style or None,
-                    'suffix': kpi.suffix,
-                    'dp': kpi.dp,
-                    'is_percentage': kpi.type == 'pct',
-                    'period_id': c.id,
-                    'expr': kpi.expression,
-                    'drilldown': drilldown,
-                }
-
-            if len(recompute_queue) == 0:
-                # nothing to recompute, we are done
-                break
-            if len(recompute_queue) == len(compute_queue):
-                # could not compute anything in this iteration
-                # (ie real Value errors or cyclic dependency)
-                # so we stop trying
-                break
-            # try again
-            compute_queue = recompute_queue
-            recompute_queue = []
+        for kpi, kpi_val_rendered in zip(
+                kpis_to_render,
+                renderer.render_values(
+                    kpis_to_render,
+                    [res[kpi.name]['val'] for kpi in kpis_to_render])):
+            res[kpi.name]['val_r'] = kpi_val_rendered
 
         return res
 
@@ -753,11 +1230,90 @@ class MisReportInstance(orm.Model):
         'root_account': fields.many2one('account.account',
                                         domain='[("parent_id", "=", False)]',
                                         string="Account chart",
-                                        required=True)
+                                        required=True),
+        'aep_backend': fields.selection(
+            [('sql', 'SQL'),
+             ('orm', 'ORM'),
+             ],
+            string='Accounting query backend',
+            required=True,
+            help='SQL queries the journal items table directly, '
+                 'with one query for all periods. ORM, the default, '
+                 'is slower but honors customizations of the journal '
+                 'items model. Both apply the record rules on journal '
+                 'items.'),
+        'vectorized_evaluation': fields.boolean(
+            string='Vectorized evaluation',
+            help='Evaluate purely arithmetic KPI\'s for all periods '
+                 'at once. This requires the numpy python library.'),
+        'fetch_queries_once': fields.boolean(
+            string='Fetch queries once',
+            help='Fetch the data of queries once for all periods, over '
+                 'the union of their dates, and split it by period in '
+                 'memory. This is faster when periods overlap or are '
+                 'adjacent.'),
+        'query_workers': fields.integer(
+            string='Parallel queries',
+            help='Number of database connections used to query accounting '
+                 'data in parallel, at most half of the db_maxconn '
+                 'option of the server. All connections see the same '
+                 'snapshot of the database. Queries run sequentially '
+                 'when the transaction has uncommitted changes, which '
+                 'other connections would not see.'),
+        'result_cache': fields.selection(
+            [('none', 'No cache'),
+             ('user', 'Per user'),
+             ('shared', 'Shared by all users'),
+             ],
+            string='Result cache',
+            required=True,
+            help='Keep computed results until accounting data or the '
+                 'report definition change. Shared results are shared '
+                 'by users having the same groups and companies: use a '
+                 'per user cache when record rules depend on other '
+                 'properties of the users. Data of queries on other '
+                 'models is refreshed when the cached results expire.'),
+        'precomputed': fields.boolean(
+            string='Precomputed',
+            help='Compute this report periodically in the background, '
+                 'and show the latest snapshot while it is fresh. '
+                 'Snapshots are computed in each installed language with '
+                 'the access rights of the user of the scheduled action, '
+                 'and only shown to users having the same groups and '
+                 'companies.'),
+        'snapshot_validity': fields.integer(
+            string='Snapshot validity (hours)',
+            help='Snapshots older than this are not shown, '
+                 'and the report is computed instead.'),
+        'snapshot_ids': fields.one2many('mis.report.instance.snapshot',
+                                        'instance_id',
+                                        string='Snapshots',
+                                        readonly=True),
     }
 
+    def _check_query_workers(self, cr, uid, ids, context=None):
+        for r in self.browse(cr, uid, ids, context=context):
+            if r.query_workers > get_max_workers():
+                return False
+        return True
+
+    _constraints = [
+        (_check_query_workers,
+         'Too many parallel queries for the database connections '
+         'of the server (db_maxconn)', ['query_workers']),
+    ]
+
+    _sql_constraints = [
+        ('query_workers', 'CHECK (query_workers>0)',
+         'Wrong number of parallel queries, it must be positive!'),
+    ]
+
     _defaults = {
         'target_move': 'posted',
+        'aep_backend': 'orm',
+        'query_workers': 1,
+        'result_cache': 'none',
+        'snapshot_validity': 24,
     }
 
     def create(self, cr, uid, vals, context=None):
@@ -774,13 +1330,18 @@ class MisReportInstance(orm.Model):
                     mis_report_instance_period_obj.write(
                         cr, uid, [line[1]], {'sequence': idx + 1},
                         context=context)
-        return super(MisReportInstance, self).create(cr, uid, vals,
-                                                     context=context)
+        res = super(MisReportInstance, self).create(cr, uid, vals,
+                                                    context=context)
+        if vals.get('result_cache', 'none') != 'none':
+            self.pool['mis.report.result.cache']._update_triggers(cr)
+        return res
 
     def write(self, cr, uid, ids, vals, context=None):
         # TODO: explain this
         res = super(MisReportInstance, self).write(
             cr, uid, ids, vals, context=context)
+        if 'result_cache' in vals:
+            self.pool['mis.report.result.cache']._update_triggers(cr)
         mis_report_instance_period_obj = self.pool.get(
             'mis.report.instance.period')
         for instance in self.browse(cr, uid, ids, context):
@@ -790,6 +1351,12 @@ class MisReportInstance(orm.Model):
                     context=context)
         return res
 
+    def unlink(self, cr, uid, ids, context=None):
+        res = super(MisReportInstance, self).unlink(
+            cr, uid, ids, context=context)
+        self.pool['mis.report.result.cache']._update_triggers(cr)
+        return res
+
     def preview(self, cr, uid, ids, context=None):
         assert len(ids) == 1
         view_id = self.pool['ir.model.data'].get_object_reference(
@@ -813,29 +1380,385 @@ class MisReportInstance(orm.Model):
                                           tools.DEFAULT_SERVER_DATE_FORMAT)
         return date.strftime(tformat)
 
+    def _compute_vectorized(self, cr, uid, r, aep, compiled_kpis,
+                            kpi_schedule, periods, context=None):
+        """ Evaluate the purely arithmetic KPI's for all periods at once.
+
+        KPI's which only involve accounting variables, numbers and
+        other KPI's evaluated this way are evaluated once with numpy
+        arrays having one value per period. Other KPI's are left
+        to MisReportInstancePeriod._compute().
+
+        Returns a dictionary {period id: {kpi name: value}}, where
+        value is None in case of division by zero.
+        """
+        res = dict((period.id, {}) for period in periods)
+        if not periods:
+            return res
+        # {kpi name: numpy array}, for kpi's without division by zero
+        kpi_vectors = {}
+        kpis_by_id = dict((kpi.id, kpi) for kpi in r.report_id.kpi_ids)
+        sorted_kpi_ids, cyclic_kpi_ids = kpi_schedule
+        for kpi_id in sorted_kpi_ids:
+            if kpi_id in cyclic_kpi_ids:
+                continue
+            kpi = kpis_by_id[kpi_id]
+            compiled = compiled_kpis[kpi.id]
+            vectorized = compile_vectorized(compiled.source)
+            if vectorized is None:
+                continue
+            code, names = vectorized
+            slots = set(compiled.slots)
+            if not all(name in slots or name in kpi_vectors
+                       for name in names):
+                continue
+            slot_values_by_period = []
+            for period in periods:
+                aep.set_period(period.id)
+                slot_values_by_period.append(aep.get_slot_values(compiled))
+            values = {}
+            for name in names:
+                if name in slots:
+                    values[name] = numpy.array(
+                        [slot_values[name]
+                         for slot_values in slot_values_by_period],
+                        dtype=float)
+                else:
+                    values[name] = kpi_vectors[name]
+            kpi_vals = evaluate_vectorized(code, values, len(periods))
+            if kpi_vals is None:
+                continue
+            for period, kpi_val in zip(periods, kpi_vals):
+                res[period.id][kpi.name] = kpi_val
+            if None not in kpi_vals:
+                kpi_vectors[kpi.name] = numpy.array(kpi_vals, dtype=float)
+        return res
+
+    def _get_lang_id(self, cr, uid, context=None):
+        """ Return the ids of the res.lang of the language of the
+        context, or of the user, used to render values, English when
+        there is none. """
+        lang = context and context.get('lang') or \
+            self.pool['res.users'].read(
+                cr, uid, uid, ['lang'], context=context)['lang']
+        if not lang:
+            lang = 'en_US'
+        return self.pool['res.lang'].search(
+            cr, uid, [('code', '=', lang)], context=context)
+
+    def _get_access_key(self, cr, uid, context=None):
+        """ Return the groups and companies of the user, which usually
+        determine the record rules applied to the data of reports. """
+        user = self.pool['res.users'].read(
+            cr, SUPERUSER_ID, [uid],
+            ['groups_id', 'company_id', 'company_ids'],
+            context=context, load='_classic_write')[0]
+        return (tuple(sorted(user['groups_id'])),
+                user['company_id'],
+                tuple(sorted(user['company_ids'])))
+
+    def _get_result_cache_key(self, cr, uid, r, context=None):
+        """ Return the key of the computed result in the result cache.
+
+        The key includes the data version, which changes whenever
+        accounting data or report definitions are modified. Shared
+        results are keyed by the groups and companies of the user,
+        which usually determine the record rules applied.
+        """
+        cache_obj = self.pool['mis.report.result.cache']
+        if r.result_cache == 'user':
+            user_key = uid
+        else:
+            user_key = self._get_access_key(cr, uid, context=context)
+        return (r.id,
+                r.pivot_date,
+                context.get('lang'),
+                context.get('tz'),
+                user_key,
+                cache_obj.get_data_version(cr))
+
     def compute(self, cr, uid, _id, context=None):
         assert isinstance(_id, (int, long))
+        return self._compute_instance(cr, uid, _id, context=context)
+
+    def _compute_instance(self, cr, uid, _id, period_timeline=None,
+                          context=None):
+        """ Compute an instance, or return its snapshot or cached result.
+
+        period_timeline is an optional PeriodTimeline shared by the
+        computations of several instances.
+        """
         if context is None:
             context = {}
         r = self.browse(cr, uid, _id, context=context)
+        if r.precomputed and not context.get('mis_report_no_snapshot'):
+            res = self.pool['mis.report.instance.snapshot'].get_result(
+                cr, uid, r.id, r.pivot_date, context.get('lang'),
+                self._get_access_key(cr, uid, context=context),
+                r.snapshot_validity, context=context)
+            if res is not None:
+                return res
+        if r.result_cache == 'none':
+            return self._compute_report(
+                cr, uid, r, period_timeline=period_timeline, context=context)
+        # concurrent computes of the same instance run only once
+        return self.pool['mis.report.result.cache'].compute_once(
+            cr, uid, self._get_result_cache_key(cr, uid, r, context=context),
+            r.id, lambda: self._compute_report(
+                cr, uid, r, period_timeline=period_timeline,
+                context=context),
+            context=context)
 
+    def _compute_multi(self, cr, uid, ids, workers=1, context=None):
+        """ Compute several instances, yielding (instance id, result)
+        tuples in the order of ids.
+
+        Instances are computed by batches of workers instances in
+        parallel, on cursors sharing the snapshot of cr (see
+        parallel.run_parallel()), so at most one batch of results
+        is kept in memory. As each instance may itself query with
+        query_workers cursors, and read its cached result on another
+        one, workers is reduced so that the cursors of all instances
+        stay within parallel.get_max_workers().
+        The fiscal periods are loaded once for all instances; account
+        codes are resolved once per chart of accounts by
+        account.account.
+
+        Instances repeated in ids are computed once, their result
+        being kept until their last occurrence. Results computed on
+        worker cursors, which are rolled back, are stored in the
+        result cache on cr (see _compute_task()).
+        """
+        if context is None:
+            context = {}
+        period_timeline = PeriodTimeline(cr, uid, self.pool, context=context)
+        query_workers = max([r['query_workers'] for r in self.read(
+            cr, uid, list(set(ids)), ['query_workers'], context=context)] or
+            [1])
+        workers = max(min(workers,
+                          get_max_workers() // (2 + query_workers)), 1)
+        cache_obj = self.pool['mis.report.result.cache']
+        # {instance id: number of occurrences not yielded yet}
+        remaining = defaultdict(int)
+        for _id in ids:
+            remaining[_id] += 1
+        # {instance id: result}, of instances not yielded yet
+        results = {}
+        i = 0
+        while i < len(ids):
+            # next distinct instances to compute, in the order of ids
+            batch_ids = []
+            for _id in ids[i:]:
+                if len(batch_ids) == workers:
+                    break
+                if _id not in results and _id not in batch_ids:
+                    batch_ids.append(_id)
+            batch_results = run_parallel(
+                cr, [partial(self._compute_task, cr, uid, _id,
+                             period_timeline, context)
+                     for _id in batch_ids],
+                workers)
+            for _id, (result, puts) in zip(batch_ids, batch_results):
+                results[_id] = result
+                for key, instance_id, res in puts:
+                    cache_obj.put(cr, uid, key, instance_id, res,
+                                  context=context)
+            while i < len(ids) and ids[i] in results:
+                _id = ids[i]
+                remaining[_id] -= 1
+                if remaining[_id]:
+                    yield _id, results[_id]
+                else:
+                    yield _id, results.pop(_id)
+                i += 1
+
+    def _iter_flat_rows(self, cr, uid, ids, workers=1, context=None):
+        """ Compute instances and yield one row per instance, KPI and
+        column, as a tuple of the values of flat_export.COLUMNS.
+        Comparison columns, which have no raw value, are skipped. """
+        kpi_obj = self.pool['mis.report.kpi']
+        period_obj = self.pool['mis.report.instance.period']
+        for _id, result in self._compute_multi(cr, uid, ids, workers=workers,
+                                               context=context):
+            r = self.read(cr, uid, _id, ['name', 'pivot_date'],
+                          context=context)
+            cells = [cell for line in result['content']
+                     for cell in line['cols'] if cell.get('kpi_id')]
+            kpis = dict((kpi['id'], kpi) for kpi in kpi_obj.read(
+                cr, uid, list(set(cell['kpi_id'] for cell in cells)),
+                ['name', 'description'], context=context))
+            periods = dict(
+                (period['id'], period) for period in period_obj.read(
+                    cr, uid, list(set(cell['period_id'] for cell in cells)),
+                    ['name', 'date_from', 'date_to'], context=context))
+            for cell in cells:
+                kpi = kpis[cell['kpi_id']]
+                period = periods[cell['period_id']]
+                yield (_id, r['name'], r['pivot_date'],
+                       kpi['id'], kpi['name'], kpi['description'],
+                       period['id'], period['name'],
+                       period['date_from'] or None,
+                       period['date_to'] or None,
+                       get_raw_value(cell), cell.get('error'))
+
+    def export_flat(self, cr, uid, ids, file_format='csv', workers=1,
+                    context=None):
+        """ Export computed instances in csv or parquet format, with
+        one row per instance, KPI and column (see flat_export.COLUMNS).
+
+        Returns the content of the file, encoded in base64.
+        """
+        # unknown formats are rejected by _export_flat()
+        fd, path = tempfile.mkstemp(
+            suffix=file_format == 'parquet' and '.parquet' or '.csv')
+        os.close(fd)
+        try:
+            self._export_flat(cr, uid, ids, path, file_format=file_format,
+                              workers=workers, context=context)
+            with open(path, 'rb') as f:
+                return base64.b64encode(f.read())
+        finally:
+            os.unlink(path)
+
+    def _export_flat(self, cr, uid, ids, path, file_format='csv', workers=1,
+                     context=None):
+        """ Export computed instances to a csv or parquet file of the
+        server (see export_flat()).
+
+        Rows are written while instances are computed, by batches of
+        workers instances (see _compute_multi()), so the results of all
+        instances are never held in memory at once. Parquet requires
+        the pyarrow python library.
+        """
+        rows = self._iter_flat_rows(cr, uid, ids, workers=workers,
+                                    context=context)
+        if file_format == 'csv':
+            with open(path, 'wb') as f:
+                write_csv(rows, f)
+        elif file_format == 'parquet':
+            if pyarrow is None:
+                raise orm.except_orm(
+                    _('Error!'),
+                    _('The pyarrow python library is required '
+                      'to export to parquet.'))
+            write_parquet(rows, path)
+        else:
+            raise orm.except_orm(_('Error!'),
+                                 _('Unknown export format %s.') % file_format)
+        return True
+
+    def _compute_task(self, main_cr, uid, _id, period_timeline, context,
+                      cr):
+        """ Compute an instance for _compute_multi(), on main_cr or on a
+        worker cursor.
+
+        Returns a tuple (result, puts), where puts is the list of the
+        (key, instance id, result) tuples to store in the result cache
+        on main_cr, as the transaction of a worker cursor is rolled back.
+        """
+        puts = []
+        if cr is not main_cr:
+            context = dict(context, mis_report_result_cache_puts=puts)
+        return self._compute_instance(cr, uid, _id,
+                                      period_timeline=period_timeline,
+                                      context=context), puts
+
+    def _cron_compute_snapshots(self, cr, uid, context=None):
+        """ Compute and store the snapshots of all precomputed instances,
+        in all installed languages, as the scheduled action has no
+        language while users see reports in their own one. """
+        if context is None:
+            context = {}
+        ids = self.search(cr, uid, [('precomputed', '=', True)],
+                          context=context)
+        if not ids:
+            return True
+        lang_obj = self.pool['res.lang']
+        for lang in lang_obj.read(cr, uid, lang_obj.search(
+                cr, uid, [], context=context), ['code'], context=context):
+            self.compute_snapshots(
+                cr, uid, ids, context=dict(context, lang=lang['code']))
+        return True
+
+    def compute_snapshots(self, cr, uid, ids, context=None):
+        """ Compute and store the snapshots of instances, in the language
+        of the context.
+
+        Snapshots are computed with the access rights of uid, and shown
+        to users having the same groups and companies.
+        """
+        if context is None:
+            context = {}
+        snapshot_obj = self.pool['mis.report.instance.snapshot']
+        ctx = dict(context, mis_report_no_snapshot=True)
+        access_key = self._get_access_key(cr, uid, context=ctx)
+        for r in self.browse(cr, uid, ids, context=ctx):
+            _logger.info("computing snapshot of mis report instance %s",
+                         r.name)
+            snapshot_obj.store(cr, uid, r.id, r.pivot_date,
+                               ctx.get('lang'), access_key,
+                               self.compute(cr, uid, r.id, context=ctx),
+                               context=ctx)
+        return True
+
+    def _compute_report(self, cr, uid, r, period_timeline=None,
+                        context=None):
         # prepare AccountingExpressionProcessor
-        aep = AEP(cr)
+        report_obj = self.pool['mis.report']
+        compiled_kpis = report_obj._get_compiled_kpis(
+            cr, uid, r.report_id.id, context=context)
+        kpi_schedule = report_obj._get_kpi_schedule(
+            cr, uid, r.report_id.id, context=context)
+        kpi_code = report_obj._get_kpi_code(
+            cr, uid, r.report_id.id, context=context)
+        aep = AEP(cr, backend=r.aep_backend, workers=r.query_workers,
+                  period_timeline=period_timeline)
         for kpi in r.report_id.kpi_ids:
-            aep.parse_expr(kpi.expression)
+            aep.parse_expr(compiled_kpis[kpi.id])
         aep.done_parsing(cr, uid, r.root_account, context=context)
 
         report_instance_period_obj = self.pool['mis.report.instance.period']
         kpi_obj = self.pool.get('mis.report.kpi')
 
         # fetch user language only once
-        # TODO: is this necessary?
-        lang = self.pool['res.users'].read(
-            cr, uid, uid, ['lang'], context=context)['lang']
-        if not lang:
-            lang = 'en_US'
-        lang_id = self.pool['res.lang'].search(
-            cr, uid, [('code', '=', lang)], context=context)
+        lang_id = self._get_lang_id(cr, uid, context=context)
+        renderer = kpi_obj._get_renderer(cr, uid, lang_id, context=context)
+
+        # query accounting data for all periods at once
+        aep.do_queries_multi(
+            cr, uid,
+            [{'key': period.id,
+              'date_from': period.date_from,
+              'date_to': period.date_to,
+              'period_from': period.period_from,
+              'period_to': period.period_to,
+              'additional_move_line_filter':
+                  report_instance_period_obj._get_additional_move_line_filter(
+                      cr, uid, period.id, context=context),
+              } for period in r.period_ids if period.valid],
+            r.target_move,
+            context=context)
+
+        # fetch queries once for all periods
+        query_values_by_period_ids = {}
+        if r.fetch_queries_once:
+            query_values_by_period_ids = \
+                report_instance_period_obj._fetch_queries_multi(
+                    cr, uid,
+                    [period for period in r.period_ids if period.valid],
+                    context)
+
+        # evaluate arithmetic kpi's for all periods at once
+        vectorized_kpi_values = {}
+        if r.vectorized_evaluation:
+            if numpy is None:
+                _logger.warning("numpy is not installed, "
+                                "vectorized evaluation is disabled")
+            else:
+                vectorized_kpi_values = self._compute_vectorized(
+                    cr, uid, r, aep, compiled_kpis, kpi_schedule,
+                    [period for period in r.period_ids if period.valid],
+                    context=context)
 
         # compute kpi values for each period
         kpi_values_by_period_ids = {}
@@ -843,7 +1766,12 @@ class MisReportInstance(orm.Model):
             if not period.valid:
                 continue
             kpi_values = report_instance_period_obj._compute(
-                cr, uid, lang_id, period, aep, context=context)
+                cr, uid, lang_id, period, aep, compiled_kpis=compiled_kpis,
+                kpi_values=vectorized_kpi_values.get(period.id),
+                kpi_schedule=kpi_schedule, kpi_code=kpi_code,
+                renderer=renderer,
+                query_values=query_values_by_period_ids.get(period.id),
+                context=context)
             kpi_values_by_period_ids[period.id] = kpi_values
 
         # prepare header and content
@@ -902,18 +1830,17 @@ class MisReportInstance(orm.Model):
                                                    compare_col.name),
                              date=''))
                     # add comparison values
-                    for kpi in r.report_id.kpi_ids:
+                    kpis = r.report_id.kpi_ids
+                    comparisons = renderer.render_comparisons(
+                        kpis,
+                        [kpi_values[kpi.name]['val'] for kpi in kpis],
+                        [compare_kpi_values[kpi.name]['val']
+                         for kpi in kpis],
+                        period.normalize_factor,
+                        compare_col.normalize_factor)
+                    for kpi, comparison in zip(kpis, comparisons):
                         rows_by_kpi_name[kpi.name]['cols'].append({
-                            'val_r': kpi_obj._render_comparison(
-                                cr,
-                                uid,
-                                lang_id,
-                                kpi,
-                                kpi_values[kpi.name]['val'],
-                                compare_kpi_values[kpi.name]['val'],
-                                period.normalize_factor,
-                                compare_col.normalize_factor,
-                                context=context)
+                            'val_r': comparison
                         })
 
         return {'header': header,
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    mis_builder module for Odoo, Management Information System Builder
+#    Copyright (C) 2014-2015 ACSONE SA/NV (<http://acsone.eu>)
+#
+#    This file is a part of mis_builder
+#
+#    mis_builder is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License v3 or later
+#    as published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    mis_builder is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License v3 or later for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    v3 or later along with this program.
+#    If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+
+import datetime
+import hashlib
+import json
+
+from openerp.osv import orm, fields
+from openerp import tools
+
+
+class MisReportInstanceSnapshot(orm.Model):
+    """ A computed MIS report instance, as returned by
+    mis.report.instance compute().
+
+    Snapshots of precomputed instances are computed by a scheduled
+    action, and there is one snapshot per instance, pivot date,
+    language and access key, so older pivot dates are kept as a
+    history. The access key identifies the groups and companies of the
+    user who computed the snapshot (see mis.report.instance
+    _get_access_key()), and snapshots are only shown to users having
+    the same ones, as record rules usually depend on them. """
+
+    _name = 'mis.report.instance.snapshot'
+    _description = 'MIS Report Instance Snapshot'
+    _order = 'pivot_date desc, compute_date desc'
+
+    _columns = {
+        'instance_id': fields.many2one('mis.report.instance',
+                                       string='Report instance',
+                                       required=True, ondelete='cascade',
+                                       readonly=True, select=True),
+        'pivot_date': fields.date(string='Pivot date', required=True,
+                                  readonly=True),
+        'lang': fields.char(size=64, string='Language', readonly=True),
+        'access_key': fields.char(size=40, string='Access key',
+                                  readonly=True),
+        'compute_date': fields.datetime(string='Computed on', required=True,
+                                        readonly=True),
+        'result': fields.text(string='Result', readonly=True),
+    }
+
+    @staticmethod
+    def _hash_access_key(access_key):
+        return hashlib.sha1(repr(access_key)).hexdigest()
+
+    def _search_snapshot(self, cr, uid, instance_id, pivot_date, lang,
+                         access_key, context=None):
+        return self.search(cr, uid,
+                           [('instance_id', '=', instance_id),
+                            ('pivot_date', '=', pivot_date),
+                            ('lang', '=', lang or False),
+                            ('access_key', '=',
+                             self._hash_access_key(access_key))],
+                           context=context)
+
+    def get_result(self, cr, uid, instance_id, pivot_date, lang,
+                   access_key, max_age, context=None):
+        """ Return the result of the snapshot of an instance for a pivot
+        date, language and access key, if it was computed less than
+        max_age hours ago, or None. """
+        snapshot_ids = self._search_snapshot(
+            cr, uid, instance_id, pivot_date, lang, access_key,
+            context=context)
+        if not snapshot_ids:
+            return None
+        snapshot = self.read(cr, uid, snapshot_ids[0],
+                             ['compute_date', 'result'], context=context)
+        compute_date = datetime.datetime.strptime(
+            snapshot['compute_date'], tools.DEFAULT_SERVER_DATETIME_FORMAT)
+        if compute_date < datetime.datetime.utcnow() - \
+                datetime.timedelta(hours=max_age):
+            return None
+        return json.loads(snapshot['result'])
+
+    def store(self, cr, uid, instance_id, pivot_date, lang, access_key,
+              result, context=None):
+        """ Replace the snapshot of an instance for a pivot date,
+        language and access key. """
+        self.unlink(cr, uid, self._search_snapshot(
+            cr, uid, instance_id, pivot_date, lang, access_key,
+            context=context),
+            context=context)
+        return self.create(cr, uid, {
+            'instance_id': instance_id,
+            'pivot_date': pivot_date,
+            'lang': lang or False,
+            'access_key': self._hash_access_key(access_key),
+            'compute_date': datetime.datetime.utcnow().strftime(
+                tools.DEFAULT_SERVER_DATETIME_FORMAT),
+            'result': json.dumps(result),
+        }, context=context)
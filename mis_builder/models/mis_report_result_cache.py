@@ -0,0 +1,400 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    mis_builder module for Odoo, Management Information System Builder
+#    Copyright (C) 2014-2015 ACSONE SA/NV (<http://acsone.eu>)
+#
+#    This file is a part of mis_builder
+#
+#    mis_builder is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License v3 or later
+#    as published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    mis_builder is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License v3 or later for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    v3 or later along with this program.
+#    If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+
+import hashlib
+import json
+import logging
+
+import psycopg2
+from psycopg2 import errorcodes
+
+from openerp import SUPERUSER_ID, sql_db
+from openerp.osv import orm, fields
+
+_logger = logging.getLogger(__name__)
+
+PARAM_TTL = 'mis_builder.result_cache_ttl'
+PARAM_SIZE = 'mis_builder.result_cache_size'
+PARAM_LOCK_TIMEOUT = 'mis_builder.result_cache_lock_timeout'
+DEFAULT_TTL = 3600
+DEFAULT_SIZE = 1000
+DEFAULT_LOCK_TIMEOUT = 120
+
+# first key of the advisory locks taken by compute_once()
+ADVISORY_LOCK_CLASS = 0x6d6973  # 'mis'
+
+# tables whose changes invalidate computed results
+VERSIONED_TABLES = [
+    'account_move_line',
+    'account_move',
+    'account_account',
+    'account_account_consol_rel',
+    'account_period',
+    'mis_report',
+    'mis_report_kpi',
+    'mis_report_query',
+    'ir_model_fields_mis_report_query_rel',
+    'mis_report_instance',
+    'mis_report_instance_period',
+    'mis_report_instance_period_rel',
+]
+
+
+class MisReportResultCache(orm.Model):
+    """ Cache of computed MIS report instances, shared by all workers.
+
+    Results are stored by key (see mis.report.instance
+    _get_result_cache_key()), which includes a data version. The data
+    version is the sum of the rows of the mis_builder_data_version
+    table, where deferred triggers insert a row when a transaction
+    changes move lines, moves, accounts, fiscal periods or MIS report
+    definitions, so results computed before such a change are not used
+    anymore. As the table is read in the snapshot of the transaction,
+    the version changes exactly when the data it sees does. Data
+    fetched by queries on other models is refreshed
+    after the time to live. Cached results expire after
+    mis_builder.result_cache_ttl seconds, and the oldest results are
+    removed when there are more than mis_builder.result_cache_size.
+    The triggers are only installed while some report instance
+    uses the cache (see _update_triggers()).
+
+    Concurrent computations of the same key are coalesced by
+    compute_once(), so only one of them actually runs.
+    """
+
+    _name = 'mis.report.result.cache'
+    _description = 'MIS Report Result Cache'
+    _auto = False
+    _log_access = False
+
+    _columns = {
+        'key': fields.char(size=40, string='Key', readonly=True),
+        'instance_id': fields.many2one('mis.report.instance',
+                                       string='Report instance',
+                                       readonly=True),
+        'create_date': fields.datetime(string='Computed on', readonly=True),
+    }
+
+    def init(self, cr):
+        if not self._table_exists(cr, 'mis_report_result_cache'):
+            cr.execute("""
+                CREATE TABLE mis_report_result_cache (
+                    id serial,
+                    key varchar(40) PRIMARY KEY,
+                    instance_id integer,
+                    create_date timestamp NOT NULL,
+                    result text NOT NULL
+                );
+                CREATE INDEX mis_report_result_cache_create_date
+                    ON mis_report_result_cache (create_date);
+                """)
+        self._update_triggers(cr, force=True)
+
+    @staticmethod
+    def _table_exists(cr, table):
+        cr.execute("SELECT 1 FROM pg_class "
+                   "WHERE relname = %s AND relkind = 'r'", (table, ))
+        return bool(cr.fetchone())
+
+    def _create_data_version(self, cr):
+        """ Create the data version table and the function of its
+        triggers, which adds one row per transaction. """
+        if not self._table_exists(cr, 'mis_builder_data_version'):
+            cr.execute("""
+                CREATE TABLE mis_builder_data_version (
+                    txid bigint,
+                    weight bigint NOT NULL
+                );
+                CREATE INDEX mis_builder_data_version_txid
+                    ON mis_builder_data_version (txid);
+                """)
+        cr.execute("""
+            CREATE OR REPLACE FUNCTION mis_builder_data_version()
+            RETURNS trigger AS $$
+            BEGIN
+                IF NOT EXISTS (SELECT 1 FROM mis_builder_data_version
+                               WHERE txid = txid_current()) THEN
+                    INSERT INTO mis_builder_data_version (txid, weight)
+                    VALUES (txid_current(), 1);
+                END IF;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+            """)
+
+    def _is_used(self, cr):
+        """ Test if some report instance keeps its results in the cache. """
+        cr.execute("SELECT 1 FROM mis_report_instance "
+                   "WHERE result_cache != 'none' LIMIT 1")
+        return bool(cr.fetchone())
+
+    def _has_triggers(self, cr):
+        cr.execute("SELECT 1 FROM pg_trigger "
+                   "WHERE tgname = 'mis_builder_data_version' LIMIT 1")
+        return bool(cr.fetchone())
+
+    def _update_triggers(self, cr, force=False):
+        """ Install the triggers maintaining the data version while
+        some report instance uses the cache, and remove them when
+        none does, so databases without result cache do not pay
+        for them on every write of move lines.
+
+        The triggers are only changed when they are missing or
+        not needed anymore, or when force is True and they are needed.
+        """
+        used = self._is_used(cr)
+        had_triggers = self._has_triggers(cr)
+        if used == had_triggers and not (force and used):
+            return
+        if used:
+            self._create_data_version(cr)
+        for table in VERSIONED_TABLES:
+            if not self._table_exists(cr, table):
+                continue
+            cr.execute("DROP TRIGGER IF EXISTS mis_builder_data_version "
+                       "ON %s" % table)
+            if not used:
+                continue
+            # constraint triggers are deferred at commit time,
+            # so the version changes when the data is about to be visible
+            cr.execute("""
+                CREATE CONSTRAINT TRIGGER mis_builder_data_version
+                AFTER INSERT OR UPDATE OR DELETE ON %(table)s
+                DEFERRABLE INITIALLY DEFERRED
+                FOR EACH ROW EXECUTE PROCEDURE mis_builder_data_version();
+                """ % {'table': table})
+        if used and not had_triggers:
+            # data may have changed while the version was not maintained
+            cr.execute("INSERT INTO mis_builder_data_version (txid, weight) "
+                       "VALUES (NULL, 1)")
+
+    def get_data_version(self, cr):
+        """ Return the data version seen by the transaction of cr.
+
+        The data seen by a transaction only grows with the transactions
+        committed before it started, and so does the version. Changes of
+        the transaction itself are counted when it commits.
+        """
+        cr.execute("SELECT COALESCE(SUM(weight), 0) "
+                   "FROM mis_builder_data_version")
+        return long(cr.fetchone()[0])
+
+    def _compact_data_version(self, cr):
+        """ Replace the rows of the data version by a single row
+        having their sum, which keeps the version unchanged.
+
+        Only one transaction compacts at a time, so concurrent
+        transactions do not wait for each other. Compacting fails when
+        another transaction has compacted since the snapshot of cr
+        was taken, which is ignored.
+        """
+        cr.execute("SELECT COUNT(*) FROM mis_builder_data_version")
+        if cr.fetchone()[0] <= 1:
+            return
+        cr.execute("SELECT pg_try_advisory_xact_lock(%s, 0)",
+                   (ADVISORY_LOCK_CLASS, ))
+        if not cr.fetchone()[0]:
+            return
+        cr.execute("SAVEPOINT mis_builder_data_version")
+        try:
+            cr.execute("""
+                WITH compacted AS (
+                    DELETE FROM mis_builder_data_version
+                    RETURNING weight
+                )
+                INSERT INTO mis_builder_data_version (txid, weight)
+                SELECT NULL, SUM(weight) FROM compacted
+                HAVING COUNT(*) > 0
+                """, log_exceptions=False)
+        except psycopg2.Error:
+            cr.execute("ROLLBACK TO SAVEPOINT mis_builder_data_version")
+        finally:
+            cr.execute("RELEASE SAVEPOINT mis_builder_data_version")
+
+    def _get_param(self, cr, key, default):
+        value = self.pool['ir.config_parameter'].get_param(
+            cr, SUPERUSER_ID, key)
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return default
+
+    @staticmethod
+    def _hash_key(key):
+        return hashlib.sha1(repr(key)).hexdigest()
+
+    @staticmethod
+    def _lock_key(key):
+        """ Return the second key of the advisory lock of a key,
+        as a signed 32 bits integer. """
+        lock_key = int(MisReportResultCache._hash_key(key)[:8], 16)
+        if lock_key >= 2 ** 31:
+            lock_key -= 2 ** 32
+        return lock_key
+
+    def get(self, cr, uid, key, context=None):
+        """ Return the cached result for a key, or None. """
+        ttl = self._get_param(cr, PARAM_TTL, DEFAULT_TTL)
+        cr.execute("""
+            SELECT result FROM mis_report_result_cache
+            WHERE key = %s
+              AND create_date > (now() at time zone 'UTC')
+                                - %s * interval '1 second'
+            """, (self._hash_key(key), ttl))
+        row = cr.fetchone()
+        if not row:
+            return None
+        return json.loads(row[0])
+
+    def put(self, cr, uid, key, instance_id, result, context=None):
+        """ Store a result, if it can be serialized, and
+        remove expired and oldest results. """
+        try:
+            result = json.dumps(result)
+        except (TypeError, ValueError):
+            _logger.debug("mis report result for key %r cannot be cached",
+                          key, exc_info=True)
+            return False
+        ttl = self._get_param(cr, PARAM_TTL, DEFAULT_TTL)
+        size = self._get_param(cr, PARAM_SIZE, DEFAULT_SIZE)
+        # concurrent computes may store the same key or evict the
+        # same results, which must not abort the transaction
+        cr.execute("SAVEPOINT mis_report_result_cache")
+        try:
+            cr.execute("""
+                DELETE FROM mis_report_result_cache
+                WHERE create_date <= (now() at time zone 'UTC')
+                                     - %s * interval '1 second'
+                   OR key IN (SELECT key FROM mis_report_result_cache
+                              ORDER BY create_date DESC
+                              OFFSET %s)
+                """, (ttl, max(size - 1, 0)))
+            hash_key = self._hash_key(key)
+            cr.execute("""
+                INSERT INTO mis_report_result_cache
+                    (key, instance_id, create_date, result)
+                SELECT %s, %s, now() at time zone 'UTC', %s
+                WHERE NOT EXISTS (SELECT 1 FROM mis_report_result_cache
+                                  WHERE key = %s)
+                """, (hash_key, instance_id, result, hash_key))
+        except psycopg2.Error:
+            cr.execute("ROLLBACK TO SAVEPOINT mis_report_result_cache")
+            _logger.debug("mis report result for key %r not cached",
+                          key, exc_info=True)
+            return False
+        finally:
+            cr.execute("RELEASE SAVEPOINT mis_report_result_cache")
+        self._compact_data_version(cr)
+        return True
+
+    def compute_once(self, cr, uid, key, instance_id, compute,
+                     context=None):
+        """ Return the cached result for a key, or compute it.
+
+        compute is a function without arguments returning the result,
+        which is stored on cr, so it is only shared when the transaction
+        of the caller commits, with the data the result was computed
+        from. Concurrent calls for the same key, in any worker, wait on
+        a transaction level advisory lock held by the transaction
+        computing the result, and then read the result it committed.
+        As cr does not see results committed after its transaction
+        started, waiters read it on a short lived cursor, provided
+        that cursor sees the same data version as cr.
+
+        If the lock is not obtained within
+        mis_builder.result_cache_lock_timeout seconds, or if the
+        result cannot be cached, the result is computed anyway.
+
+        When the context has a mis_report_result_cache_puts list, the
+        result is appended to it as a (key, instance_id, result) tuple
+        instead of being stored, for callers computing on a cursor whose
+        transaction is rolled back.
+        """
+        if context is None:
+            context = {}
+        res = self.get(cr, uid, key, context=context)
+        if res is not None:
+            return res
+        lock_args = (ADVISORY_LOCK_CLASS, self._lock_key(key))
+        cr.execute("SELECT pg_try_advisory_xact_lock(%s, %s)", lock_args)
+        if not cr.fetchone()[0]:
+            # another transaction is computing the result, wait for it
+            if not self._wait_xact_lock(cr, lock_args):
+                _logger.warning("timeout waiting for the computation of "
+                                "mis report instance %s", instance_id)
+                return compute()
+            read_cr = sql_db.db_connect(cr.dbname).cursor()
+            try:
+                if self.get_data_version(read_cr) == \
+                        self.get_data_version(cr):
+                    res = self.get(read_cr, uid, key, context=context)
+            finally:
+                read_cr.close()
+            if res is not None:
+                return res
+        res = compute()
+        puts = context.get('mis_report_result_cache_puts')
+        if puts is not None:
+            puts.append((key, instance_id, res))
+        else:
+            self.put(cr, uid, key, instance_id, res, context=context)
+        return res
+
+    def _wait_xact_lock(self, cr, lock_args):
+        """ Take a transaction level advisory lock, waiting at most
+        mis_builder.result_cache_lock_timeout seconds.
+
+        Returns whether the lock has been obtained.
+        """
+        lock_timeout = self._get_param(cr, PARAM_LOCK_TIMEOUT,
+                                       DEFAULT_LOCK_TIMEOUT)
+        cr.execute("SELECT current_setting('lock_timeout')")
+        previous_lock_timeout = cr.fetchone()[0]
+        cr.execute("SAVEPOINT mis_report_result_cache_lock")
+        try:
+            cr.execute("SELECT set_config('lock_timeout', %s, true)",
+                       ('%ds' % lock_timeout, ))
+            cr.execute("SELECT pg_advisory_xact_lock(%s, %s)", lock_args,
+                       log_exceptions=False)
+        except psycopg2.OperationalError as e:
+            # also restores the lock timeout
+            cr.execute("ROLLBACK TO SAVEPOINT mis_report_result_cache_lock")
+            if e.pgcode != errorcodes.LOCK_NOT_AVAILABLE:
+                raise
+            return False
+        finally:
+            cr.execute("RELEASE SAVEPOINT mis_report_result_cache_lock")
+        cr.execute("SELECT set_config('lock_timeout', %s, true)",
+                   (previous_lock_timeout, ))
+        return True
+
+    def _clear(self, cr, uid, instance_ids=None, context=None):
+        """ Remove cached results, of some instances or all. """
+        if instance_ids:
+            cr.execute("DELETE FROM mis_report_result_cache "
+                       "WHERE instance_id IN %s", (tuple(instance_ids), ))
+        else:
+            cr.execute("DELETE FROM mis_report_result_cache")
+        return True
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    mis_builder module for Odoo, Management Information System Builder
+#    Copyright (C) 2014-2015 ACSONE SA/NV (<http://acsone.eu>)
+#
+#    This file is a part of mis_builder
+#
+#    mis_builder is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License v3 or later
+#    as published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    mis_builder is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License v3 or later for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    v3 or later along with this program.
+#    If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+
+import logging
+import threading
+
+from openerp import sql_db, tools
+
+_logger = logging.getLogger(__name__)
+
+
+def get_max_workers():
+    """ Return the maximum number of worker cursors of run_parallel(),
+    half of the database connections of the server process, so
+    parallel computations leave connections to other requests. """
+    return max(tools.config['db_maxconn'] // 2, 1)
+
+
+def has_pending_writes(cr):
+    """ Test if the transaction of cr has written to the database,
+    changes that other cursors cannot see. PostgreSQL 10 is needed to
+    tell, so writes are assumed with older servers. """
+    if cr._cnx.server_version < 100000:
+        return True
+    cr.execute("SELECT txid_current_if_assigned() IS NOT NULL")
+    return cr.fetchone()[0]
+
+
+def run_parallel(cr, tasks, workers):
+    """ Run tasks, which are functions taking a cursor, and return
+    the list of their results.
+
+    With more than one worker, tasks are distributed among worker
+    threads, each having its own database cursor. The cursors import
+    a snapshot exported by the transaction of cr, so all tasks see the
+    same data as they would on cr. As they would not see the changes
+    not yet committed by the transaction of cr, tasks are run
+    sequentially on cr when there are such changes. Worker transactions
+    are rolled back. The number of workers is capped by
+    get_max_workers().
+    """
+    workers = min(workers, len(tasks), get_max_workers())
+    if workers > 1 and has_pending_writes(cr):
+        _logger.debug("running tasks sequentially, as the transaction "
+                      "has uncommitted changes")
+        workers = 1
+    if workers <= 1:
+        return [task(cr) for task in tasks]
+    cr.execute("SELECT pg_export_snapshot()")
+    snapshot = cr.fetchone()[0]
+    results = [None] * len(tasks)
+    errors = []
+
+    def work(worker_cr, task_idxs):
+        try:
+            for i in task_idxs:
+                results[i] = tasks[i](worker_cr)
+        except Exception as e:
+            _logger.warning("parallel task failed", exc_info=True)
+            errors.append(e)
+
+    worker_crs = []
+    try:
+        for i in range(workers):
+            worker_cr = sql_db.db_connect(cr.dbname).cursor()
+            worker_crs.append(worker_cr)
+            worker_cr.execute("SET TRANSACTION SNAPSHOT %s", (snapshot, ))
+        threads = [threading.Thread(
+            target=work,
+            args=(worker_cr, range(i, len(tasks), workers)))
+            for i, worker_cr in enumerate(worker_crs)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        for worker_cr in worker_crs:
+            worker_cr.close()
+    if errors:
+        raise errors[0]
+    return results
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    mis_builder module for Odoo, Management Information System Builder
+#    Copyright (C) 2014-2015 ACSONE SA/NV (<http://acsone.eu>)
+#
+#    This file is a part of mis_builder
+#
+#    mis_builder is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License v3 or later
+#    as published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    mis_builder is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License v3 or later for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    v3 or later along with this program.
+#    If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+
+CHUNK_SIZE = 1000
+
+# {field names: row class}
+_row_classes = {}
+
+
+class QueryRow(object):
+    """ Base class of query records, with one slot per field
+    (see get_row_class()). """
+
+    __slots__ = ()
+
+    def __init__(self, **values):
+        for field_name, value in values.items():
+            setattr(self, field_name, value)
+
+    def __repr__(self):
+        return '<%s %s>' % (self.__class__.__name__, ', '.join(
+            '%s=%r' % (field_name, getattr(self, field_name, None))
+            for field_name in self.__slots__))
+
+
+def get_row_class(field_names):
+    """ Return a subclass of QueryRow with slots for id and the
+    fields, so rows do not have a dictionary of attributes.
+    Classes are created once per list of fields. """
+    key = ('id', ) + tuple(field_name for field_name in field_names
+                           if field_name != 'id')
+    row_class = _row_classes.get(key)
+    if row_class is None:
+        row_class = _row_classes[key] = type(
+            'QueryRow', (QueryRow, ), {'__slots__': key})
+    return row_class
+
+
+class LazyQueryResult(object):
+    """ The records of a query without aggregate, fetched on demand.
+
+    It behaves as a read-only list of rows, rows having the id and
+    the values of field_names of each record as attributes
+    (see get_row_class()). The length is a search_count() until
+    the records are iterated. Records are read by chunks when iterated,
+    and kept for later iterations. When no field is needed, the rows
+    only have an id and nothing is read.
+    """
+
+    def __init__(self, cr, uid, obj, domain, field_names, context=None):
+        self._cr = cr
+        self._uid = uid
+        self._obj = obj
+        self._domain = domain
+        self._field_names = field_names
+        self._row_class = get_row_class(field_names)
+        self._context = context
+        self._count = None
+        self._ids = None
+        self._rows = []
+
+    def _get_ids(self):
+        if self._ids is None:
+            self._ids = self._obj.search(self._cr, self._uid, self._domain,
+                                         context=self._context)
+        return self._ids
+
+    def _fetch(self, count):
+        """ Make at least count rows available, if there are. """
+        ids = self._get_ids()
+        count = min(count, len(ids))
+        while len(self._rows) < count:
+            chunk_ids = ids[len(self._rows):
+                            min(count, len(self._rows) + CHUNK_SIZE)]
+            if not self._field_names:
+                self._rows.extend(self._row_class(id=_id)
+                                  for _id in chunk_ids)
+                continue
+            data = dict((d['id'], d) for d in self._obj.read(
+                self._cr, self._uid, chunk_ids, self._field_names,
+                context=self._context))
+            self._rows.extend(self._row_class(**data[_id])
+                              for _id in chunk_ids)
+
+    def __len__(self):
+        if self._ids is not None:
+            return len(self._ids)
+        if self._count is None:
+            self._count = self._obj.search_count(
+                self._cr, self._uid, self._domain, context=self._context)
+        return self._count
+
+    def __iter__(self):
+        i = 0
+        while True:
+            if i >= len(self._rows):
+                self._fetch(i + CHUNK_SIZE)
+                if i >= len(self._rows):
+                    return
+            yield self._rows[i]
+            i += 1
+
+    def __getitem__(self, index):
+        # read the records up to index only, when it is not
+        # relative to the end
+        if isinstance(index, slice):
+            if index.stop is not None and index.stop >= 0 and \
+                    (index.start is None or index.start >= 0) and \
+                    (index.step is None or index.step > 0):
+                self._fetch(index.stop)
+            else:
+                self._fetch(len(self._get_ids()))
+        elif index >= 0:
+            self._fetch(index + 1)
+        else:
+            self._fetch(len(self._get_ids()))
+        return self._rows[index]
+
+    def __repr__(self):
+        return '<%s %s %r>' % (self.__class__.__name__,
+                               self._obj._name, self._domain)
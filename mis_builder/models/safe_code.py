@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    mis_builder module for Odoo, Management Information System Builder
+#    Copyright (C) 2014-2015 ACSONE SA/NV (<http://acsone.eu>)
+#
+#    This file is a part of mis_builder
+#
+#    mis_builder is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License v3 or later
+#    as published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    mis_builder is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License v3 or later for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    v3 or later along with this program.
+#    If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+
+import ast
+from types import CodeType
+
+from openerp.tools.safe_eval import safe_eval, test_expr, _SAFE_OPCODES
+
+_safe_builtins = []
+
+
+def get_safe_builtins():
+    """ Return the builtins of the safe_eval() sandbox. """
+    if not _safe_builtins:
+        globals_dict = {}
+        safe_eval('None', globals_dict, nocopy=True)
+        _safe_builtins.append(globals_dict['__builtins__'])
+    return _safe_builtins[0]
+
+
+def _check_names(code):
+    for name in code.co_names + code.co_varnames:
+        if name.startswith('__'):
+            raise ValueError("name %s not allowed" % name)
+    for const in code.co_consts:
+        if isinstance(const, CodeType):
+            _check_names(const)
+
+
+class SafeCode(object):
+    """ A python expression, validated and compiled once like
+    safe_eval() does, to be evaluated many times.
+
+    On top of the opcodes checked by safe_eval(), names starting
+    with a double underscore are rejected. Compiling raises the same
+    exceptions as safe_eval() for invalid or forbidden expressions.
+    """
+
+    def __init__(self, expr):
+        self.expr = expr
+        self.code = test_expr(expr, _SAFE_OPCODES, mode='eval')
+        _check_names(self.code)
+        # expressions binding names (such as list comprehensions in
+        # python 2) are evaluated on a copy of the globals, like
+        # safe_eval() does, so they cannot alter them
+        self.binds_names = any(
+            isinstance(node, ast.Name) and
+            not isinstance(node.ctx, ast.Load)
+            for node in ast.walk(ast.parse(expr.strip(), mode='eval')))
+
+    def eval(self, globals_dict):
+        """ Evaluate the expression.
+
+        globals_dict must contain the sandbox builtins
+        (see get_safe_builtins()) as __builtins__.
+        """
+        if self.binds_names:
+            globals_dict = dict(globals_dict)
+        return eval(self.code, globals_dict)
+
+
+def compile_safe(expr):
+    """ Return a SafeCode for an expression, or None if it is
+    empty or cannot be compiled (in which case safe_eval() gives
+    the error when evaluating it). """
+    if not expr:
+        return None
+    try:
+        return SafeCode(expr)
+    except Exception:
+        return None
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    mis_builder module for Odoo, Management Information System Builder
+#    Copyright (C) 2014-2015 ACSONE SA/NV (<http://acsone.eu>)
+#
+#    This file is a part of mis_builder
+#
+#    mis_builder is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License v3 or later
+#    as published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    mis_builder is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License v3 or later for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    v3 or later along with this program.
+#    If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+
+""" Evaluation of arithmetic KPI expressions for all columns at once.
+
+Expressions made only of numbers, names and the + - * / // % operators
+are evaluated with numpy arrays bound to names, one value per column.
+Division by zero does not raise but produces infinite or nan values,
+which are reported as None.
+
+Names are bound to float values, and numpy arrays only hold floats, so
+expressions computing integers, such as 1 / 2 which is 0 in python 2,
+are left to the evaluation of each column.
+"""
+
+import ast
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+_BINOPS = (ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod)
+_UNARYOPS = (ast.UAdd, ast.USub)
+
+
+def _get_type(node, names):
+    """ Return the type of a purely arithmetic ast node, int or float,
+    collecting names, or None if the node is not purely arithmetic or
+    involves an operation between integers. """
+    if isinstance(node, ast.Expression):
+        return _get_type(node.body, names)
+    elif isinstance(node, ast.BinOp):
+        if not isinstance(node.op, _BINOPS):
+            return None
+        left_type = _get_type(node.left, names)
+        right_type = _get_type(node.right, names)
+        if left_type is None or right_type is None or \
+                left_type is right_type is int:
+            return None
+        return float
+    elif isinstance(node, ast.UnaryOp):
+        if not isinstance(node.op, _UNARYOPS):
+            return None
+        return _get_type(node.operand, names)
+    elif isinstance(node, ast.Num):
+        if isinstance(node.n, float):
+            return float
+        elif isinstance(node.n, (int, long)):
+            return int
+        return None
+    elif isinstance(node, ast.Name):
+        if node.id.startswith('__'):
+            return None
+        names.add(node.id)
+        return float
+    return None
+
+
+def compile_vectorized(source):
+    """ Compile an arithmetic expression.
+
+    Returns a (code, names) tuple, or None if the expression
+    is not purely arithmetic or does not compute a float.
+    """
+    try:
+        tree = ast.parse(source.strip(), mode='eval')
+    except SyntaxError:
+        return None
+    names = set()
+    if _get_type(tree, names) is not float:
+        return None
+    return compile(tree, '<vectorized>', 'eval'), names
+
+
+def evaluate_vectorized(code, values, size):
+    """ Evaluate a compiled arithmetic expression.
+
+    values is a dictionary {name: numpy array of size values}.
+
+    Returns a list of size floats, None replacing non finite values,
+    or None if the expression could not be evaluated.
+    """
+    try:
+        with numpy.errstate(all='ignore'):
+            res = eval(code, {'__builtins__': {}}, values)
+    except Exception:
+        return None
+    res = numpy.asarray(res, dtype=float)
+    if res.ndim == 0:
+        res = numpy.repeat(res, size)
+    return [float(v) if numpy.isfinite(v) else None for v in res]
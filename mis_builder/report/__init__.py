@@ -26,3 +26,4 @@ try:
     from . import mis_builder_xls
 except ImportError:
     pass  # this module is not installed
+from . import mis_builder_xlsx
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    mis_builder module for Odoo, Management Information System Builder
+#    Copyright (C) 2014-2015 ACSONE SA/NV (<http://acsone.eu>)
+#
+#    This file is a part of mis_builder
+#
+#    mis_builder is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License v3 or later
+#    as published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    mis_builder is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License v3 or later for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    v3 or later along with this program.
+#    If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+
+import os
+import re
+import tempfile
+
+try:
+    import xlsxwriter
+except ImportError:
+    xlsxwriter = None
+
+from openerp import SUPERUSER_ID, pooler
+from openerp.osv import orm
+from openerp.report.interface import report_int
+from openerp.tools.translate import _
+
+DEFAULT_EXPORT_WORKERS = 2
+
+
+class XlsxStyles(object):
+    """ Formats of a workbook, created once each.
+
+    Number formats are cached by (dp, suffix, percentage), so their
+    number is bounded by the distinct formats of the KPI's, whatever
+    the number of cells.
+    """
+
+    def __init__(self, workbook):
+        self.workbook = workbook
+        self.title = workbook.add_format({'bold': True, 'font_size': 14})
+        self.header = workbook.add_format({
+            'bold': True, 'bg_color': '#E0E0E0', 'border': 1,
+            'align': 'right'})
+        self.kpi_name = workbook.add_format({
+            'bold': True, 'bg_color': '#E0E0E0', 'border': 1})
+        self.text = workbook.add_format({'border': 1, 'align': 'right'})
+        # {(dp, suffix, is_percentage): format}
+        self._num_formats = {}
+
+    def get_num_format(self, dp, suffix, is_percentage):
+        key = (dp, suffix, is_percentage)
+        num_format = self._num_formats.get(key)
+        if num_format is None:
+            num_format_str = '#,##0'
+            if dp:
+                num_format_str += '.' + '0' * int(dp)
+            if is_percentage:
+                num_format_str += '%'
+            if suffix:
+                num_format_str += ' "%s"' % suffix.replace('"', '')
+            num_format = self._num_formats[key] = self.workbook.add_format(
+                {'border': 1, 'align': 'right',
+                 'num_format': num_format_str})
+        return num_format
+
+
+def get_sheet_name(name, sheet_names):
+    """ Return a valid and unique worksheet name for name,
+    and add it to the set sheet_names. """
+    base = re.sub(r'[\[\]:*?/\\]', '_', name or '')[:31] or 'Sheet'
+    sheet_name = base
+    i = 1
+    while sheet_name.lower() in sheet_names:
+        i += 1
+        suffix = ' (%d)' % i
+        sheet_name = base[:31 - len(suffix)] + suffix
+    sheet_names.add(sheet_name.lower())
+    return sheet_name
+
+
+def write_instance_sheet(workbook, styles, sheet_name, title, data):
+    """ Write the result of mis.report.instance compute() in a new
+    worksheet, row by row, as required by the constant memory mode. """
+    ws = workbook.add_worksheet(sheet_name)
+    ws.set_landscape()
+    ws.fit_to_pages(1, 0)
+    cols = data['header'][0]['cols']
+    ws.set_column(0, 0, 30)
+    if cols:
+        ws.set_column(1, len(cols), 15)
+    ws.write_string(0, 0, title, styles.title)
+    # column headers
+    ws.write_blank(2, 0, None, styles.header)
+    ws.write_blank(3, 0, None, styles.header)
+    for col_pos, col in enumerate(cols, 1):
+        ws.write_string(2, col_pos, col['name'] or '', styles.header)
+        ws.write_string(3, col_pos, col['date'] or '', styles.header)
+    ws.freeze_panes(4, 1)
+    # kpi values
+    for row_pos, line in enumerate(data['content'], 4):
+        ws.write_string(row_pos, 0, line['kpi_name'] or '', styles.kpi_name)
+        for col_pos, value in enumerate(line['cols'], 1):
+            val = value.get('val')
+            if isinstance(val, (int, long, float)) and \
+                    not isinstance(val, bool) and not value.get('error'):
+                ws.write_number(row_pos, col_pos, val, styles.get_num_format(
+                    value.get('dp'), value.get('suffix'),
+                    value.get('is_percentage')))
+            else:
+                ws.write_string(row_pos, col_pos, value.get('val_r') or '',
+                                styles.text)
+    return ws
+
+
+def write_workbook(write):
+    """ Create a workbook in constant memory mode, call write(workbook)
+    and return the content of the xlsx file. """
+    fd, path = tempfile.mkstemp(suffix='.xlsx')
+    os.close(fd)
+    try:
+        workbook = xlsxwriter.Workbook(path, {'constant_memory': True})
+        write(workbook)
+        workbook.close()
+        with open(path, 'rb') as f:
+            return f.read()
+    finally:
+        os.unlink(path)
+
+
+class mis_builder_xlsx(report_int):
+    """ Export of report instances in xlsx format, one sheet
+    per instance.
+
+    Unlike the xls export, the workbook is written in streaming mode,
+    so it has no row or column limits other than those of xlsx,
+    and cell formats are created once per number format.
+    Several instances are computed in parallel by
+    mis.report.instance _compute_multi(), with the number of workers
+    of the mis_builder.export_workers system parameter, reduced by
+    _compute_multi() to fit the database connections of the server.
+    It requires the xlsxwriter python library.
+    """
+
+    def create(self, cr, uid, ids, data, context=None):
+        if xlsxwriter is None:
+            raise orm.except_orm(
+                _('Error!'),
+                _('The xlsxwriter python library is required '
+                  'to export to xlsx.'))
+        pool = pooler.get_pool(cr.dbname)
+        instance_obj = pool['mis.report.instance']
+        names = dict((instance['id'], instance['name'])
+                     for instance in instance_obj.read(
+                         cr, uid, ids, ['name'], context=context))
+        try:
+            workers = int(pool['ir.config_parameter'].get_param(
+                cr, SUPERUSER_ID, 'mis_builder.export_workers',
+                DEFAULT_EXPORT_WORKERS))
+        except ValueError:
+            workers = DEFAULT_EXPORT_WORKERS
+
+        def write(workbook):
+            styles = XlsxStyles(workbook)
+            sheet_names = set()
+            for instance_id, result in instance_obj._compute_multi(
+                    cr, uid, ids, workers=workers, context=context):
+                name = names[instance_id]
+                write_instance_sheet(
+                    workbook, styles, get_sheet_name(name, sheet_names),
+                    name, result)
+
+        return write_workbook(write), 'xlsx'
+
+
+mis_builder_xlsx('report.mis.report.instance.xlsx')
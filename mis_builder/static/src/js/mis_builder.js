@@ -23,6 +23,7 @@ openerp.mis_builder = function(instance) {
 
         events: {
             "click a.mis_builder_drilldown": "drilldown",
+            "mouseenter div.mis_builder_error": "error_detail",
         },
 
         drilldown: function(event) {
@@ -42,6 +43,25 @@ openerp.mis_builder = function(instance) {
                 });
             }
         },
+
+        error_detail: function(event) {
+            var $cell = $(event.currentTarget);
+            if ($cell.data("error-detail-loaded")) {
+                return;
+            }
+            $cell.data("error-detail-loaded", true);
+            var period_id = JSON.parse($cell.data("period-id"));
+            var kpi_id = JSON.parse($cell.data("kpi-id"));
+            new instance.web.Model("mis.report.instance.period").call(
+                "error_detail",
+                [period_id, kpi_id],
+                {'context': new instance.web.CompoundContext()}
+            ).then(function(result) {
+                if (result) {
+                    $cell.attr("title", result);
+                }
+            });
+        },
     });
 
     instance.web.form.custom_widgets.add('mis_report', 'instance.mis_builder.MisReport');
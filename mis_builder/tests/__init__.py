@@ -23,7 +23,23 @@
 ##############################################################################
 
 from . import test_mis_builder
+from . import test_aep
+from . import test_aep_chart
+from . import test_aep_expr
+from . import test_aep_period
+from . import test_vectorized
+from . import test_kpi_graph
+from . import test_safe_code
+from . import test_xlsx
 
 checks = [
     test_mis_builder,
+    test_aep,
+    test_aep_chart,
+    test_aep_expr,
+    test_aep_period,
+    test_vectorized,
+    test_kpi_graph,
+    test_safe_code,
+    test_xlsx,
     ]
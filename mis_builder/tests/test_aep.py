@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    mis_builder module for Odoo, Management Information System Builder
+#    Copyright (C) 2014-2015 ACSONE SA/NV (<http://acsone.eu>)
+#
+#    This file is a part of mis_builder
+#
+#    mis_builder is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License v3 or later
+#    as published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    mis_builder is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License v3 or later for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    v3 or later along with this program.
+#    If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import time
+
+import openerp.tests.common as common
+
+from ..models.aep import AccountingExpressionProcessor as AEP
+from ..models.aep_backend import AEPSqlBackend
+
+EXPRESSIONS = [
+    'bal[%]',
+    'debi[%]',
+    'crde[%]',
+    "deb[%][('journal_id.type', '=', 'sale')]",
+    "crd[%][('journal_id.type', '=', 'purchase')]",
+]
+
+
+class test_aep(common.TransactionCase):
+
+    def _get_periods(self):
+        """ Return a date column and two fiscal period columns,
+        the second one with an additional move line filter. """
+        period_obj = self.registry('account.period')
+        period = period_obj.browse(self.cr, self.uid, period_obj.find(
+            self.cr, self.uid, time.strftime('%Y-%m-%d'))[0])
+        return [
+            {'key': 'dates',
+             'date_from': time.strftime('%Y-01-01'),
+             'date_to': time.strftime('%Y-12-31'),
+             'period_from': None,
+             'period_to': None},
+            {'key': 'period',
+             'date_from': period.date_start,
+             'date_to': period.date_stop,
+             'period_from': period,
+             'period_to': period},
+            {'key': 'period_sale',
+             'date_from': period.date_start,
+             'date_to': period.date_stop,
+             'period_from': period,
+             'period_to': period,
+             'additional_move_line_filter':
+                 [('journal_id.type', '=', 'sale')]},
+        ]
+
+    def _get_aep(self, backend='orm', workers=1):
+        aep = AEP(self.cr, backend=backend, workers=workers)
+        for expr in EXPRESSIONS:
+            aep.parse_expr(expr)
+        aep.done_parsing(self.cr, self.uid, self.registry(
+            'account.account').browse(self.cr, self.uid,
+                                      self.ref('account.chart0')))
+        return aep
+
+    def _get_values(self, aep, period_key):
+        aep.set_period(period_key)
+        return [aep.get_slot_values(expr) for expr in EXPRESSIONS]
+
+    def test_do_queries_multi(self):
+        periods = self._get_periods()
+        for backend in ('orm', 'sql'):
+            aep = self._get_aep(backend)
+            aep.do_queries_multi(self.cr, self.uid, periods, 'posted')
+            for p in periods:
+                self.assertTrue(aep.has_period(p['key']))
+                # same values as when querying the period alone
+                period_aep = self._get_aep(backend)
+                period_aep.do_queries_multi(self.cr, self.uid, [p], 'posted')
+                self.assertEqual(self._get_values(aep, p['key']),
+                                 self._get_values(period_aep, p['key']))
+
+    def test_sum_period_data(self):
+        data = {1: {10: (1.0, 2.0)},
+                2: {10: (3.0, 0.0), 11: (0.0, 4.0)},
+                3: {11: (5.0, 0.0)}}
+        read_period_ids = []
+
+        class ReadData(dict):
+
+            def get(self, period_id, default=None):
+                read_period_ids.append(period_id)
+                return dict.get(self, period_id, default)
+
+        sets = [frozenset([1, 2, 3]), frozenset([1]), frozenset([1, 2]),
+                frozenset([2, 3])]
+        res = AEP._sum_period_data(ReadData(data), sets)
+        self.assertEqual(res, {
+            frozenset([1]): {10: (1.0, 2.0)},
+            frozenset([1, 2]): {10: (4.0, 2.0), 11: (0.0, 4.0)},
+            frozenset([1, 2, 3]): {10: (4.0, 2.0), 11: (5.0, 4.0)},
+            frozenset([2, 3]): {10: (3.0, 0.0), 11: (5.0, 4.0)},
+        })
+        # each set is summed from the largest set it contains: [1],
+        # then 2 for [1, 2], [2, 3] from scratch, and one more period
+        # for [1, 2, 3], instead of reading 8 periods
+        self.assertEqual(len(read_period_ids), 5)
+
+    def test_domains_in_one_query(self):
+        backend = AEPSqlBackend(self.registry('account.move.line').pool)
+        domains = [(('journal_id.type', '=', 'sale'), ),
+                   (('journal_id.type', '=', 'purchase'), )]
+        aggregates, aggregates_params, join_move, where, where_params = \
+            backend._get_where(self.cr, self.uid, domains,
+                               [self.ref('account.a_recv')], 'posted', None)
+        # one pair of filtered sums per domain, reading only the move
+        # lines matching one of the domains
+        self.assertEqual(aggregates.count('FILTER (WHERE'), 4)
+        self.assertIn(' OR ', where)
+        # a domain without filter needs all move lines
+        aggregates, aggregates_params, join_move, where, where_params = \
+            backend._get_where(self.cr, self.uid, domains + [()],
+                               [self.ref('account.a_recv')], 'posted', None)
+        self.assertEqual(aggregates.count('FILTER (WHERE'), 4)
+        self.assertNotIn(' OR ', where)
+
+    def test_backends(self):
+        periods = self._get_periods()
+        values = {}
+        for backend in ('orm', 'sql'):
+            aep = self._get_aep(backend)
+            aep.do_queries_multi(self.cr, self.uid, periods, 'posted')
+            values[backend] = [self._get_values(aep, p['key'])
+                               for p in periods]
+        for period_values, orm_period_values in zip(values['sql'],
+                                                    values['orm']):
+            for slot_values, orm_slot_values in zip(period_values,
+                                                    orm_period_values):
+                self.assertEqual(sorted(slot_values),
+                                 sorted(orm_slot_values))
+                for slot, value in orm_slot_values.items():
+                    self.assertAlmostEqual(slot_values[slot], value)
+
+    def test_parallel_queries(self):
+        periods = self._get_periods()
+        for backend in ('orm', 'sql'):
+            aep = self._get_aep(backend)
+            aep.do_queries_multi(self.cr, self.uid, periods, 'posted')
+            parallel_aep = self._get_aep(backend, workers=2)
+            parallel_aep.do_queries_multi(self.cr, self.uid, periods,
+                                          'posted')
+            for p in periods:
+                self.assertEqual(self._get_values(parallel_aep, p['key']),
+                                 self._get_values(aep, p['key']))
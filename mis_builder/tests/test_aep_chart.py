@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    mis_builder module for Odoo, Management Information System Builder
+#    Copyright (C) 2014-2015 ACSONE SA/NV (<http://acsone.eu>)
+#
+#    This file is a part of mis_builder
+#
+#    mis_builder is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License v3 or later
+#    as published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    mis_builder is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License v3 or later for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    v3 or later along with this program.
+#    If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import openerp.tests.common as common
+
+from ..models.aep_chart import AccountChartIndex
+
+
+class test_aep_chart(common.TransactionCase):
+
+    def setUp(self):
+        super(test_aep_chart, self).setUp()
+        self.account_obj = self.registry('account.account')
+        self.chart_id = self.ref('account.chart0')
+        self.index = AccountChartIndex(self.cr, self.uid,
+                                       self.account_obj.pool, self.chart_id)
+
+    def _search_leaves(self, domain):
+        """ Search leaf accounts of the chart, as the index resolves
+        account codes. """
+        return set(self.account_obj.search(self.cr, self.uid, [
+            ('id', 'child_of', self.account_obj.search(
+                self.cr, self.uid,
+                [('id', 'child_of', self.chart_id)] + domain)),
+            ('type', 'not in', ('view', 'consolidation')),
+        ]))
+
+    def test_exact_code(self):
+        account = self.account_obj.browse(self.cr, self.uid,
+                                          self.ref('account.a_recv'))
+        self.assertEqual(self.index.get_account_ids(account.code),
+                         set([account.id]))
+        self.assertEqual(self.index.get_account_ids('no such code'), set())
+
+    def test_view_code(self):
+        # view accounts are replaced by their leaf descendants
+        chart = self.account_obj.browse(self.cr, self.uid, self.chart_id)
+        leaf_ids = self._search_leaves([])
+        self.assertTrue(leaf_ids)
+        self.assertEqual(self.index.get_account_ids(chart.code), leaf_ids)
+        self.assertEqual(self.index.get_account_ids(None), leaf_ids)
+
+    def test_pattern(self):
+        self.assertEqual(self.index.get_account_ids('%'),
+                         self._search_leaves([]))
+        code = self.account_obj.browse(
+            self.cr, self.uid, self.ref('account.a_recv')).code
+        for pattern in (code[:1] + '%', '%' + code[-1:],
+                        code[:1] + '_' * (len(code) - 2) + '%'):
+            self.assertEqual(self.index.get_account_ids(pattern),
+                             self._search_leaves([('code', '=like',
+                                                   pattern)]),
+                             pattern)
+
+    def test_cache_invalidation(self):
+        account_id = self.ref('account.a_recv')
+        codes = frozenset(['MIS_TEST'])
+        self.assertEqual(self.account_obj._get_mis_account_ids_by_code(
+            self.cr, self.uid, self.chart_id, codes),
+            {'MIS_TEST': frozenset()})
+        # changing accounts clears the cached codes
+        self.account_obj.write(self.cr, self.uid, [account_id],
+                               {'code': 'MIS_TEST'})
+        self.assertEqual(self.account_obj._get_mis_account_ids_by_code(
+            self.cr, self.uid, self.chart_id, codes),
+            {'MIS_TEST': frozenset([account_id])})
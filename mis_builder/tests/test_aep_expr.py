@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    mis_builder module for Odoo, Management Information System Builder
+#    Copyright (C) 2014-2015 ACSONE SA/NV (<http://acsone.eu>)
+#
+#    This file is a part of mis_builder
+#
+#    mis_builder is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License v3 or later
+#    as published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    mis_builder is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License v3 or later for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    v3 or later along with this program.
+#    If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import unittest2
+
+from ..models.aep_expr import compile_expr
+
+
+class test_aep_expr(unittest2.TestCase):
+
+    def test_compile_expr(self):
+        compiled = compile_expr('bali[70,60] - bale_1 + crd[]')
+        self.assertEqual(compiled.source, '_aep_0 - _aep_1 + _aep_2')
+        self.assertEqual(compiled.variables,
+                         [('bal', 'i', ('70', '60'), ()),
+                          ('bal', 'e', ('1', ), ()),
+                          ('crd', 'p', (None, ), ())])
+        self.assertEqual(compiled.render(['1', '2', '3']), '1 - 2 + 3')
+
+    def test_compile_expr_domain(self):
+        compiled = compile_expr(
+            "debs[7%][('journal_id.code', 'in', ['A', 'B]'])] * 2")
+        self.assertEqual(compiled.source, '_aep_0 * 2')
+        self.assertEqual(compiled.variables,
+                         [('deb', 'e', ('7%', ),
+                           (('journal_id.code', 'in', ('A', 'B]')), ))])
+
+    def test_compile_expr_no_var(self):
+        for expr in ("balance + bal_70_x",
+                     "x.bal[70]",
+                     "'bal[70]'",
+                     "bal[70"):
+            compiled = compile_expr(expr)
+            self.assertEqual(compiled.source, expr)
+            self.assertEqual(compiled.variables, [])
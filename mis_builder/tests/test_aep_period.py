@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    mis_builder module for Odoo, Management Information System Builder
+#    Copyright (C) 2014-2015 ACSONE SA/NV (<http://acsone.eu>)
+#
+#    This file is a part of mis_builder
+#
+#    mis_builder is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License v3 or later
+#    as published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    mis_builder is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License v3 or later for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    v3 or later along with this program.
+#    If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import openerp.tests.common as common
+
+from ..models.aep_period import PeriodTimeline
+
+
+class test_aep_period(common.TransactionCase):
+
+    def setUp(self):
+        super(test_aep_period, self).setUp()
+        self.period_obj = self.registry('account.period')
+        self.timeline = PeriodTimeline(self.cr, self.uid,
+                                       self.period_obj.pool)
+        self.periods = self.period_obj.browse(
+            self.cr, self.uid, self.period_obj.search(
+                self.cr, self.uid, [], order='date_start, id'))
+
+    def test_get_normal_period_ids_between(self):
+        for period in self.periods:
+            fiscalyear = period.fiscalyear_id
+            company_id = period.company_id.id
+            for date_start, date_stop in (
+                    (period.date_start, period.date_stop),
+                    (fiscalyear.date_start, period.date_stop),
+                    (period.date_start, fiscalyear.date_stop),
+                    (fiscalyear.date_start, fiscalyear.date_stop)):
+                self.assertEqual(
+                    self.timeline.get_normal_period_ids_between(
+                        company_id, date_start, date_stop),
+                    self.period_obj.search(self.cr, self.uid, [
+                        ('company_id', '=', company_id),
+                        ('special', '=', False),
+                        ('date_start', '>=', date_start),
+                        ('date_stop', '<=', date_stop),
+                    ], order='date_start, id'))
+
+    def test_get_previous_periods(self):
+        for period in self.periods:
+            company_id = period.company_id.id
+            opening_ids = self.period_obj.search(self.cr, self.uid, [
+                ('company_id', '=', company_id),
+                ('special', '=', True),
+                ('date_start', '<=', period.date_start),
+            ], order='date_start desc, id desc', limit=1)
+            opening = self.timeline.get_previous_opening_period(
+                company_id, period.date_start)
+            self.assertEqual(opening and [opening.id] or [], opening_ids)
+            normal_ids = self.period_obj.search(self.cr, self.uid, [
+                ('company_id', '=', company_id),
+                ('special', '=', False),
+                ('date_start', '<', period.date_start),
+            ], order='date_start desc, id desc', limit=1)
+            normal = self.timeline.get_previous_normal_period(
+                company_id, period.date_start)
+            self.assertEqual(normal and [normal.id] or [], normal_ids)
+
+    def test_get_first_normal_period(self):
+        for company_id in set(period.company_id.id
+                              for period in self.periods):
+            first_ids = self.period_obj.search(self.cr, self.uid, [
+                ('company_id', '=', company_id),
+                ('special', '=', False),
+            ], order='date_start, id', limit=1)
+            self.assertEqual(
+                self.timeline.get_first_normal_period(company_id).id,
+                first_ids[0])
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    mis_builder module for Odoo, Management Information System Builder
+#    Copyright (C) 2014-2015 ACSONE SA/NV (<http://acsone.eu>)
+#
+#    This file is a part of mis_builder
+#
+#    mis_builder is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License v3 or later
+#    as published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    mis_builder is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License v3 or later for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    v3 or later along with this program.
+#    If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+
+import unittest2
+
+from ..models.kpi_graph import get_expr_attributes, get_expr_names, \
+    sort_kpis
+
+
+class test_kpi_graph(unittest2.TestCase):
+
+    def test_get_expr_names(self):
+        self.assertEqual(
+            get_expr_names('a + sum([l.debit for l in q]) + len(b)'),
+            set(['a', 'sum', 'q', 'len', 'b']))
+        self.assertEqual(get_expr_names('a +'), set())
+
+    def test_get_expr_attributes(self):
+        self.assertEqual(
+            get_expr_attributes('sum([l.debit - l.credit for l in q]) + '
+                                'len(b) + c.amount.real'),
+            set(['debit', 'credit', 'amount', 'real']))
+        self.assertEqual(get_expr_attributes('len(q)'), set())
+        self.assertEqual(get_expr_attributes('a.'), set())
+
+    def test_sort_kpis(self):
+        kpi_names = ['a', 'b', 'c', 'd', 'e']
+        dependencies = {
+            'a': set(['c', 'bal_70']),
+            'b': set(['a']),
+            'c': set(),
+            'd': set(['e']),
+            'e': set(['d']),
+        }
+        self.assertEqual(sort_kpis(kpi_names, dependencies),
+                         (['c', 'a', 'b', 'd', 'e'], set(['d', 'e'])))
+
+    def test_sort_kpis_self_reference(self):
+        self.assertEqual(sort_kpis(['a', 'b'], {'a': set(['a'])}),
+                         (['a', 'b'], set(['a'])))
+
+    def test_sort_kpis_long_chain(self):
+        # each kpi depends on the next one
+        kpi_names = ['k%d' % i for i in range(5000)]
+        dependencies = dict((kpi_names[i], set([kpi_names[i + 1]]))
+                            for i in range(len(kpi_names) - 1))
+        self.assertEqual(sort_kpis(kpi_names, dependencies),
+                         (list(reversed(kpi_names)), set()))
+        # and the last one on the first one
+        dependencies[kpi_names[-1]] = set([kpi_names[0]])
+        res, cyclic = sort_kpis(kpi_names, dependencies)
+        self.assertEqual(cyclic, set(kpi_names))
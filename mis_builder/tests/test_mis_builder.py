@@ -22,9 +22,24 @@
 #
 ##############################################################################
 
+import base64
+import csv
+import datetime
+import os
+import tempfile
+import time
+
+import unittest2
+
 import openerp.tests.common as common
+from openerp.osv import orm
 
+from ..models import aep_backend
+from ..models import aggregate as aggregate_module
+from ..models import flat_export
 from ..models import mis_builder
+from ..models import parallel
+from ..models import query_result
 
 
 class test_mis_builder(common.TransactionCase):
@@ -69,6 +84,9 @@ class test_mis_builder(common.TransactionCase):
                             'suffix': False,
                             'expr': u'len(test)',
                             'val_c': u'total_test = len(test)',
+                            'error': None,
+                            'kpi_id': self.ref('mis_builder.'
+                                               'mis_report_kpi_test'),
                             'val': 0,
                             'val_r': u'0\xa0',
                             'is_percentage': False,
@@ -81,3 +99,560 @@ class test_mis_builder(common.TransactionCase):
                              'name': u'today'}]
                    }],
              }, data)
+
+    def test_error_detail(self):
+        detail = self.registry('mis.report.instance.period').error_detail(
+            self.cr, self.uid,
+            self.ref('mis_builder.mis_report_instance_period_test'),
+            self.ref('mis_builder.mis_report_kpi_test'))
+        self.assertFalse(detail)
+        kpi_obj = self.registry('mis.report.kpi')
+        report_id = self.ref('mis_builder.mis_report_test')
+        div0_id = kpi_obj.create(self.cr, self.uid, {
+            'report_id': report_id,
+            'name': 'div0_test',
+            'description': 'division by zero',
+            'expression': 'total_test / 0',
+        })
+        err_id = kpi_obj.create(self.cr, self.uid, {
+            'report_id': report_id,
+            'name': 'err_test',
+            'description': 'error',
+            'expression': 'total_test + unknown_name',
+        })
+        detail = self.registry('mis.report.instance.period').error_detail(
+            self.cr, self.uid,
+            self.ref('mis_builder.mis_report_instance_period_test'),
+            div0_id)
+        self.assertTrue(detail.startswith('div0_test = total_test / 0\n\n'))
+        self.assertIn('ZeroDivisionError', detail)
+        detail = self.registry('mis.report.instance.period').error_detail(
+            self.cr, self.uid,
+            self.ref('mis_builder.mis_report_instance_period_test'),
+            err_id)
+        self.assertTrue(detail.startswith('err_test = total_test + '
+                                          'unknown_name\n\n'))
+        self.assertIn("NameError: name 'unknown_name'", detail)
+        # KPI's of other reports are refused
+        other_kpi_id = kpi_obj.create(self.cr, self.uid, {
+            'report_id': self.registry('mis.report').create(
+                self.cr, self.uid, {'name': 'other report'}),
+            'name': 'other',
+            'description': 'other',
+            'expression': '1',
+        })
+        with self.assertRaises(orm.except_orm):
+            self.registry('mis.report.instance.period').error_detail(
+                self.cr, self.uid,
+                self.ref('mis_builder.mis_report_instance_period_test'),
+                other_kpi_id, context=None)
+
+    def test_kpi_version(self):
+        report_obj = self.registry('mis.report')
+        kpi_obj = self.registry('mis.report.kpi')
+        report_id = self.ref('mis_builder.mis_report_test')
+        kpi_id = self.ref('mis_builder.mis_report_kpi_test')
+        # successive writes in a transaction share their write date
+        for expression, css_style in (('len(test) + 1', False),
+                                      ('len(test) + 2', False),
+                                      ('len(test) + 2', "{'color': 'red'}")):
+            kpi_obj.write(self.cr, self.uid, [kpi_id],
+                          {'expression': expression,
+                           'css_style': css_style})
+            self.assertEqual(report_obj._get_compiled_kpis(
+                self.cr, self.uid, report_id)[kpi_id].source, expression)
+            css_code = report_obj._get_kpi_code(
+                self.cr, self.uid, report_id)[kpi_id][1]
+            self.assertEqual(css_code is None, not css_style)
+
+    def test_render_num(self):
+        lang_id = self.registry('res.lang').search(
+            self.cr, self.uid, [('code', '=', 'en_US')])
+        renderer = self.registry('mis.report.kpi')._get_renderer(
+            self.cr, self.uid, lang_id)
+        self.assertEqual(renderer.render_num(-1234567.891, '1', 2, 'EUR'),
+                         u'\u20111,234,567.89\xa0EUR')
+        self.assertEqual(renderer.render_num(1234.5, '1e3', 1, None),
+                         u'1.2\xa0k')
+        self.assertEqual(renderer.render_num(0.123, 0.01, 1, '%', sign='+'),
+                         u'+12.3\xa0%')
+
+    def test_render_num_lang(self):
+        lang_obj = self.registry('res.lang')
+        for thousands_sep in (' ', '.'):
+            lang_id = lang_obj.create(self.cr, self.uid, {
+                'name': 'MIS test %s' % thousands_sep,
+                'code': 'mis_test_%d' % ord(thousands_sep),
+                'grouping': '[3, 2, -1]',
+                'thousands_sep': thousands_sep,
+                'decimal_point': ',',
+            })
+            renderer = self.registry('mis.report.kpi')._get_renderer(
+                self.cr, self.uid, [lang_id])
+            for value in (0.0, 1.5, -12.345, 1234.5, -1234567.891,
+                          123456789.0):
+                for sign, dp in (('-', 0), ('-', 2), ('+', 1), ('+', 3)):
+                    self.assertEqual(
+                        renderer._format(sign, dp, value),
+                        lang_obj.format(
+                            self.cr, self.uid, [lang_id],
+                            '%%%s.%df' % (sign, dp), value, grouping=True))
+
+    def test_result_cache(self):
+        instance_obj = self.registry('mis.report.instance')
+        cache_obj = self.registry('mis.report.result.cache')
+        instance_id = self.ref('mis_builder.mis_report_instance_test')
+        data = instance_obj.compute(self.cr, self.uid, instance_id)
+        self.assertFalse(cache_obj._has_triggers(self.cr))
+        instance_obj.write(self.cr, self.uid, [instance_id],
+                           {'result_cache': 'shared'})
+        self.assertTrue(cache_obj._has_triggers(self.cr))
+        self.assertEqual(instance_obj.compute(self.cr, self.uid, instance_id),
+                         data)
+        self.assertTrue(cache_obj.search(
+            self.cr, self.uid, [('instance_id', '=', instance_id)]))
+        self.assertEqual(instance_obj.compute(self.cr, self.uid, instance_id),
+                         data)
+        # the version changes once per transaction changing the data,
+        # when the deferred triggers run
+        version = cache_obj.get_data_version(self.cr)
+        account_obj = self.registry('account.account')
+        account_id = self.ref('account.chart0')
+        for name in ('version 1', 'version 2'):
+            account_obj.write(self.cr, self.uid, [account_id],
+                              {'name': name})
+            self.assertEqual(cache_obj.get_data_version(self.cr), version)
+            self.cr.execute("SET CONSTRAINTS ALL IMMEDIATE")
+            self.assertEqual(cache_obj.get_data_version(self.cr),
+                             version + 1)
+            self.cr.execute("SET CONSTRAINTS ALL DEFERRED")
+        cache_obj._compact_data_version(self.cr)
+        self.assertEqual(cache_obj.get_data_version(self.cr), version + 1)
+        self.cr.execute("SELECT COUNT(*) FROM mis_builder_data_version")
+        self.assertEqual(self.cr.fetchone()[0], 1)
+        instance_obj.write(self.cr, self.uid, [instance_id],
+                           {'result_cache': 'none'})
+        self.assertFalse(cache_obj._has_triggers(self.cr))
+
+    def test_snapshot(self):
+        instance_obj = self.registry('mis.report.instance')
+        instance_id = self.ref('mis_builder.mis_report_instance_test')
+        data = instance_obj.compute(self.cr, self.uid, instance_id)
+        instance_obj.write(self.cr, self.uid, [instance_id],
+                           {'precomputed': True})
+        instance_obj._cron_compute_snapshots(self.cr, self.uid)
+        instance = instance_obj.browse(self.cr, self.uid, instance_id)
+        lang_ids = self.registry('res.lang').search(self.cr, self.uid, [])
+        self.assertEqual(len(instance.snapshot_ids), len(lang_ids))
+        snapshot = [snapshot for snapshot in instance.snapshot_ids
+                    if snapshot.lang == 'en_US'][0]
+        self.assertEqual(snapshot.pivot_date, instance.pivot_date)
+        self.assertEqual(instance_obj.compute(self.cr, self.uid, instance_id,
+                                              context={'lang': 'en_US'}),
+                         data)
+        # a new computation replaces the snapshot of the pivot date
+        instance_obj.compute_snapshots(self.cr, self.uid, [instance_id],
+                                       context={'lang': 'en_US'})
+        instance.refresh()
+        self.assertEqual(len(instance.snapshot_ids), len(lang_ids))
+        # snapshots are only shown to users with the same groups
+        # and companies
+        snapshot_obj = self.registry('mis.report.instance.snapshot')
+        for uid, shown in ((self.uid, True),
+                           (self._create_accountant(), False)):
+            res = snapshot_obj.get_result(
+                self.cr, self.uid, instance_id, instance.pivot_date,
+                'en_US',
+                instance_obj._get_access_key(self.cr, uid),
+                instance.snapshot_validity)
+            self.assertEqual(res is not None, shown)
+
+    def test_aggregate_in_sql(self):
+        period_obj = self.registry('mis.report.instance.period')
+        aml_obj = self.registry('account.move.line')
+        field_names = ['debit', 'credit']
+        self.assertTrue(period_obj._can_aggregate_in_sql(
+            aml_obj, field_names))
+        self.assertFalse(period_obj._can_aggregate_in_sql(
+            aml_obj, ['name']))
+        domain = [('debit', '>', 0)]
+        data = aml_obj.read(
+            self.cr, self.uid,
+            aml_obj.search(self.cr, self.uid, domain),
+            field_names)
+        for aggregate, agg in (('sum', aggregate_module._sum),
+                               ('avg', aggregate_module._avg),
+                               ('min', aggregate_module._min),
+                               ('max', aggregate_module._max)):
+            s = period_obj._aggregate_in_sql(
+                self.cr, self.uid, aml_obj, domain, field_names, aggregate)
+            self.assertEqual(s.count, len(data))
+            for field_name in field_names:
+                self.assertAlmostEqual(
+                    getattr(s, field_name),
+                    agg([d[field_name] for d in data]))
+            s = period_obj._aggregate_in_sql(
+                self.cr, self.uid, aml_obj, [('id', '=', 0)], field_names,
+                aggregate)
+            self.assertEqual(s.count, 0)
+            self.assertIsNone(s.debit)
+
+    def test_fetch_queries_multi(self):
+        period_obj = self.registry('mis.report.instance.period')
+        period = period_obj.browse(
+            self.cr, self.uid,
+            self.ref('mis_builder.mis_report_instance_period_test'))
+        data = period_obj._fetch_queries_multi(
+            self.cr, self.uid, [period], {})
+        expected = period_obj._fetch_queries(self.cr, self.uid, period, {})
+        self.assertEqual(sorted(data[period.id]), sorted(expected))
+        for name, rows in expected.items():
+            self.assertEqual([repr(row) for row in data[period.id][name]],
+                             [repr(row) for row in rows])
+
+    def test_fetch_queries_multi_non_adjacent(self):
+        instance_obj = self.registry('mis.report.instance')
+        period_obj = self.registry('mis.report.instance.period')
+        instance_id = self.ref('mis_builder.mis_report_instance_test')
+        for name, aggregate in (('aml', False), ('aml_sum', 'sum')):
+            self.registry('mis.report.query').create(self.cr, self.uid, {
+                'report_id': self.ref('mis_builder.mis_report_test'),
+                'name': name,
+                'model_id': self.ref('account.model_account_move_line'),
+                'field_ids': [(6, 0, [
+                    self.ref('account.field_account_move_line_debit')])],
+                'date_field': self.ref('account.field_account_move_line_date'),
+                'aggregate': aggregate,
+            })
+        # two periods of 100 days, 100 days apart
+        instance_obj.write(self.cr, self.uid, [instance_id], {
+            'date': time.strftime('%Y-01-01'),
+            'period_ids': [
+                (0, 0, {'name': 'first', 'type': 'd',
+                        'offset': 0, 'duration': 100}),
+                (0, 0, {'name': 'second', 'type': 'd',
+                        'offset': 200, 'duration': 100}),
+            ],
+        })
+        periods = [period for period in instance_obj.browse(
+            self.cr, self.uid, instance_id).period_ids
+            if period.name in ('first', 'second')]
+        data = period_obj._fetch_queries_multi(
+            self.cr, self.uid, periods, {})
+        for period in periods:
+            expected = period_obj._fetch_queries(
+                self.cr, self.uid, period, {})
+            self.assertEqual([repr(row) for row in data[period.id]['aml']],
+                             [repr(row) for row in expected['aml']])
+            self.assertEqual(data[period.id]['aml_sum'].count,
+                             expected['aml_sum'].count)
+            self.assertAlmostEqual(data[period.id]['aml_sum'].debit or 0.0,
+                                   expected['aml_sum'].debit or 0.0)
+
+    def test_lazy_query_result(self):
+        aml_obj = self.registry('account.move.line')
+        domain = [('debit', '>', 0)]
+        aml_ids = aml_obj.search(self.cr, self.uid, domain)
+        rows = query_result.LazyQueryResult(
+            self.cr, self.uid, aml_obj, domain, ['debit'])
+        self.assertEqual(len(rows), len(aml_ids))
+        self.assertEqual([row.id for row in rows], aml_ids)
+        self.assertEqual(
+            [row.debit for row in rows],
+            [d['debit'] for d in sorted(
+                aml_obj.read(self.cr, self.uid, aml_ids, ['debit']),
+                key=lambda d: aml_ids.index(d['id']))])
+        rows = query_result.LazyQueryResult(
+            self.cr, self.uid, aml_obj, domain, [])
+        self.assertEqual([row.id for row in rows[:2]], aml_ids[:2])
+        if aml_ids:
+            self.assertFalse(hasattr(rows[0], 'debit'))
+        # indexing reads the records up to the index only
+        rows = query_result.LazyQueryResult(
+            self.cr, self.uid, aml_obj, domain, ['debit'])
+        if len(aml_ids) > 1:
+            self.assertEqual(rows[1].id, aml_ids[1])
+            self.assertEqual(len(rows._rows), 2)
+            self.assertEqual(rows[-1].id, aml_ids[-1])
+            self.assertEqual(len(rows._rows), len(aml_ids))
+
+    def test_row_class(self):
+        row_class = query_result.get_row_class(['name', 'id', 'debit'])
+        self.assertIs(query_result.get_row_class(['name', 'id', 'debit']),
+                      row_class)
+        row = row_class(id=1, name='a', debit=2.0)
+        self.assertEqual((row.id, row.name, row.debit), (1, 'a', 2.0))
+        self.assertFalse(hasattr(row, '__dict__'))
+        with self.assertRaises(AttributeError):
+            row.credit = 1.0
+
+    def test_compute_multi(self):
+        instance_obj = self.registry('mis.report.instance')
+        instance_id = self.ref('mis_builder.mis_report_instance_test')
+        data = instance_obj.compute(self.cr, self.uid, instance_id)
+        self.assertEqual(
+            list(instance_obj._compute_multi(
+                self.cr, self.uid, [instance_id, instance_id])),
+            [(instance_id, data), (instance_id, data)])
+        # in parallel, on cursors sharing the snapshot of the test cursor
+        self.assertEqual(
+            list(instance_obj._compute_multi(
+                self.cr, self.uid, [instance_id] * 3, workers=2)),
+            [(instance_id, data)] * 3)
+
+    def test_compute_multi_result_cache(self):
+        instance_obj = self.registry('mis.report.instance')
+        cache_obj = self.registry('mis.report.result.cache')
+        instance_id = self.ref('mis_builder.mis_report_instance_test')
+        instance_obj.write(self.cr, self.uid, [instance_id],
+                           {'result_cache': 'shared'})
+        # on a worker cursor, the result is returned to be stored
+        # on the main cursor
+        result, puts = instance_obj._compute_task(
+            None, self.uid, instance_id, None, {}, self.cr)
+        self.assertFalse(cache_obj.search(
+            self.cr, self.uid, [('instance_id', '=', instance_id)]))
+        self.assertEqual([(instance_id, result)],
+                         [(put_instance_id, res)
+                          for key, put_instance_id, res in puts])
+        self.assertEqual(
+            list(instance_obj._compute_multi(
+                self.cr, self.uid, [instance_id] * 2, workers=2)),
+            [(instance_id, result)] * 2)
+        self.assertTrue(cache_obj.search(
+            self.cr, self.uid, [('instance_id', '=', instance_id)]))
+
+    def test_run_parallel(self):
+        if parallel.has_pending_writes(self.cr):
+            self.skipTest("worker cursors would not see the changes "
+                          "of the test transaction")
+        results = parallel.run_parallel(
+            self.cr, [lambda cr: cr is self.cr] * 3, 2)
+        self.assertEqual(results, [False] * 3)
+        # errors of the tasks are raised
+        with self.assertRaises(ZeroDivisionError):
+            parallel.run_parallel(self.cr, [lambda cr: 1, lambda cr: 1 / 0],
+                                  2)
+
+    def test_export_flat(self):
+        instance_obj = self.registry('mis.report.instance')
+        instance_id = self.ref('mis_builder.mis_report_instance_test')
+        content = base64.b64decode(instance_obj.export_flat(
+            self.cr, self.uid, [instance_id]))
+        rows = list(csv.reader(content.splitlines()))
+        self.assertEqual(rows[0], [name for name, column_type
+                                   in flat_export.COLUMNS])
+        self.assertEqual(len(rows), 2)
+        row = dict(zip(rows[0], rows[1]))
+        self.assertEqual(row['kpi_name'], 'total_test')
+        self.assertEqual(row['val'], '0.0')
+        self.assertEqual(row['error'], '')
+
+    @unittest2.skipIf(flat_export.pyarrow is None,
+                      'pyarrow is not installed')
+    def test_export_flat_parquet(self):
+        instance_obj = self.registry('mis.report.instance')
+        instance_id = self.ref('mis_builder.mis_report_instance_test')
+        fd, path = tempfile.mkstemp(suffix='.parquet')
+        os.close(fd)
+        try:
+            instance_obj._export_flat(self.cr, self.uid, [instance_id], path,
+                                      file_format='parquet')
+            table = flat_export.pyarrow.parquet.read_table(path)
+        finally:
+            os.unlink(path)
+        self.assertEqual(table.schema.names,
+                         [name for name, column_type in flat_export.COLUMNS])
+        rows = table.to_pydict()
+        self.assertEqual(rows['instance_id'], [instance_id])
+        self.assertEqual(rows['kpi_name'], ['total_test'])
+        self.assertEqual(rows['pivot_date'], [datetime.date(2014, 7, 31)])
+        self.assertEqual(rows['val'], [0.0])
+        self.assertEqual(rows['error'], [None])
+
+    def _create_aep_instance(self, aep_backend, expressions, periods,
+                             target_move='posted'):
+        report_id = self.registry('mis.report').create(
+            self.cr, self.uid, {
+                'name': 'aep test',
+                'kpi_ids': [(0, 0, {'name': 'k%d' % i,
+                                    'description': 'k%d' % i,
+                                    'expression': expression,
+                                    'sequence': i})
+                            for i, expression in enumerate(expressions)],
+            })
+        return self.registry('mis.report.instance').create(
+            self.cr, self.uid, {
+                'name': 'aep test',
+                'report_id': report_id,
+                'date': time.strftime('%Y-%m-%d'),
+                'root_account': self.ref('account.chart0'),
+                'aep_backend': aep_backend,
+                'target_move': target_move,
+                'period_ids': [(0, 0, dict(period, sequence=i))
+                               for i, period in enumerate(periods)],
+            })
+
+    def _compute_values(self, instance_id, uid=None):
+        data = self.registry('mis.report.instance').compute(
+            self.cr, uid or self.uid, instance_id)
+        return dict(((row['kpi_name'], i), col['val'])
+                    for row in data['content']
+                    for i, col in enumerate(row['cols']))
+
+    def _assert_backends_equal(self, expressions, periods,
+                               target_move='posted', uid=None):
+        """ Check that the sql and orm backends compute the same
+        values. """
+        values = {}
+        for backend_name in ('orm', 'sql'):
+            instance_id = self._create_aep_instance(
+                backend_name, expressions, periods, target_move=target_move)
+            values[backend_name] = self._compute_values(instance_id, uid=uid)
+        self.assertEqual(sorted(values['sql']), sorted(values['orm']))
+        for key, value in values['orm'].items():
+            self.assertAlmostEqual(values['sql'][key], value, msg=key)
+
+    def test_aep_orm_fp_column(self):
+        instance_id = self._create_aep_instance(
+            'orm', ['deb[%]', 'crd[%]'],
+            [{'name': 'fp', 'type': 'fp', 'offset': 0, 'duration': 1}])
+        values = self._compute_values(instance_id)
+        period = self.registry('mis.report.instance').browse(
+            self.cr, self.uid, instance_id).period_ids[0]
+        aml_obj = self.registry('account.move.line')
+        amls = aml_obj.read(
+            self.cr, self.uid,
+            aml_obj.search(self.cr, self.uid, [
+                ('period_id', '=', period.period_from.id),
+                ('move_id.state', '=', 'posted'),
+                ('account_id', 'child_of', self.ref('account.chart0')),
+            ]),
+            ['debit', 'credit'])
+        self.assertAlmostEqual(values[('k0', 0)],
+                               sum(aml['debit'] for aml in amls))
+        self.assertAlmostEqual(values[('k1', 0)],
+                               sum(aml['credit'] for aml in amls))
+
+    def _create_move(self, amount):
+        period_id = self.registry('account.period').find(
+            self.cr, self.uid, time.strftime('%Y-%m-%d'))[0]
+        return self.registry('account.move').create(self.cr, self.uid, {
+            'journal_id': self.ref('account.sales_journal'),
+            'period_id': period_id,
+            'date': time.strftime('%Y-%m-%d'),
+            'line_id': [
+                (0, 0, {'name': 'mis test',
+                        'account_id': self.ref('account.a_recv'),
+                        'debit': amount}),
+                (0, 0, {'name': 'mis test',
+                        'account_id': self.ref('account.a_sale'),
+                        'credit': amount}),
+            ],
+        })
+
+    def test_aep_backends(self):
+        move_obj = self.registry('account.move')
+        move_obj.button_validate(self.cr, self.uid,
+                                 [self._create_move(100.0)])
+        self._create_move(30.0)
+        code = self.registry('account.account').browse(
+            self.cr, self.uid, self.ref('account.a_recv')).code
+        domain = "[('journal_id.type', '=', 'sale')]"
+        fp_periods = [
+            {'name': 'fp', 'type': 'fp', 'offset': 0, 'duration': 1},
+            {'name': 'fp2', 'type': 'fp', 'offset': -1, 'duration': 2},
+        ]
+        date_periods = [
+            {'name': 'd', 'type': 'd', 'offset': -30, 'duration': 31},
+            {'name': 'w', 'type': 'w', 'offset': 0, 'duration': 1},
+        ]
+        for target_move in ('posted', 'all'):
+            self._assert_backends_equal(
+                ['bal[%]', 'bali[%]', 'bale[%]',
+                 'bal[%s]' % code, 'bali[%s]' % code, 'bale[%s]' % code,
+                 'deb[%s]%s' % (code, domain), 'bale[%s]%s' % (code, domain)],
+                fp_periods, target_move=target_move)
+            self._assert_backends_equal(
+                ['bal[%]', 'crd[%]', 'bal[%s]' % code,
+                 'deb[%s]%s' % (code, domain)],
+                date_periods, target_move=target_move)
+
+    def test_period_balance(self):
+        balance_obj = self.registry('mis.account.period.balance')
+        move_obj = self.registry('account.move')
+        aml_obj = self.registry('account.move.line')
+        balance_obj.enable(self.cr, self.uid)
+        self.assertEqual(balance_obj.check(self.cr, self.uid), [])
+        self.registry('account.journal').write(
+            self.cr, self.uid, [self.ref('account.sales_journal')],
+            {'update_posted': True})
+        move_id = self._create_move(100.0)
+        self.assertEqual(balance_obj.check(self.cr, self.uid), [])
+        move = move_obj.browse(self.cr, self.uid, move_id)
+        balance_ids = balance_obj.search(self.cr, self.uid, [
+            ('account_id', '=', self.ref('account.a_recv')),
+            ('period_id', '=', move.period_id.id),
+        ])
+        posted_debit = sum(
+            balance['debit'] for balance in balance_obj.read(
+                self.cr, self.uid, balance_ids, ['debit', 'move_state'])
+            if balance['move_state'] == 'posted')
+        # post
+        move_obj.button_validate(self.cr, self.uid, [move_id])
+        self.assertEqual(balance_obj.check(self.cr, self.uid), [])
+        self.assertAlmostEqual(
+            sum(balance['debit'] for balance in balance_obj.read(
+                self.cr, self.uid, balance_ids, ['debit', 'move_state'])
+                if balance['move_state'] == 'posted'),
+            posted_debit + 100.0)
+        # cancel
+        move_obj.button_cancel(self.cr, self.uid, [move_id])
+        self.assertEqual(balance_obj.check(self.cr, self.uid), [])
+        # edit a move line
+        line_id = [line.id for line in move.line_id if line.debit][0]
+        aml_obj.write(self.cr, self.uid, [line_id],
+                      {'account_id': self.ref('account.a_pay')})
+        self.assertEqual(balance_obj.check(self.cr, self.uid), [])
+        move_obj.button_validate(self.cr, self.uid, [move_id])
+        self.assertEqual(balance_obj.check(self.cr, self.uid), [])
+        # delete
+        move_obj.button_cancel(self.cr, self.uid, [move_id])
+        move_obj.unlink(self.cr, self.uid, [move_id])
+        self.assertEqual(balance_obj.check(self.cr, self.uid), [])
+        # rebuild repairs the table
+        self.cr.execute("UPDATE mis_account_period_balance "
+                        "SET debit = debit + 1")
+        self.assertTrue(balance_obj.check(self.cr, self.uid))
+        balance_obj.rebuild(self.cr, self.uid)
+        self.assertEqual(balance_obj.check(self.cr, self.uid), [])
+        balance_obj.disable(self.cr, self.uid)
+
+    def _create_accountant(self):
+        return self.registry('res.users').create(self.cr, self.uid, {
+            'name': 'mis accountant',
+            'login': 'mis_accountant',
+            'company_id': self.ref('base.main_company'),
+            'company_ids': [(6, 0, [self.ref('base.main_company')])],
+            'groups_id': [(6, 0, [self.ref('account.group_account_user'),
+                                  self.ref('base.group_user')])],
+        })
+
+    def test_period_balance_company_rules(self):
+        self.registry('mis.account.period.balance').enable(
+            self.cr, self.uid)
+        self._create_move(100.0)
+        user_id = self._create_accountant()
+        backend = aep_backend.AEPSqlBackend(
+            self.registry('account.move.line').pool)
+        self.assertEqual(backend._get_balance_rules_where(
+            self.cr, self.uid), (None, []))
+        rules_where, rules_params = backend._get_balance_rules_where(
+            self.cr, user_id)
+        self.assertIn('"mis_account_period_balance"."company_id"',
+                      rules_where)
+        # the balances give the amounts of the move lines of the user
+        self._assert_backends_equal(
+            ['bal[%]', 'deb[%]', 'bale[%]', 'crdi[%]'],
+            [{'name': 'fp', 'type': 'fp', 'offset': 0, 'duration': 1}],
+            target_move='all', uid=user_id)
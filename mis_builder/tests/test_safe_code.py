@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    mis_builder module for Odoo, Management Information System Builder
+#    Copyright (C) 2014-2015 ACSONE SA/NV (<http://acsone.eu>)
+#
+#    This file is a part of mis_builder
+#
+#    mis_builder is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License v3 or later
+#    as published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    mis_builder is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License v3 or later for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    v3 or later along with this program.
+#    If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+
+import unittest2
+
+from ..models.safe_code import compile_safe, get_safe_builtins
+
+
+class test_safe_code(unittest2.TestCase):
+
+    def test_eval(self):
+        globals_dict = {'a': 1, 'q': [1, 2, 3],
+                        '__builtins__': get_safe_builtins()}
+        code = compile_safe('a + len(q)')
+        self.assertEqual(code.eval(globals_dict), 4)
+        code = compile_safe('[a for a in q][-1]')
+        self.assertEqual(code.eval(globals_dict), 3)
+        self.assertEqual(globals_dict['a'], 1)
+
+    def test_not_compiled(self):
+        for expr in ('', None, 'a +', '().__class__',
+                     '[x.__class__ for x in q]'):
+            self.assertEqual(compile_safe(expr), None)
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    mis_builder module for Odoo, Management Information System Builder
+#    Copyright (C) 2014-2015 ACSONE SA/NV (<http://acsone.eu>)
+#
+#    This file is a part of mis_builder
+#
+#    mis_builder is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License v3 or later
+#    as published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    mis_builder is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License v3 or later for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    v3 or later along with this program.
+#    If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+
+import unittest2
+
+from ..models.vectorized import numpy
+from ..models.vectorized import compile_vectorized, evaluate_vectorized
+
+
+class test_vectorized(unittest2.TestCase):
+
+    def test_compile_vectorized(self):
+        code, names = compile_vectorized('-(_aep_0 + a) / 2.5 % b // 3')
+        self.assertEqual(names, set(['_aep_0', 'a', 'b']))
+
+    def test_compile_not_vectorized(self):
+        for source in ('sum(a)',
+                       'a ** 2',
+                       'a if b else c',
+                       'a > b',
+                       'a.b',
+                       'a[0]',
+                       "'a'",
+                       '__import__',
+                       'a +',
+                       # integer results, such as 0 for 1 / 2
+                       '1 / 2',
+                       '7 // 2',
+                       'a * (1 / 2)',
+                       '-7 % 2 + a',
+                       '2'):
+            self.assertEqual(compile_vectorized(source), None)
+
+    @unittest2.skipIf(numpy is None, 'numpy is not installed')
+    def test_evaluate_vectorized(self):
+        code, names = compile_vectorized('a / b + 1')
+        res = evaluate_vectorized(code,
+                                  {'a': numpy.array([1.0, 1.0, 0.0]),
+                                   'b': numpy.array([2.0, 0.0, 0.0])},
+                                  3)
+        self.assertEqual(res, [1.5, None, None])
+        code, names = compile_vectorized('2.0')
+        self.assertEqual(evaluate_vectorized(code, {}, 2), [2.0, 2.0])
+        # integer constants with float operands
+        code, names = compile_vectorized('a / 2 + 7 // 2.0')
+        self.assertEqual(evaluate_vectorized(
+            code, {'a': numpy.array([1.0, 3.0])}, 2), [3.5, 4.5])
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    mis_builder module for Odoo, Management Information System Builder
+#    Copyright (C) 2014-2015 ACSONE SA/NV (<http://acsone.eu>)
+#
+#    This file is a part of mis_builder
+#
+#    mis_builder is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License v3 or later
+#    as published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    mis_builder is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License v3 or later for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    v3 or later along with this program.
+#    If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import unittest2
+
+from ..report.mis_builder_xlsx import XlsxStyles, get_sheet_name, \
+    write_instance_sheet, write_workbook, xlsxwriter
+
+
+class test_xlsx(unittest2.TestCase):
+
+    def test_get_sheet_name(self):
+        sheet_names = set()
+        self.assertEqual(get_sheet_name('a[b]:c*d?e/f\\g', sheet_names),
+                         'a_b__c_d_e_f_g')
+        self.assertEqual(get_sheet_name('', sheet_names), 'Sheet')
+        self.assertEqual(get_sheet_name(None, sheet_names), 'Sheet (2)')
+        # names are unique regardless of case
+        self.assertEqual(get_sheet_name('Report', sheet_names), 'Report')
+        self.assertEqual(get_sheet_name('report', sheet_names),
+                         'report (2)')
+        self.assertEqual(get_sheet_name('REPORT', sheet_names),
+                         'REPORT (3)')
+        # and at most 31 characters long
+        self.assertEqual(get_sheet_name('x' * 40, sheet_names), 'x' * 31)
+        self.assertEqual(get_sheet_name('x' * 40, sheet_names),
+                         'x' * 27 + ' (2)')
+
+    @unittest2.skipIf(xlsxwriter is None, 'xlsxwriter is not installed')
+    def test_num_formats(self):
+        def write(workbook):
+            styles = XlsxStyles(workbook)
+            num_format = styles.get_num_format(2, 'EUR', False)
+            self.assertIs(styles.get_num_format(2, 'EUR', False),
+                          num_format)
+            self.assertIsNot(styles.get_num_format(2, 'EUR', True),
+                             num_format)
+            self.assertIsNot(styles.get_num_format(0, 'EUR', False),
+                             num_format)
+            self.assertEqual(len(styles._num_formats), 3)
+        write_workbook(write)
+
+    @unittest2.skipIf(xlsxwriter is None, 'xlsxwriter is not installed')
+    def test_write_instance_sheet(self):
+        data = {
+            'header': [{'kpi_name': '',
+                        'cols': [{'name': 'p%d' % i, 'date': '07/31/2014'}
+                                 for i in range(3)]}],
+            'content': [{'kpi_name': 'kpi %d' % i,
+                         'cols': [{'val': i * 10.0 + j, 'dp': i % 2,
+                                   'suffix': 'EUR',
+                                   'is_percentage': False,
+                                   'val_r': '%s EUR' % (i * 10 + j)}
+                                  for j in range(2)] +
+                         [{'val': None, 'error': 'div0',
+                           'val_r': '#DIV/0'}]}
+                        for i in range(100)],
+        }
+
+        def write(workbook):
+            styles = XlsxStyles(workbook)
+            ws = write_instance_sheet(workbook, styles, 'Sheet', 'Title',
+                                      data)
+            self.assertEqual(ws.get_name(), 'Sheet')
+            # one number format per distinct rounding
+            self.assertEqual(len(styles._num_formats), 2)
+        content = write_workbook(write)
+        self.assertEqual(content[:2], b'PK')